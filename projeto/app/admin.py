@@ -42,7 +42,7 @@ class ClienteAdmin(admin.ModelAdmin):
 
 @admin.register(Loja)
 class LojaAdmin(admin.ModelAdmin):
-    list_display = ('nome', 'localizacao', 'lojista', 'nota', 'ativo', 'criacao', 'atualizacao')
+    list_display = ('nome', 'localizacao', 'lojista', 'nota', 'total_avaliacoes', 'ativo', 'criacao', 'atualizacao')
     search_fields = ('nome', 'localizacao', 'lojista__nome')
     filter_horizontal = ['categorias']
     filter_horizontal = ['avaliacoes']
@@ -0,0 +1,187 @@
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated, PermissionDenied
+from rest_framework.request import Request
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from . import cache, recomendacao
+from .cache import FAVORITOS, VALIDADOR, cache_respostas, calcular_etag, chave_resposta, etiquetas, marcar_validadores
+from .leitura import JSONRapidoRenderer, LeituraLoja, LeituraPesquisa, LeituraProduto
+from .models import Cliente, Loja, Produto
+from .views import dados_perfil, ids_pesquisa, ler_limite, ler_pagina_pesquisa
+
+
+# Modo ASGI (projeto/asgi.py sob uvicorn, ver gunicorn.conf.py). No ASGI o
+# Django roda cada view síncrona do DRF numa única thread por processo
+# (sync_to_async com thread_sensitive), uma requisição de cada vez, do início
+# ao fim. As leituras mais frequentes têm aqui variantes async, nos mesmos
+# endereços e com a mesma saída: autenticação, consultas pelo ORM assíncrono
+# (cada consulta é uma ida curta à thread do banco) e montagem e JSON no loop,
+# de modo que a thread do banco atende outras requisições no meio tempo.
+#
+# O DRF não tem views async; daqui ele só empresta as peças que não fazem
+# consultas: Request (query_params, ?fields=), a montagem dos querysets das
+# ViewSets, a paginação e as exceções. O resto de cada endereço (escrita,
+# OPTIONS) continua na view síncrona. As respostas são sempre JSON, sem a
+# API navegável.
+#
+# Só é usado com settings.VIEWS_ASSINCRONAS (ligado pelo projeto/asgi.py): no
+# WSGI cada view async precisaria de um loop próprio por requisição.
+
+_jwt = JWTAuthentication()
+
+
+async def autenticar(request):
+    # Mesma ordem de REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES']: sessão, depois JWT
+    user = await request.auser()
+    if user.is_authenticated:
+        return user
+    cabecalho = _jwt.get_header(request)
+    token = _jwt.get_raw_token(cabecalho) if cabecalho is not None else None
+    if token is None:
+        return None
+    # a busca do usuário (ativo, token revogado) é a do simplejwt, numa ida à thread do banco
+    return await sync_to_async(_jwt.get_user)(_jwt.get_validated_token(token))
+
+
+def resposta_json(dados, status_code=status.HTTP_200_OK):
+    resposta = HttpResponse(JSONRapidoRenderer().render(dados), status=status_code, content_type='application/json')
+    patch_vary_headers(resposta, ('Accept', ))
+    return resposta
+
+
+def resposta_erro(erro):
+    # Como o exception_handler do DRF; sem WWW-Authenticate (a sessão vem
+    # primeiro), falhas de autenticação são 403
+    if isinstance(erro, (NotAuthenticated, AuthenticationFailed)):
+        erro.status_code = status.HTTP_403_FORBIDDEN
+    dados = erro.detail if isinstance(erro.detail, (list, dict)) else {'detail': erro.detail}
+    return resposta_json(dados, erro.status_code)
+
+
+def assincrona(sincrona):
+    # View async para os GETs de um endereço; os demais métodos seguem para a
+    # view síncrona `sincrona`, como no modo WSGI
+    def decorar(funcao):
+        @csrf_exempt
+        async def view(request, *args, **kwargs):
+            if request.method != 'GET':
+                return await sync_to_async(sincrona)(request, *args, **kwargs)
+            try:
+                user = await autenticar(request)
+                if user is None:
+                    raise NotAuthenticated()
+                requisicao = Request(request)
+                requisicao.user = user
+                return await funcao(requisicao, *args, **kwargs)
+            except APIException as erro:
+                return resposta_erro(erro)
+        view.sincrona = sincrona
+        return view
+    return decorar
+
+
+async def _no_cache(funcao, *args):
+    # o backend local é memória do processo; o 'django' (ex.: Redis) vai à rede
+    if cache.configuracao()['BACKEND'] == 'local':
+        return funcao(*args)
+    return await sync_to_async(funcao)(*args)
+
+
+def listagem(viewset):
+    # GET da listagem de uma ViewSet com LeituraRapidaMixin e os mixins de
+    # app/cache.py: as mesmas entradas no cache de respostas e os mesmos ETags
+    @assincrona(viewset.as_view({'get': 'list', 'post': 'create'}))
+    async def view(request):
+        ferramentas = viewset(request=request, args=(), kwargs={}, action='list', format_kwarg=None)
+        model = ferramentas.model_cache()
+        usuario = request.user if ferramentas.por_usuario() else None
+
+        chave = None
+        if cache_respostas.ativo():
+            chave, nomes = chave_resposta(request, 'json', etiquetas(model), usuario)
+            achou, guardado, versoes = await _no_cache(cache_respostas.obter, chave, nomes)
+            if achou:
+                dados, validadores = guardado
+                if validadores is None:
+                    return resposta_json(dados)
+                etag, ultima = validadores
+                resposta = get_conditional_response(request, etag=etag, last_modified=ultima)
+                return marcar_validadores(resposta or resposta_json(dados), etag, ultima)
+
+        queryset = ferramentas.filter_queryset(ferramentas.get_queryset())
+        validador = await queryset.order_by().aaggregate(**VALIDADOR)
+        partes = [validador['ultima'], validador['total']]
+        if usuario is not None:
+            validador = await FAVORITOS[model].objects.filter(cliente__user=usuario).aaggregate(**VALIDADOR)
+            partes += [validador['ultima'], validador['total']]
+        etag = calcular_etag(request, 'json', partes)
+
+        resposta = get_conditional_response(request, etag=etag)
+        if resposta is None:
+            leitura, paginador = ferramentas.leitura, ferramentas.paginator
+            campos = leitura.nomes(request)
+            pagina = await paginador.apaginate_queryset(leitura.valores(queryset, campos), request)
+            dados = {'next': paginador.get_next_link(), 'results': await leitura.amontar(pagina, request, campos)}
+            resposta = resposta_json(dados)
+        marcar_validadores(resposta, etag, None)
+        if chave is not None and resposta.status_code == status.HTTP_200_OK:
+            await _no_cache(cache_respostas.guardar, chave, versoes, (dados, resposta.validadores))
+        return resposta
+    return view
+
+
+def recomendados(sincrona, tipo, leitura, queryset):
+    # Top-K pré-calculado do cliente (app/recomendacao.py), só os itens ativos
+    @assincrona(sincrona)
+    async def view(request):
+        limite = ler_limite(request)
+        if limite is None:
+            return resposta_json(
+                {"detail": "Parâmetro 'limite' deve ser inteiro."}, status.HTTP_400_BAD_REQUEST
+            )
+        cliente = await Cliente.objects.filter(user=request.user).afirst()
+        if cliente is None:
+            raise PermissionDenied('Recomendações são só para clientes.')
+        ids = await sync_to_async(recomendacao.recomendados)(cliente, tipo, limite)
+        return resposta_json(await leitura.apor_ids(ids, request, queryset))
+    return view
+
+
+def pesquisa(sincrona):
+    @assincrona(sincrona)
+    async def view(request):
+        pagina = ler_pagina_pesquisa(request)
+        if pagina is None:
+            return resposta_json(
+                {"detail": "Parâmetros 'limite' e 'cursor' devem ser inteiros."}, status.HTTP_400_BAD_REQUEST
+            )
+        # o índice em memória é remontado do banco de tempos em tempos
+        ids_lojas, ids_produtos, proximo = await sync_to_async(ids_pesquisa)(
+            request.query_params.get('nome', ''), *pagina
+        )
+        return resposta_json({
+            'lojas': await LeituraPesquisa().apor_ids(ids_lojas, request),
+            'produtos': await LeituraProduto().apor_ids(ids_produtos, request),
+            'proximo_cursor': proximo,
+        })
+    return view
+
+
+def perfil(sincrona):
+    # ClienteSerializer e LojistaSerializer, com as relações aninhadas: tudo numa ida à thread do banco
+    @assincrona(sincrona)
+    async def view(request):
+        return resposta_json(await sync_to_async(dados_perfil)(request))
+    return view
+
+
+def lojas_recomendadas(sincrona):
+    return recomendados(sincrona, 'loja', LeituraLoja(), Loja.objects.filter(ativo=True))
+
+
+def produtos_recomendados(sincrona):
+    return recomendados(sincrona, 'produto', LeituraProduto(), Produto.objects.filter(ativo=True))
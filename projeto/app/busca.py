@@ -0,0 +1,334 @@
+import heapq
+import math
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+from .models import Loja, Produto, Categoria
+
+
+# Motor de busca da /api/pesquisa/: índice invertido em memória sobre lojas e
+# produtos, com normalização de texto em português e ranking BM25.
+# O índice é montado sob demanda na primeira busca e atualizado pelos signals
+# de Loja, Produto e Categoria (ver app/signals.py).
+
+STOPWORDS = frozenset('''
+    a o as os um uma uns umas de da do das dos e em no na nos nas para por
+    com sem que se ao aos ou mais muito
+'''.split())
+
+# Peso de cada campo, aplicado como repetição dos termos no documento
+PESOS = {
+    'nome': 3,
+    'categorias': 2,
+    'descricao': 1,
+    'composicao': 1,
+    'cor': 1,
+}
+
+_PALAVRA = re.compile(r'[a-z0-9]+')
+
+
+def _sem_acentos(texto):
+    decomposto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in decomposto if not unicodedata.combining(c))
+
+
+def radical(palavra):
+    # Stemming leve: reduz plurais e a vogal final (bonitas -> bonit, bonito -> bonit)
+    if len(palavra) <= 3 or palavra.isdigit():
+        return palavra
+    for sufixo, troca in (('oes', 'ao'), ('aes', 'ao'), ('ais', 'al'), ('eis', 'el'),
+                          ('ois', 'ol'), ('eus', 'eu'), ('ns', 'm'), ('res', 'r'), ('zes', 'z')):
+        if palavra.endswith(sufixo):
+            palavra = palavra[:-len(sufixo)] + troca
+            break
+    else:
+        if palavra.endswith('s') and not palavra.endswith(('ss', 'us', 'is')):
+            palavra = palavra[:-1]
+    if len(palavra) > 4 and palavra[-1] in 'aoe':
+        palavra = palavra[:-1]
+    return palavra
+
+
+def normalizar(texto):
+    if not texto:
+        return []
+    palavras = _PALAVRA.findall(_sem_acentos(texto).lower())
+    return [radical(p) for p in palavras if p not in STOPWORDS]
+
+
+class IndiceInvertido:
+    # Postings por termo (documento -> frequência) e tamanho de cada documento.
+    # Para buscas com limite, cada termo também mantém suas postings ordenadas
+    # pela contribuição ao BM25 (impacto), o que permite parar a varredura assim
+    # que nenhum documento ainda não visto consegue entrar no top-k.
+
+    # variação do tamanho médio dos documentos que invalida as listas de impacto
+    TOLERANCIA_MEDIA = 0.05
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)
+        self.tamanhos = {}
+        self.termos_doc = {}
+        self.soma_tamanhos = 0
+        self._vocabulario = None
+        self._impactos = {}
+        self._media = None
+
+    def __len__(self):
+        return len(self.tamanhos)
+
+    def adicionar(self, doc, termos):
+        self.remover(doc)
+        frequencias = Counter(termos)
+        for termo, frequencia in frequencias.items():
+            if termo not in self.postings:
+                self._vocabulario = None
+            self.postings[termo][doc] = frequencia
+            self._impactos.pop(termo, None)
+        self.termos_doc[doc] = tuple(frequencias)
+        self.tamanhos[doc] = len(termos)
+        self.soma_tamanhos += len(termos)
+
+    def remover(self, doc):
+        tamanho = self.tamanhos.pop(doc, None)
+        if tamanho is None:
+            return
+        self.soma_tamanhos -= tamanho
+        for termo in self.termos_doc.pop(doc):
+            del self.postings[termo][doc]
+            self._impactos.pop(termo, None)
+            if not self.postings[termo]:
+                del self.postings[termo]
+                self._vocabulario = None
+
+    def expandir(self, termo, limite=20):
+        # Termos do vocabulário que começam com o termo buscado (busca enquanto digita)
+        if self._vocabulario is None:
+            self._vocabulario = sorted(self.postings)
+        inicio = bisect_left(self._vocabulario, termo)
+        encontrados = []
+        for candidato in self._vocabulario[inicio:inicio + limite]:
+            if not candidato.startswith(termo):
+                break
+            encontrados.append(candidato)
+        return encontrados
+
+    def buscar(self, termos, limite=None):
+        if not self.tamanhos:
+            return []
+        self._atualizar_media()
+
+        total = len(self.tamanhos)
+        listas = []
+        for termo in set(termos):
+            for expandido in self.expandir(termo):
+                # termos só completados por prefixo pesam metade
+                peso = 1.0 if expandido == termo else 0.5
+                docs = self.postings[expandido]
+                idf = math.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+                listas.append((peso * idf, expandido))
+
+        if limite is None:
+            pontuacao = defaultdict(float)
+            for peso, termo in listas:
+                for doc, frequencia in self.postings[termo].items():
+                    pontuacao[doc] += peso * self._contribuicao(frequencia, doc)
+            return sorted(pontuacao, key=lambda doc: (-pontuacao[doc], doc))
+        return self._top_k(listas, limite)
+
+    def _top_k(self, listas, limite):
+        # Algoritmo do limiar (Fagin): percorre as listas de impacto em paralelo e
+        # para quando o k-ésimo melhor já supera o máximo possível de quem falta
+        impactos = [self._lista_impacto(termo) for _, termo in listas]
+        posicoes = [0] * len(listas)
+        vistos = set()
+        melhores = []  # heap mínimo de (pontuação, -doc)
+
+        while True:
+            avancou = False
+            for i, (_, termo) in enumerate(listas):
+                if posicoes[i] >= len(impactos[i]):
+                    continue
+                _, doc = impactos[i][posicoes[i]]
+                posicoes[i] += 1
+                avancou = True
+                if doc in vistos:
+                    continue
+                vistos.add(doc)
+                pontuacao = sum(
+                    peso * self._contribuicao(self.postings[t][doc], doc)
+                    for peso, t in listas if doc in self.postings[t]
+                )
+                item = (pontuacao, -doc)
+                if len(melhores) < limite:
+                    heapq.heappush(melhores, item)
+                elif item > melhores[0]:
+                    heapq.heapreplace(melhores, item)
+
+            if not avancou:
+                break
+            limiar = sum(
+                peso * impactos[i][posicoes[i]][0]
+                for i, (peso, _) in enumerate(listas) if posicoes[i] < len(impactos[i])
+            )
+            if len(melhores) >= limite and melhores[0][0] >= limiar:
+                break
+
+        return [-doc for _, doc in sorted(melhores, reverse=True)]
+
+    def _contribuicao(self, frequencia, doc):
+        norma = self.k1 * (1 - self.b + self.b * self.tamanhos[doc] / self._media)
+        return frequencia * (self.k1 + 1) / (frequencia + norma)
+
+    def _lista_impacto(self, termo):
+        lista = self._impactos.get(termo)
+        if lista is None:
+            lista = sorted(
+                ((self._contribuicao(f, doc), doc) for doc, f in self.postings[termo].items()),
+                key=lambda item: (-item[0], item[1]),
+            )
+            self._impactos[termo] = lista
+        return lista
+
+    def _atualizar_media(self):
+        # As listas de impacto dependem do tamanho médio; só são refeitas quando
+        # ele muda além da tolerância, e até lá a média antiga é usada em tudo
+        media = self.soma_tamanhos / len(self.tamanhos) or 1
+        if self._media is None or abs(media / self._media - 1) > self.TOLERANCIA_MEDIA:
+            self._media = media
+            self._impactos.clear()
+
+
+def documentos(tipo, ids=None):
+    # (pk, termos) de cada loja ou produto, com os termos repetidos pelo PESOS do campo
+    model = Loja if tipo == 'loja' else Produto
+    campos = ['nome', 'descricao'] if tipo == 'loja' else ['nome', 'descricao', 'composicao', 'cor']
+    queryset = model.objects.all()
+    if ids is not None:
+        queryset = queryset.filter(pk__in=ids)
+
+    through = model.categorias.through
+    coluna = through._meta.get_field(model._meta.model_name).attname
+    categorias = dict(Categoria.objects.values_list('pk', 'nome'))
+    nomes_categorias = defaultdict(list)
+    relacoes = through.objects.filter(**{f'{coluna}__in': queryset.values('pk')})
+    for pk, categoria_id in relacoes.values_list(coluna, 'categoria_id').iterator():
+        nomes_categorias[pk].append(categorias.get(categoria_id, ''))
+
+    for linha in queryset.values('pk', *campos).iterator():
+        termos = []
+        for campo in campos:
+            termos.extend(normalizar(linha[campo]) * PESOS[campo])
+        for nome in nomes_categorias[linha['pk']]:
+            termos.extend(normalizar(nome) * PESOS['categorias'])
+        yield linha['pk'], termos
+
+
+class MotorBusca:
+    # Os índices são lidos e alterados sob `_trava`; a montagem periódica lê o
+    # banco fora dela (ver _garantir_indices)
+
+    def __init__(self):
+        self._trava = threading.RLock()
+        self._montagem = threading.Lock()
+        self._indices = None
+        self._montado_em = 0
+        self._geracao = 0
+        # alterações recebidas durante uma montagem, para repetir no índice novo
+        self._pendentes = None
+
+    def limpar(self):
+        with self._trava:
+            self._indices = None
+            self._geracao += 1
+
+    def buscar(self, tipo, texto, limite=None):
+        termos = normalizar(texto)
+        indices = self._garantir_indices()
+        with self._trava:
+            return indices[tipo].buscar(termos, limite)
+
+    def reindexar(self, tipo, ids):
+        if self._indices is None and self._pendentes is None:
+            return
+        atuais = dict(documentos(tipo, ids))
+        with self._trava:
+            if self._pendentes is not None:
+                self._pendentes.append(('reindexar', tipo, ids))
+            if self._indices is not None:
+                _aplicar(self._indices[tipo], ids, atuais)
+
+    def remover(self, tipo, ids):
+        with self._trava:
+            if self._pendentes is not None:
+                self._pendentes.append(('remover', tipo, ids))
+            if self._indices is not None:
+                for pk in ids:
+                    self._indices[tipo].remover(pk)
+
+    def _valido(self):
+        validade = getattr(settings, 'BUSCA_REMONTAR_SEGUNDOS', 300)
+        return self._indices is not None and time.monotonic() - self._montado_em <= validade
+
+    def _garantir_indices(self):
+        # Outros processos (workers do gunicorn) não recebem os signals deste,
+        # então o índice é remontado periodicamente. Uma thread monta os
+        # índices novos lendo o banco fora da trava, enquanto as demais seguem
+        # buscando nos anteriores (só esperam se ainda não há nenhum), e os
+        # troca depois de repetir neles as alterações recebidas no meio tempo
+        with self._trava:
+            if self._valido():
+                return self._indices
+        if not self._montagem.acquire(blocking=False):
+            with self._trava:
+                if self._indices is not None:
+                    return self._indices
+            self._montagem.acquire()
+        try:
+            with self._trava:
+                if self._valido():
+                    return self._indices
+                self._pendentes, geracao = [], self._geracao
+            indices = {'loja': IndiceInvertido(), 'produto': IndiceInvertido()}
+            for tipo, indice in indices.items():
+                for pk, termos in documentos(tipo):
+                    indice.adicionar(pk, termos)
+            while True:
+                with self._trava:
+                    pendentes, self._pendentes = self._pendentes, []
+                    if not pendentes:
+                        self._pendentes = None
+                        self._indices = indices
+                        # com um limpar() no meio, a leitura pode ser anterior a ele
+                        self._montado_em = time.monotonic() if geracao == self._geracao else 0
+                        return indices
+                for operacao, tipo, ids in pendentes:
+                    if operacao == 'reindexar':
+                        _aplicar(indices[tipo], ids, dict(documentos(tipo, ids)))
+                    else:
+                        for pk in ids:
+                            indices[tipo].remover(pk)
+        finally:
+            with self._trava:
+                self._pendentes = None
+            self._montagem.release()
+
+
+def _aplicar(indice, ids, atuais):
+    for pk in ids:
+        if pk in atuais:
+            indice.adicionar(pk, atuais[pk])
+        else:
+            indice.remover(pk)
+
+
+motor = MotorBusca()
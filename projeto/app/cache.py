@@ -0,0 +1,351 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from .models import Loja, Produto, LojaFavorita, ProdutoFavorito
+
+
+# Cache das respostas de leitura do catálogo (list/retrieve de lojas, produtos,
+# categorias, setores e mapas). Cada resposta guardada leva etiquetas:
+#   'loja'              qualquer listagem de lojas
+#   'loja:5'            o detalhe da loja 5
+#   'favoritos:<user>'  respostas com o campo favoritado, que variam por usuário
+# Os signals (app/signals.py) invalidam as etiquetas dos objetos alterados.
+# A invalidação é por versão: cada etiqueta tem uma versão, a entrada guarda as
+# versões que viu ao ser gravada e deixa de valer quando alguma delas muda.
+#
+# Configuração (settings.CACHE_RESPOSTAS):
+#   ATIVO       liga/desliga o cache
+#   BACKEND     'local' (LRU em memória do processo) ou 'django' (um cache de settings.CACHES)
+#   ALIAS       cache do Django usado pelo backend 'django'
+#   CAPACIDADE  entradas máximas do backend local
+#   TTL         segundos de validade de cada resposta
+#
+# Com o backend local cada worker tem o próprio cache e só recebe as
+# invalidações feitas nele; o TTL limita por quanto tempo outro worker pode
+# servir um dado antigo. O backend 'django' (ex.: Redis) é compartilhado.
+#
+# RespostaCondicionalMixin, no fim do arquivo, responde 304 aos GETs
+# condicionais com ETags tirados de `atualizacao`. Os validadores são guardados
+# junto com a resposta, então um acerto no cache também responde 304 sem banco.
+
+PADRAO = {
+    'ATIVO': True,
+    'BACKEND': 'local',
+    'ALIAS': 'default',
+    'CAPACIDADE': 2000,
+    'TTL': 60,
+}
+
+# presente em todas as entradas; invalidá-la esvazia o cache
+TODAS = 'todas'
+
+
+def configuracao():
+    return {**PADRAO, **getattr(settings, 'CACHE_RESPOSTAS', {})}
+
+
+def etiquetas(model, pks=()):
+    nome = model._meta.model_name
+    return {nome} | {f'{nome}:{pk}' for pk in pks if pk is not None}
+
+
+class BackendLocal:
+
+    def __init__(self, capacidade, ttl):
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self._entradas = OrderedDict()
+        self._versoes = {}
+        self._trava = threading.Lock()
+        self.contadores = {'despejadas': 0, 'expiradas': 0}
+
+    def ler(self, chave, nomes):
+        with self._trava:
+            item = self._entradas.get(chave)
+            if item is not None and item[0] <= time.monotonic():
+                del self._entradas[chave]
+                self.contadores['expiradas'] += 1
+                item = None
+            if item is not None:
+                self._entradas.move_to_end(chave)
+            versoes = {nome: self._versoes.get(nome, 0) for nome in nomes}
+            return (item[1] if item else None), versoes
+
+    def gravar(self, chave, entrada):
+        with self._trava:
+            self._entradas[chave] = (time.monotonic() + self.ttl, entrada)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.capacidade:
+                self._entradas.popitem(last=False)
+                self.contadores['despejadas'] += 1
+
+    def remover(self, chave):
+        with self._trava:
+            self._entradas.pop(chave, None)
+
+    def invalidar(self, nomes):
+        with self._trava:
+            for nome in nomes:
+                self._versoes[nome] = self._versoes.get(nome, 0) + 1
+
+    def estatisticas(self):
+        with self._trava:
+            return {**self.contadores, 'entradas': len(self._entradas), 'capacidade': self.capacidade}
+
+
+class BackendDjango:
+    # As versões ficam no próprio cache, sem expiração. São valores aleatórios,
+    # e não contadores, para que uma versão despejada pelo servidor de cache não
+    # volte a um valor que alguma entrada antiga já tenha visto.
+
+    prefixo = 'respostas'
+
+    def __init__(self, alias, ttl):
+        self.cache = caches[alias]
+        self.ttl = ttl
+
+    def ler(self, chave, nomes):
+        chaves = {self._chave_etiqueta(nome): nome for nome in nomes}
+        valores = self.cache.get_many([self._chave(chave), *chaves])
+        versoes = {}
+        for chave_etiqueta, nome in chaves.items():
+            versao = valores.get(chave_etiqueta)
+            if versao is None:
+                versao = uuid.uuid4().hex
+                if not self.cache.add(chave_etiqueta, versao, timeout=None):
+                    versao = self.cache.get(chave_etiqueta)
+            versoes[nome] = versao
+        return valores.get(self._chave(chave)), versoes
+
+    def gravar(self, chave, entrada):
+        self.cache.set(self._chave(chave), entrada, self.ttl)
+
+    def remover(self, chave):
+        self.cache.delete(self._chave(chave))
+
+    def invalidar(self, nomes):
+        self.cache.set_many({self._chave_etiqueta(nome): uuid.uuid4().hex for nome in nomes}, timeout=None)
+
+    def estatisticas(self):
+        return {}
+
+    def _chave(self, chave):
+        return f'{self.prefixo}:{chave}'
+
+    def _chave_etiqueta(self, nome):
+        return f'{self.prefixo}:etiqueta:{nome}'
+
+
+class CacheRespostas:
+
+    def __init__(self):
+        self._trava = threading.Lock()
+        self._backend = None
+        self._config = None
+        self.contadores = {'acertos': 0, 'faltas': 0, 'invalidadas': 0}
+
+    def ativo(self):
+        return configuracao()['ATIVO']
+
+    def obter(self, chave, nomes):
+        # Devolve (achou, dados, versões); as versões são as lidas antes de
+        # montar a resposta e devem ser passadas a guardar()
+        nomes = {*nomes, TODAS}
+        entrada, versoes = self.backend().ler(chave, nomes)
+        if entrada is not None and entrada[0] == versoes:
+            self._contar('acertos')
+            return True, entrada[1], versoes
+        if entrada is not None:
+            self._contar('invalidadas')
+            self.backend().remover(chave)
+        self._contar('faltas')
+        return False, None, versoes
+
+    def guardar(self, chave, versoes, dados):
+        self.backend().gravar(chave, (versoes, dados))
+
+    def invalidar(self, nomes):
+        nomes = set(nomes)
+        if not nomes or not self.ativo():
+            return
+        self.backend().invalidar(nomes)
+        # de novo após o commit: uma leitura concorrente pode ter gravado o
+        # estado anterior com as versões novas antes da transação terminar
+        transaction.on_commit(lambda: self.backend().invalidar(nomes))
+
+    def limpar(self):
+        self.backend().invalidar({TODAS})
+
+    def estatisticas(self):
+        config = configuracao()
+        with self._trava:
+            dados = dict(self.contadores)
+        consultas = dados['acertos'] + dados['faltas']
+        dados['taxa_acertos'] = round(dados['acertos'] / consultas, 4) if consultas else None
+        dados['backend'] = config['BACKEND']
+        dados['ttl'] = config['TTL']
+        dados.update(self.backend().estatisticas())
+        return dados
+
+    def backend(self):
+        # Recriado quando a configuração muda (override_settings nos testes)
+        config = configuracao()
+        with self._trava:
+            if self._backend is None or config != self._config:
+                if config['BACKEND'] == 'django':
+                    self._backend = BackendDjango(config['ALIAS'], config['TTL'])
+                else:
+                    self._backend = BackendLocal(config['CAPACIDADE'], config['TTL'])
+                self._config = config
+            return self._backend
+
+    def _contar(self, contador):
+        with self._trava:
+            self.contadores[contador] += 1
+
+
+cache_respostas = CacheRespostas()
+
+
+class RecursoMixin:
+
+    def model_cache(self):
+        return self.get_serializer_class().Meta.model
+
+    def pk_da_url(self):
+        valor = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            return self.model_cache()._meta.pk.to_python(valor)
+        except ValidationError:
+            return None
+
+    def por_usuario(self):
+        # o campo favoritado muda a resposta de um usuário para outro
+        if 'favoritado' not in self.get_serializer_class()._declared_fields:
+            return False
+        campos = self.request.query_params.get('fields')
+        return not campos or 'favoritado' in {nome.strip() for nome in campos.split(',')}
+
+
+class CacheRespostaMixin(RecursoMixin):
+    # list e retrieve de ViewSets servidos do cache. Autenticação e permissões
+    # rodam antes (em initial()), então o cache não as contorna. Serializers com
+    # o campo favoritado geram uma resposta por usuário.
+
+    def list(self, request, *args, **kwargs):
+        return self.resposta_em_cache(etiquetas(self.model_cache()), super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = self.pk_da_url()
+        if pk is None:
+            return super().retrieve(request, *args, **kwargs)
+        nome = self.model_cache()._meta.model_name
+        return self.resposta_em_cache({f'{nome}:{pk}'}, super().retrieve, request, *args, **kwargs)
+
+    def resposta_em_cache(self, nomes, gerar, request, *args, **kwargs):
+        if not cache_respostas.ativo():
+            return gerar(request, *args, **kwargs)
+
+        usuario = request.user if self.por_usuario() else None
+        chave, nomes = chave_resposta(request, request.accepted_renderer.format, nomes, usuario)
+
+        achou, guardado, versoes = cache_respostas.obter(chave, nomes)
+        if achou:
+            dados, validadores = guardado
+            if validadores is None:
+                return Response(dados)
+            return responder_condicional(request, *validadores, lambda: Response(dados))
+        resposta = gerar(request, *args, **kwargs)
+        if resposta.status_code == 200:
+            cache_respostas.guardar(chave, versoes, (resposta.data, getattr(resposta, 'validadores', None)))
+        return resposta
+
+
+def chave_resposta(request, formato, nomes, usuario=None):
+    # Chave da resposta no cache e as etiquetas dela; com usuário, uma por usuário
+    partes = [request.build_absolute_uri(), formato]
+    if usuario is not None:
+        partes.append(str(usuario.pk))
+        nomes = {*nomes, f'favoritos:{usuario.pk}'}
+    return hashlib.sha1('|'.join(partes).encode()).hexdigest(), nomes
+
+
+FAVORITOS = {
+    Loja: LojaFavorita,
+    Produto: ProdutoFavorito,
+}
+
+# max(atualizacao) e contagem, de onde saem os ETags
+VALIDADOR = {'ultima': Max('atualizacao'), 'total': Count('pk')}
+
+
+class RespostaCondicionalMixin(RecursoMixin):
+    # GET condicional (If-None-Match / If-Modified-Since) com validadores
+    # calculados sem serializar: listagens usam max(atualizacao) + contagem do
+    # queryset filtrado (a contagem percebe exclusões) e detalhes a `atualizacao`
+    # da linha. Respostas com favoritado somam os favoritos do usuário.
+    # Last-Modified só nos detalhes: numa listagem o máximo não muda ao excluir.
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset()).order_by()
+        validador = queryset.aggregate(**VALIDADOR)
+        partes = [validador['ultima'], validador['total']]
+        return self.resposta_condicional(partes, None, super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = self.pk_da_url()
+        atualizacao = None
+        if pk is not None:
+            queryset = self.filter_queryset(self.get_queryset()).filter(pk=pk)
+            atualizacao = queryset.values_list('atualizacao', flat=True).first()
+        if atualizacao is None:
+            return super().retrieve(request, *args, **kwargs)
+        return self.resposta_condicional([atualizacao], atualizacao, super().retrieve, request, *args, **kwargs)
+
+    def resposta_condicional(self, partes, ultima, gerar, request, *args, **kwargs):
+        if self.por_usuario():
+            favoritos = FAVORITOS[self.model_cache()].objects.filter(cliente__user=request.user)
+            validador = favoritos.aggregate(**VALIDADOR)
+            partes = [*partes, validador['ultima'], validador['total']]
+            if ultima is not None and validador['ultima'] is not None:
+                ultima = max(ultima, validador['ultima'])
+
+        etag = calcular_etag(request, request.accepted_renderer.format, partes)
+        ultima = int(ultima.timestamp()) if ultima is not None else None
+        return responder_condicional(request, etag, ultima, lambda: gerar(request, *args, **kwargs))
+
+
+def calcular_etag(request, formato, partes):
+    texto = '|'.join(str(parte) for parte in [request.build_absolute_uri(), formato, *partes])
+    return '"%s"' % hashlib.sha1(texto.encode()).hexdigest()
+
+
+def responder_condicional(request, etag, ultima, gerar):
+    # 304 (ou 412) se os validadores batem com o pedido; senão gera a resposta
+    resposta = get_conditional_response(request, etag=etag, last_modified=ultima)
+    if resposta is None:
+        resposta = gerar()
+    return marcar_validadores(resposta, etag, ultima)
+
+
+def marcar_validadores(resposta, etag, ultima):
+    if resposta.status_code in (200, 304):
+        resposta.headers['ETag'] = etag
+        if ultima is not None:
+            resposta.headers['Last-Modified'] = http_date(ultima)
+        # o cliente guarda a resposta, mas sempre revalida
+        patch_cache_control(resposta, private=True, no_cache=True)
+        resposta.validadores = (etag, ultima)
+    return resposta
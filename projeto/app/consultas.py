@@ -0,0 +1,82 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+from .models import Loja
+
+
+# Planejamento de consultas: a partir dos campos declarados no serializer,
+# decide quais relações precisam de select_related/prefetch_related para que
+# uma listagem custe um número constante de queries.
+
+def planejar_queryset(queryset, serializer):
+    if isinstance(serializer, type):
+        serializer = serializer()
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+
+    model = queryset.model
+    select, prefetch = set(), []
+
+    for campo in serializer.fields.values():
+        if campo.write_only or campo.source == '*':
+            continue
+
+        relacao = _relacao(model, campo.source_attrs[0])
+        if relacao is None:
+            continue
+
+        if isinstance(campo, serializers.ManyRelatedField):
+            prefetch.append(Prefetch(campo.source, queryset=_queryset_de_ids(relacao)))
+        elif isinstance(campo, serializers.ListSerializer):
+            filho = queryset_base(relacao.related_model).order_by('pk')
+            prefetch.append(Prefetch(campo.source, queryset=planejar_queryset(filho, campo.child)))
+        elif isinstance(campo, serializers.BaseSerializer) or len(campo.source_attrs) > 1:
+            if relacao.many_to_one or relacao.one_to_one:
+                select.add(campo.source_attrs[0])
+
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
+
+
+def queryset_base(model):
+    return model._default_manager.all()
+
+
+def lojas_queryset(queryset=None, serializer=None):
+    # Todas as views que serializam Loja passam por aqui; a nota média já vem
+    # de Loja.nota/total_avaliacoes, sem agregação por requisição
+    from .serializers import LojaSerializer
+
+    base = queryset_base(Loja)
+    if queryset is not None:
+        base = base.filter(pk__in=queryset.values('pk'))
+    return planejar_queryset(base, serializer or LojaSerializer)
+
+
+def em_ordem(queryset, ids):
+    # Objetos do queryset na ordem dos ids (ex.: ranking da busca)
+    objetos = {obj.pk: obj for obj in queryset}
+    return [objetos[pk] for pk in ids if pk in objetos]
+
+
+def _relacao(model, nome):
+    try:
+        campo = model._meta.get_field(nome)
+    except FieldDoesNotExist:
+        return None
+    return campo if campo.is_relation else None
+
+
+def _queryset_de_ids(relacao):
+    # Só o necessário para o PrimaryKeyRelatedField: a pk e, nas relações
+    # reversas de FK, a coluna usada para ligar o resultado ao objeto pai.
+    # Em ordem de pk, a mesma da leitura rápida (app/leitura.py)
+    related = relacao.related_model
+    campos = [related._meta.pk.name]
+    if relacao.one_to_many:
+        campos.append(relacao.field.name)
+    return related._default_manager.only(*campos).order_by('pk')
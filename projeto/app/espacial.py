@@ -0,0 +1,185 @@
+import heapq
+import math
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+
+from .models import Loja, Mapas, PosicaoLoja
+
+
+# Índice espacial das lojas nos mapas: uma grade uniforme por mapa, montada em
+# memória a partir de PosicaoLoja na primeira consulta ao mapa. As células têm
+# em média POR_CELULA lojas, então as k mais próximas saem de poucas células
+# ao redor do ponto (busca em anéis, que para assim que nenhum anel seguinte
+# pode ter loja mais perto) e uma região lê só as células que ela cobre.
+#
+# As grades são descartadas pelos signals de PosicaoLoja, Loja e Mapas (ver
+# app/signals.py) e remontadas periodicamente, já que outros processos não
+# recebem os signals deste.
+#
+# Configuração (settings.ESPACIAL):
+#   POR_CELULA         lojas por célula, em média
+#   VIZINHOS           lojas próximas devolvidas por padrão
+#   MAXIMO_VIZINHOS    máximo de ?limite= nas lojas próximas
+#   MAXIMO_REGIAO      máximo de lojas numa região
+#   REMONTAR_SEGUNDOS  validade de uma grade
+
+PADRAO = {
+    'POR_CELULA': 2,
+    'VIZINHOS': 10,
+    'MAXIMO_VIZINHOS': 100,
+    'MAXIMO_REGIAO': 1000,
+    'REMONTAR_SEGUNDOS': 300,
+}
+
+Ponto = namedtuple('Ponto', 'loja nome x y setor categorias')
+
+
+def configuracao():
+    return {**PADRAO, **getattr(settings, 'ESPACIAL', {})}
+
+
+class Grade:
+
+    def __init__(self, pontos, por_celula=2):
+        self.pontos = pontos
+        self.celulas = defaultdict(list)
+        if not pontos:
+            self.x0 = self.y0 = 0
+            self.celula, self.colunas, self.linhas = 1.0, 1, 1
+            return
+
+        self.x0 = min(p.x for p in pontos)
+        self.y0 = min(p.y for p in pontos)
+        largura = max(p.x for p in pontos) - self.x0
+        altura = max(p.y for p in pontos) - self.y0
+        # área com ~por_celula pontos; o segundo termo cobre lojas todas numa linha
+        self.celula = max(
+            math.sqrt(largura * altura * por_celula / len(pontos)),
+            max(largura, altura) * por_celula / len(pontos),
+        ) or 1.0
+        self.colunas = int(largura // self.celula) + 1
+        self.linhas = int(altura // self.celula) + 1
+        for ponto in pontos:
+            self.celulas[self._celula(ponto.x, ponto.y)].append(ponto)
+
+    def __len__(self):
+        return len(self.pontos)
+
+    def _celula(self, x, y):
+        # célula do ponto, trazida para dentro da grade se ele está fora
+        coluna = min(max(int((x - self.x0) // self.celula), 0), self.colunas - 1)
+        linha = min(max(int((y - self.y0) // self.celula), 0), self.linhas - 1)
+        return coluna, linha
+
+    def proximas(self, x, y, k, aceita=None):
+        # [(ponto, distância)] das k lojas mais próximas de (x, y)
+        coluna, linha = self._celula(x, y)
+        melhores = []  # heap de (-distância², -loja, ponto)
+        ultimo_anel = max(coluna, self.colunas - 1 - coluna, linha, self.linhas - 1 - linha)
+        for anel in range(ultimo_anel + 1):
+            for celula in self._anel(coluna, linha, anel):
+                for ponto in self.celulas.get(celula, ()):
+                    if aceita and not aceita(ponto):
+                        continue
+                    item = (-((ponto.x - x) ** 2 + (ponto.y - y) ** 2), -ponto.loja, ponto)
+                    if len(melhores) < k:
+                        heapq.heappush(melhores, item)
+                    elif item[:2] > melhores[0][:2]:
+                        heapq.heapreplace(melhores, item)
+            # as lojas dos anéis seguintes estão a pelo menos anel * celula
+            if len(melhores) == k and -melhores[0][0] <= (anel * self.celula) ** 2:
+                break
+        return [(ponto, math.sqrt(-d)) for d, _, ponto in sorted(melhores, reverse=True)]
+
+    def _anel(self, coluna, linha, anel):
+        if anel == 0:
+            yield coluna, linha
+            return
+        for c in range(coluna - anel, coluna + anel + 1):
+            yield c, linha - anel
+            yield c, linha + anel
+        for l in range(linha - anel + 1, linha + anel):
+            yield coluna - anel, l
+            yield coluna + anel, l
+
+    def regiao(self, x0, y0, x1, y1, aceita=None):
+        # Pontos dentro do retângulo, em ordem de leitura (y, x)
+        x0, x1 = sorted((x0, x1))
+        y0, y1 = sorted((y0, y1))
+        coluna0, linha0 = self._celula(x0, y0)
+        coluna1, linha1 = self._celula(x1, y1)
+        dentro = [
+            ponto
+            for coluna in range(coluna0, coluna1 + 1)
+            for linha in range(linha0, linha1 + 1)
+            for ponto in self.celulas.get((coluna, linha), ())
+            if x0 <= ponto.x <= x1 and y0 <= ponto.y <= y1 and (not aceita or aceita(ponto))
+        ]
+        dentro.sort(key=lambda ponto: (ponto.y, ponto.x, ponto.loja))
+        return dentro
+
+
+def filtro(setor=None, categoria=None):
+    if setor is None and categoria is None:
+        return None
+    return lambda ponto: (
+        (setor is None or ponto.setor == setor)
+        and (categoria is None or categoria in ponto.categorias)
+    )
+
+
+class IndicePosicoes:
+
+    def __init__(self):
+        self._trava = threading.Lock()
+        self._grades = {}  # mapa -> (grade ou None se o mapa não existe, montada em)
+        self._mapas_da_loja = defaultdict(set)
+
+    def limpar(self):
+        with self._trava:
+            self._grades.clear()
+            self._mapas_da_loja.clear()
+
+    def invalidar_mapas(self, ids):
+        with self._trava:
+            for mapa in ids:
+                self._grades.pop(mapa, None)
+
+    def invalidar_lojas(self, ids):
+        with self._trava:
+            for loja in ids:
+                for mapa in self._mapas_da_loja.pop(loja, ()):
+                    self._grades.pop(mapa, None)
+
+    def grade(self, mapa):
+        # None se o mapa não existe
+        validade = configuracao()['REMONTAR_SEGUNDOS']
+        with self._trava:
+            guardada = self._grades.get(mapa)
+            if guardada is None or time.monotonic() - guardada[1] > validade:
+                guardada = self._grades[mapa] = (self._montar(mapa), time.monotonic())
+            return guardada[0]
+
+    def _montar(self, mapa):
+        if not Mapas.objects.filter(pk=mapa).exists():
+            return None
+        posicoes = list(
+            PosicaoLoja.objects.filter(mapa_id=mapa, ativo=True, loja__ativo=True)
+            .values_list('loja_id', 'loja__nome', 'x', 'y', 'loja__setor_id')
+        )
+        categorias = defaultdict(set)
+        relacoes = Loja.categorias.through.objects.filter(loja_id__in=[posicao[0] for posicao in posicoes])
+        for loja, categoria in relacoes.values_list('loja_id', 'categoria_id'):
+            categorias[loja].add(categoria)
+
+        pontos = []
+        for loja, nome, x, y, setor in posicoes:
+            pontos.append(Ponto(loja, nome, x, y, setor, frozenset(categorias[loja])))
+            self._mapas_da_loja[loja].add(mapa)
+        return Grade(pontos, configuracao()['POR_CELULA'])
+
+
+indice_posicoes = IndicePosicoes()
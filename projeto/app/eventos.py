@@ -0,0 +1,174 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, close_old_connections
+
+from .models import AcaoUsuario, Loja, Produto
+
+logger = logging.getLogger(__name__)
+
+
+# Registro assíncrono de AcaoUsuario: a requisição só coloca a ação numa fila
+# em memória e uma thread de fundo grava os lotes com bulk_create.
+#
+# Configuração (settings.ACOES_FILA):
+#   TAMANHO_MAXIMO  ações pendentes antes de começar a descartar
+#   LOTE            ações por bulk_create
+#   INTERVALO       segundos máximos entre gravações
+#   ESPERA_MAXIMA   segundos que a requisição espera por espaço na fila cheia
+#   SINCRONO        grava direto na requisição (testes e scripts)
+
+PADRAO = {
+    'TAMANHO_MAXIMO': 10000,
+    'LOTE': 500,
+    'INTERVALO': 1.0,
+    'ESPERA_MAXIMA': 0.005,
+    'SINCRONO': False,
+}
+
+
+def configuracao():
+    return {**PADRAO, **getattr(settings, 'ACOES_FILA', {})}
+
+
+class FilaAcoes:
+
+    def __init__(self, iniciar_trabalhador=True):
+        self.iniciar_trabalhador = iniciar_trabalhador
+        self._fila = None
+        self._trabalhador = None
+        self._parar = threading.Event()
+        self._trava = threading.Lock()
+        self._trava_gravacao = threading.Lock()
+        self.contadores = {'enfileiradas': 0, 'gravadas': 0, 'descartadas': 0, 'falhas': 0}
+
+    def registrar(self, usuario, acao, loja=None, produto=None, detalhes=''):
+        config = configuracao()
+        campos = {
+            'usuario_id': usuario.pk,
+            'acao': acao,
+            'loja_id': loja.pk if loja else None,
+            'produto_id': produto.pk if produto else None,
+            'detalhes': detalhes,
+        }
+        if config['SINCRONO']:
+            AcaoUsuario.objects.create(**campos)
+            return
+
+        fila = self._garantir_fila(config)
+        try:
+            # o timestamp é definido aqui, não na gravação do lote
+            fila.put(AcaoUsuario(**campos), timeout=config['ESPERA_MAXIMA'])
+        except queue.Full:
+            self._contar('descartadas')
+            return
+        self._contar('enfileiradas')
+
+    def esvaziar(self):
+        # Grava tudo que estiver pendente na thread atual
+        config = configuracao()
+        while self._fila is not None and not self._fila.empty():
+            self._gravar(self._retirar_lote(config['LOTE'], espera=0))
+
+    def encerrar(self, timeout=5):
+        self._parar.set()
+        if self._trabalhador is not None:
+            self._trabalhador.join(timeout)
+        self.esvaziar()
+
+    def estatisticas(self):
+        with self._trava:
+            dados = dict(self.contadores)
+        dados['pendentes'] = self._fila.qsize() if self._fila is not None else 0
+        return dados
+
+    def _garantir_fila(self, config):
+        if self._fila is None:
+            with self._trava:
+                if self._fila is None:
+                    self._fila = queue.Queue(maxsize=config['TAMANHO_MAXIMO'])
+                    if self.iniciar_trabalhador:
+                        self._trabalhador = threading.Thread(
+                            target=self._trabalhar, name='fila-acoes', daemon=True
+                        )
+                        self._trabalhador.start()
+                        atexit.register(self.encerrar)
+        return self._fila
+
+    def _trabalhar(self):
+        while not self._parar.is_set():
+            config = configuracao()
+            lote = self._retirar_lote(config['LOTE'], espera=config['INTERVALO'])
+            if lote:
+                self._gravar(lote)
+
+    def _retirar_lote(self, tamanho, espera):
+        # Junta até `tamanho` ações, esperando no máximo `espera` segundos
+        lote = []
+        limite = time.monotonic() + espera
+        while len(lote) < tamanho:
+            restante = limite - time.monotonic()
+            try:
+                if restante > 0:
+                    lote.append(self._fila.get(timeout=restante))
+                else:
+                    lote.append(self._fila.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _gravar(self, lote):
+        if not lote:
+            return
+        # a thread de fundo cuida da própria conexão, como faria uma requisição
+        em_segundo_plano = threading.current_thread() is self._trabalhador
+        with self._trava_gravacao:
+            if em_segundo_plano:
+                close_old_connections()
+            try:
+                gravadas = self._inserir(lote)
+            except Exception:
+                logger.exception('Falha ao gravar %d ações de usuário', len(lote))
+                self._contar('falhas', len(lote))
+            else:
+                self._contar('gravadas', gravadas)
+                if gravadas < len(lote):
+                    logger.warning('%d ação(ões) de usuário excluído descartada(s)', len(lote) - gravadas)
+                    self._contar('falhas', len(lote) - gravadas)
+            finally:
+                if em_segundo_plano:
+                    close_old_connections()
+
+    def _inserir(self, lote):
+        # Devolve quantas ações foram gravadas. Se um usuário, loja ou produto
+        # foi excluído depois que a ação entrou na fila, o lote inteiro falha:
+        # aplica o on_delete de AcaoUsuario (as ações do usuário são
+        # descartadas, loja e produto ficam nulos) e grava o restante
+        try:
+            AcaoUsuario.objects.bulk_create(lote)
+            return len(lote)
+        except IntegrityError:
+            pass
+        usuarios = set(User.objects.filter(pk__in={a.usuario_id for a in lote}).values_list('pk', flat=True))
+        lojas = set(Loja.objects.filter(pk__in={a.loja_id for a in lote}).values_list('pk', flat=True))
+        produtos = set(Produto.objects.filter(pk__in={a.produto_id for a in lote}).values_list('pk', flat=True))
+        validas = [acao for acao in lote if acao.usuario_id in usuarios]
+        for acao in validas:
+            if acao.loja_id not in lojas:
+                acao.loja_id = None
+            if acao.produto_id not in produtos:
+                acao.produto_id = None
+        AcaoUsuario.objects.bulk_create(validas)
+        return len(validas)
+
+    def _contar(self, contador, quantidade=1):
+        with self._trava:
+            self.contadores[contador] += quantidade
+
+
+fila_acoes = FilaAcoes()
@@ -0,0 +1,285 @@
+import base64
+import binascii
+import csv
+import heapq
+import io
+import json
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import AcaoUsuario, Avaliacao, TotemPessoal
+
+
+# Exportação em fluxo dos eventos brutos, sem serializers: as linhas saem de
+# values_list em lotes por keyset em (data, id), crescente, e cada lote é
+# formatado e enviado antes do próximo ser lido. A memória fica no tamanho de
+# um lote, seja qual for o tamanho da exportação, e nenhuma consulta fica
+# aberta entre os lotes.
+#
+# O cursor (base64 de "data|id" da última linha enviada) permite retomar uma
+# exportação interrompida de onde ela parou. Quem só tem o arquivo recebido
+# retoma com `depois`, "data,id" da última linha, nos campos da própria linha.
+# As ações incluem os meses já movidos para arquivos pela retenção
+# (app/retencao.py).
+
+FONTES = {
+    'acoes': {
+        'model': AcaoUsuario,
+        'data': 'timestamp',
+        'campos': ('id', 'usuario_id', 'acao', 'timestamp', 'loja_id', 'produto_id', 'detalhes'),
+        'arquivada': True,
+    },
+    'avaliacoes': {
+        'model': Avaliacao,
+        'data': 'criacao',
+        'campos': ('id', 'cliente_id', 'loja_id', 'nota', 'comentario', 'criacao', 'atualizacao', 'ativo'),
+    },
+    'totens': {
+        'model': TotemPessoal,
+        'data': 'criacao',
+        'campos': ('id', 'tipo_usuario', 'faixa_etaria', 'genero', 'categoria_id', 'criacao'),
+    },
+}
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+LOTE = 5000
+
+
+def codificar(data, pk):
+    return base64.urlsafe_b64encode(f'{data.isoformat()}|{pk}'.encode()).decode().rstrip('=')
+
+
+def decodificar(cursor):
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('Cursor inválido.')
+    return ler_posicao(texto, '|', 'Cursor inválido.')
+
+
+def ler_posicao(texto, separador=',', erro="Parâmetro 'depois' deve ser <data ISO>,<id>."):
+    # (data, id) de "data<separador>id"; data sem fuso é a do fuso do projeto
+    try:
+        data, pk = texto.rsplit(separador, 1)
+        data, pk = parse_datetime(data), int(pk)
+    except ValueError:
+        data = None
+    if data is None:
+        raise ValueError(erro)
+    if timezone.is_naive(data):
+        data = timezone.make_aware(data)
+    return data, pk
+
+
+class Exportacao:
+    # Itere para obter os pedaços (bytes) do arquivo; `cursor` acompanha a
+    # última linha já entregue. Retoma de `cursor` ou de `depois` ("data,id")
+
+    def __init__(self, fonte, formato='ndjson', inicio=None, fim=None, cursor=None, lote=LOTE, depois=None):
+        if fonte not in FONTES:
+            raise ValueError(f"Fonte deve ser uma de: {', '.join(FONTES)}.")
+        if formato not in FORMATOS:
+            raise ValueError(f"Formato deve ser um de: {', '.join(FORMATOS)}.")
+        self.fonte = FONTES[fonte]
+        self.nome = fonte
+        self.formato = formato
+        self.inicio = inicio
+        self.fim = fim
+        if cursor:
+            self.posicao = decodificar(cursor)
+        elif depois:
+            self.posicao = ler_posicao(depois)
+            cursor = codificar(*self.posicao)
+        else:
+            self.posicao = None
+        self.cursor = cursor
+        self.lote = lote
+        if formato == 'parquet':
+            _pyarrow()
+
+    @property
+    def content_type(self):
+        return FORMATOS[self.formato]
+
+    @property
+    def nome_arquivo(self):
+        return f'{self.nome}.{self.formato}'
+
+    def __iter__(self):
+        return getattr(self, f'_{self.formato}')()
+
+    async def __aiter__(self):
+        # No ASGI: cada pedaço é montado numa ida à thread do banco, e enviado
+        # antes do próximo ser lido
+        pedacos = iter(self)
+        proximo = sync_to_async(next)
+        while (pedaco := await proximo(pedacos, None)) is not None:
+            yield pedaco
+
+    def lotes(self):
+        # Listas de até `lote` tuplas na ordem de `campos`
+        lote = []
+        for linha in self.linhas():
+            lote.append(linha)
+            if len(lote) == self.lote:
+                yield from self._entregar(lote)
+                lote = []
+        if lote:
+            yield from self._entregar(lote)
+
+    def _entregar(self, lote):
+        yield lote
+        # o cursor só avança depois que o lote foi consumido
+        self.cursor = codificar(*self._chave(lote[-1]))
+
+    def _chave(self, linha):
+        campos = self.fonte['campos']
+        return linha[campos.index(self.fonte['data'])], linha[campos.index('id')]
+
+    def linhas(self):
+        # Ações de meses já arquivados (app/retencao.py) saem dos arquivos,
+        # intercaladas em ordem com as que ainda estão no banco
+        data = self.fonte['data']
+        queryset = self.fonte['model'].objects.all()
+        if self.inicio:
+            queryset = queryset.filter(**{f'{data}__gte': self.inicio})
+        if self.fim:
+            queryset = queryset.filter(**{f'{data}__lte': self.fim})
+        if not self.fonte.get('arquivada'):
+            return ler_em_lotes(queryset, data, self.fonte['campos'], self.posicao, self.lote)
+
+        from . import retencao
+        banco = ler_em_lotes(
+            queryset.exclude(retencao.ainda_no_banco()), data, self.fonte['campos'], self.posicao, self.lote
+        )
+        desde = max(filter(None, [self.inicio, self.posicao and self.posicao[0]]), default=None)
+        arquivos = [
+            (linha for linha in retencao.ler(parte) if self._dentro(linha))
+            for parte in retencao.partes(desde, self.fim)
+        ]
+        return heapq.merge(banco, *arquivos, key=self._chave)
+
+    def _dentro(self, linha):
+        chave = self._chave(linha)
+        return (
+            (self.inicio is None or chave[0] >= self.inicio)
+            and (self.fim is None or chave[0] <= self.fim)
+            and (self.posicao is None or chave > self.posicao)
+        )
+
+    def _csv(self):
+        saida = io.StringIO()
+        escritor = csv.writer(saida)
+        if self.posicao is None:
+            # ao retomar, as linhas continuam o arquivo anterior, sem repetir o cabeçalho
+            escritor.writerow(self.fonte['campos'])
+        for linhas in self.lotes():
+            escritor.writerows([_texto(valor) for valor in linha] for linha in linhas)
+            yield _esvaziar(saida).encode()
+
+    def _ndjson(self):
+        campos = self.fonte['campos']
+        for linhas in self.lotes():
+            yield ''.join(
+                json.dumps(dict(zip(campos, map(_texto, linha))), ensure_ascii=False) + '\n' for linha in linhas
+            ).encode()
+
+    def _parquet(self):
+        pa, pq = _pyarrow()
+        model = self.fonte['model']
+        esquema = pa.schema([(campo, _tipo_arrow(pa, model, campo)) for campo in self.fonte['campos']])
+        saida = _SaidaContinua()
+        with pq.ParquetWriter(saida, esquema) as escritor:
+            for linhas in self.lotes():
+                # um row group por lote
+                escritor.write_table(pa.Table.from_arrays(
+                    [pa.array(coluna, type=tipo) for coluna, tipo in zip(zip(*linhas), esquema.types)],
+                    schema=esquema,
+                ))
+                yield saida.esvaziar()
+        yield saida.esvaziar()
+
+
+class _SaidaContinua(io.RawIOBase):
+    # Arquivo só de escrita que entrega o que foi escrito e descarta; tell()
+    # continua contando, já que o rodapé do parquet guarda as posições
+
+    def __init__(self):
+        super().__init__()
+        self.pedacos = []
+        self.posicao = 0
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self.pedacos.append(bytes(dados))
+        self.posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self.posicao
+
+    def esvaziar(self):
+        dados = b''.join(self.pedacos)
+        self.pedacos = []
+        return dados
+
+
+def ler_em_lotes(queryset, data, campos, posicao=None, lote=LOTE):
+    # Tuplas de `campos` em ordem de (data, id), depois de `posicao`; cada lote
+    # é uma consulta curta por keyset
+    queryset = queryset.order_by(data, 'pk')
+    indice_data, indice_id = campos.index(data), campos.index('id')
+    while True:
+        pagina = queryset
+        if posicao is not None:
+            valor, pk = posicao
+            pagina = pagina.filter(Q(**{f'{data}__gt': valor}) | Q(**{data: valor, 'pk__gt': pk}))
+        linhas = list(pagina.values_list(*campos)[:lote])
+        yield from linhas
+        if len(linhas) < lote:
+            return
+        posicao = linhas[-1][indice_data], linhas[-1][indice_id]
+
+
+def _texto(valor):
+    return valor.isoformat() if hasattr(valor, 'isoformat') else valor
+
+
+def _esvaziar(saida):
+    dados = saida.getvalue()
+    saida.seek(0)
+    saida.truncate()
+    return dados
+
+
+def _pyarrow():
+    # Dependência opcional, só para o formato parquet
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError('O formato parquet requer o pacote pyarrow.')
+    return pyarrow, pyarrow.parquet
+
+
+def _tipo_arrow(pa, model, campo):
+    tipo = model._meta.get_field(campo.removesuffix('_id') if campo != 'id' else campo).get_internal_type()
+    if tipo in ('AutoField', 'BigAutoField', 'ForeignKey', 'IntegerField', 'BigIntegerField'):
+        return pa.int64()
+    if tipo == 'FloatField':
+        return pa.float64()
+    if tipo == 'BooleanField':
+        return pa.bool_()
+    if tipo == 'DateTimeField':
+        return pa.timestamp('us', tz='UTC')
+    return pa.string()
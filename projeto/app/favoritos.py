@@ -0,0 +1,68 @@
+from django.db import transaction
+from django.dispatch import Signal
+from rest_framework import serializers
+
+from .models import Loja, LojaFavorita, Produto, ProdutoFavorito
+from .serializers import FavoritoLoteSerializer
+
+
+# Sincronização de favoritos de um cliente em lote, por exemplo as mudanças
+# feitas offline no app. As operações são aplicadas na ordem: para cada
+# produto ou loja vale a última, então marcar e desmarcar o mesmo item dá no
+# estado final sem gravar nada no meio. Tudo vai numa transação, com uma
+# remoção e um bulk_create(ignore_conflicts=True) por tipo: repetir o lote
+# não muda nada e favoritos já existentes não geram erro.
+#
+# Nem o bulk_create nem a remoção direta disparam post_save/post_delete por
+# linha: `favoritos_em_lote` avisa os receivers de app/signals.py uma vez.
+
+MAXIMO_OPERACOES = 1000
+
+# sender: ProdutoFavorito ou LojaFavorita; clientes: ids dos clientes cujos favoritos mudaram
+favoritos_em_lote = Signal()
+
+TIPOS = {
+    'produto': (Produto, ProdutoFavorito),
+    'loja': (Loja, LojaFavorita),
+}
+
+
+def sincronizar(cliente, operacoes):
+    # Devolve ({tipo: ids que não existem}, None) ou (None, erros)
+    if not isinstance(operacoes, list):
+        return None, {'detail': 'Envie uma lista de operações.'}
+    if len(operacoes) > MAXIMO_OPERACOES:
+        return None, {'detail': f'Máximo de {MAXIMO_OPERACOES} operações por lote.'}
+
+    validador = FavoritoLoteSerializer()
+    finais, erros = {tipo: {} for tipo in TIPOS}, []
+    for numero, operacao in enumerate(operacoes, start=1):
+        try:
+            dados = validador.run_validation(operacao)
+        except serializers.ValidationError as erro:
+            erros.append({'linha': numero, **erro.detail})
+            continue
+        tipo = 'produto' if 'produto' in dados else 'loja'
+        finais[tipo][dados[tipo]] = dados['acao']
+    if erros:
+        return None, {'erros': erros}
+
+    ignorados = {}
+    with transaction.atomic():
+        for tipo, (model, favorito) in TIPOS.items():
+            adicionar = [pk for pk, acao in finais[tipo].items() if acao == 'adicionar']
+            remover = [pk for pk, acao in finais[tipo].items() if acao == 'remover']
+            existentes = set(model.objects.filter(pk__in=adicionar).values_list('pk', flat=True))
+            ignorados[tipo] = [pk for pk in adicionar if pk not in existentes]
+            if not existentes and not remover:
+                continue
+
+            campo = f'{tipo}_id'
+            # sem dependentes, a remoção pode ir direto ao banco, sem um post_delete por linha
+            favorito.objects.filter(cliente=cliente, **{f'{campo}__in': remover})._raw_delete(favorito.objects.db)
+            favorito.objects.bulk_create(
+                [favorito(cliente=cliente, **{campo: pk}) for pk in adicionar if pk in existentes],
+                ignore_conflicts=True,
+            )
+            favoritos_em_lote.send(sender=favorito, clientes=[cliente.pk])
+    return ignorados, None
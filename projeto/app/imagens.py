@@ -0,0 +1,167 @@
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, models, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+from .cache import cache_respostas, etiquetas
+
+logger = logging.getLogger(__name__)
+
+
+# Variantes das imagens enviadas (fotos, banners, produtos, mapas). Depois do
+# commit de um save com imagem nova, um pool de threads gera versões menores em
+# WebP (e AVIF, se o Pillow tiver suporte) e grava os nomes no campo
+# `variantes` do próprio objeto, que os serializers expõem como URLs por
+# tamanho. A requisição não espera o processamento.
+#
+# Os arquivos ficam em PASTA/<sha256 do conteúdo>/<tamanho>.<formato>: a mesma
+# imagem enviada de novo (ou por outro objeto) reaproveita as variantes já
+# gravadas, sem decodificar nem codificar nada.
+#
+# Configuração (settings.IMAGENS):
+#   TAMANHOS       nome -> maior lado em pixels; imagens menores não são ampliadas
+#   FORMATOS       formatos gerados, entre os suportados pelo Pillow instalado
+#   QUALIDADE      qualidade do codificador
+#   PASTA          pasta das variantes no storage
+#   TRABALHADORES  threads do pool
+#   SINCRONO       processa na própria thread (testes e scripts)
+
+PADRAO = {
+    'TAMANHOS': {
+        'mini': 160,
+        'pequena': 480,
+        'media': 960,
+        'grande': 1920,
+    },
+    'FORMATOS': ('webp', 'avif'),
+    'QUALIDADE': 80,
+    'PASTA': 'variantes',
+    'TRABALHADORES': 2,
+    'SINCRONO': False,
+}
+
+
+def configuracao():
+    return {**PADRAO, **getattr(settings, 'IMAGENS', {})}
+
+
+def formatos(config):
+    return [formato for formato in config['FORMATOS'] if features.check(formato)]
+
+
+def campos_imagem(model):
+    return [campo.name for campo in model._meta.fields if isinstance(campo, models.ImageField)]
+
+
+def pendentes(instancia):
+    # Campos de imagem cujo arquivo atual ainda não tem variantes
+    return [
+        campo for campo in campos_imagem(type(instancia))
+        if getattr(instancia, campo) and instancia.variantes.get(campo, {}).get('original') != getattr(instancia, campo).name
+    ]
+
+
+def processar(model, pk, campo, nome):
+    # Gera (ou reaproveita) as variantes de `nome` e as registra no objeto
+    config = configuracao()
+    storage = model._meta.get_field(campo).storage
+    with storage.open(nome, 'rb') as arquivo:
+        dados = arquivo.read()
+    conteudo = hashlib.sha256(dados).hexdigest()
+    largura, altura, tamanhos = gerar(dados, conteudo, storage, config)
+
+    with transaction.atomic():
+        linha = model.objects.select_for_update().filter(pk=pk).values_list(campo, 'variantes').first()
+        # o objeto pode ter sido excluído ou ter recebido outra imagem nesse meio tempo
+        if linha is None or linha[0] != nome:
+            return
+        variantes = linha[1]
+        variantes[campo] = {'original': nome, 'largura': largura, 'altura': altura, 'tamanhos': tamanhos}
+        model.objects.filter(pk=pk).update(variantes=variantes, atualizacao=timezone.now())
+    cache_respostas.invalidar(etiquetas(model, [pk]))
+
+
+def gerar(dados, conteudo, storage, config):
+    # {tamanho: {formato: nome no storage}}, do maior para o menor
+    imagem = Image.open(io.BytesIO(dados))
+    largura, altura = imagem.size
+    if imagem.getexif().get(0x0112, 1) in (5, 6, 7, 8):  # rotação de 90 graus
+        largura, altura = altura, largura
+    lado = max(largura, altura)
+    pasta = f"{config['PASTA']}/{conteudo[:2]}/{conteudo}"
+
+    # tamanhos menores que a imagem, mais um no tamanho original; nunca amplia
+    planejados = []
+    for nome, limite in sorted(config['TAMANHOS'].items(), key=lambda item: item[1]):
+        planejados.append((nome, min(limite, lado)))
+        if limite >= lado:
+            break
+    planejados.reverse()
+
+    tamanhos = {}
+    atual = None
+    for nome, limite in planejados:
+        tamanhos[nome] = {}
+        for formato in formatos(config):
+            destino = f'{pasta}/{nome}.{formato}'
+            if not storage.exists(destino):
+                if atual is None:
+                    atual = preparar(imagem)
+                # cada tamanho sai do anterior (maior), não do original
+                atual.thumbnail((limite, limite), Image.Resampling.LANCZOS)
+                saida = io.BytesIO()
+                atual.save(saida, formato.upper(), quality=config['QUALIDADE'])
+                destino = storage.save(destino, ContentFile(saida.getvalue()))
+            tamanhos[nome][formato] = destino
+    return largura, altura, tamanhos
+
+
+def preparar(imagem):
+    imagem = ImageOps.exif_transpose(imagem)
+    transparente = 'A' in imagem.getbands() or 'transparency' in imagem.info
+    return imagem.convert('RGBA' if transparente else 'RGB')
+
+
+class ProcessadorImagens:
+    # Pool de threads para trabalhos fora da requisição: imagens, mosaicos e
+    # a compilação das rotas (app/rotas.py)
+
+    def __init__(self):
+        self._executor = None
+        self._trava = threading.Lock()
+
+    def enviar(self, funcao, *args):
+        config = configuracao()
+        if config['SINCRONO']:
+            funcao(*args)
+            return
+        if self._executor is None:
+            with self._trava:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(config['TRABALHADORES'], thread_name_prefix='imagens')
+        self._executor.submit(self._executar, funcao, *args)
+
+    def encerrar(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _executar(self, funcao, *args):
+        # cada thread do pool cuida da própria conexão, como faria uma requisição
+        close_old_connections()
+        try:
+            funcao(*args)
+        except Exception:
+            logger.exception('Falha no processamento de imagem: %s%r', funcao.__name__, args)
+        finally:
+            close_old_connections()
+
+
+processador_imagens = ProcessadorImagens()
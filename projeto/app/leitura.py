@@ -0,0 +1,277 @@
+from collections import defaultdict, namedtuple
+
+from asgiref.sync import sync_to_async
+from rest_framework import serializers
+from rest_framework.generics import get_object_or_404
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+
+from .models import Categoria, Loja, LojaFavorita, Produto, ProdutoFavorito
+from .serializers import (
+    CategoriaSerializer, LojaSerializer, PesquisaSerializer, ProdutoSerializer,
+    ids_favoritos, lista_parametro, urls_variantes,
+)
+
+try:
+    import orjson
+except ImportError:  # dependência opcional: sem ela fica o JSONRenderer do DRF
+    orjson = None
+
+
+# Leitura rápida de produtos, lojas e categorias: listagem e detalhe das
+# ViewSets e a pesquisa. Em vez de instanciar os models e passar cada valor
+# pelos fields do DRF, lê as colunas com values(), os ids de cada relação com
+# uma consulta e monta os dicts diretamente. Os serializers continuam sendo a
+# referência (nomes, ordem dos campos, escrita e demais rotas) e a saída é a
+# mesma, byte a byte; um campo novo no serializer precisa do seu Campo aqui.
+#
+# Cada Campo diz as colunas que lê, como chega ao valor e, se for o caso, o que
+# carregar uma vez para a página toda (ids de uma relação, favoritos).
+
+Campo = namedtuple('Campo', 'colunas valor carregar', defaults=(None,))
+
+_DATA = serializers.DateTimeField()
+
+
+def colunas(*nomes):
+    return {nome: Campo((nome,), lambda linha, extra, request, nome=nome: linha[nome]) for nome in nomes}
+
+
+def datas(*nomes):
+    # O fuso (o de DateTimeField) é lido uma vez por página, como um carregamento
+    return {
+        nome: Campo(
+            (nome,),
+            lambda linha, fuso, request, nome=nome: formatar_data(linha[nome], fuso),
+            lambda pks, request: _DATA.default_timezone(),
+        )
+        for nome in nomes
+    }
+
+
+def formatar_data(valor, fuso):
+    # DateTimeField.to_representation no formato padrão (ISO 8601)
+    if not valor:
+        return None
+    if fuso is not None:
+        valor = valor.astimezone(fuso)
+    texto = valor.isoformat()
+    return texto[:-6] + 'Z' if texto.endswith('+00:00') else texto
+
+
+def imagens(model, *nomes):
+    # O campo de imagem e o seu _variantes, como ImageField e VariantesImagemField
+    campos = {}
+    for nome in nomes:
+        storage = model._meta.get_field(nome).storage
+
+        def arquivo(linha, extra, request, nome=nome, storage=storage):
+            if not linha[nome]:
+                return None
+            # sem request, o endereço relativo, como no ImageField do DRF
+            return request.build_absolute_uri(storage.url(linha[nome])) if request else storage.url(linha[nome])
+
+        def variantes(linha, extra, request, nome=nome, storage=storage):
+            return urls_variantes(storage, linha[nome], linha['variantes'].get(nome), request)
+
+        campos[nome] = Campo((nome,), arquivo)
+        campos[f'{nome}_variantes'] = Campo((nome, 'variantes'), variantes)
+    return campos
+
+
+def ids(model, relacao):
+    return Campo(
+        ('id',),
+        lambda linha, extra, request: extra.get(linha['id'], []),
+        lambda pks, request: ids_relacionados(model, relacao, pks),
+    )
+
+
+def favoritado(modelo):
+    return Campo(
+        ('id',),
+        lambda linha, extra, request: linha['id'] in extra,
+        lambda pks, request: ids_favoritos({'request': request}, modelo),
+    )
+
+
+def aninhados(leitura, chave):
+    # Objetos completos de `leitura` cuja FK `chave` aponta para a linha
+    def carregar(ids, request):
+        nomes = leitura.nomes()
+        linhas = list(
+            leitura.model._default_manager.filter(**{f'{chave}__in': ids}).order_by('pk')
+            .values(*leitura.colunas(nomes) | {chave})
+        )
+        grupos = defaultdict(list)
+        for linha, dados in zip(linhas, leitura.montar(linhas, request, nomes)):
+            grupos[linha[chave]].append(dados)
+        return grupos
+    return Campo(('id',), lambda linha, extra, request: extra.get(linha['id'], []), carregar)
+
+
+def ids_relacionados(model, relacao, ids):
+    # {id: [ids relacionados]}, em ordem de pk como no prefetch de app/consultas.py
+    campo = model._meta.get_field(relacao)
+    if campo.many_to_many:
+        origem, destino = campo.m2m_field_name(), campo.m2m_reverse_field_name()
+        pares = campo.remote_field.through.objects.filter(**{f'{origem}__in': ids}).order_by(destino)
+    else:
+        origem, destino = campo.field.name, 'pk'
+        pares = campo.related_model._default_manager.filter(**{f'{origem}__in': ids}).order_by('pk')
+    grupos = defaultdict(list)
+    for pai, filho in pares.values_list(origem, destino):
+        grupos[pai].append(filho)
+    return grupos
+
+
+class Leitura:
+    model = None
+    serializer = None
+    campos = {}
+
+    def nomes(self, request=None):
+        # Campos da resposta na ordem do serializer; ?fields= só no objeto principal
+        nomes = list(self.serializer.Meta.fields)
+        pedidos = lista_parametro(request, 'fields') if request is not None else set()
+        return [nome for nome in nomes if nome in pedidos] if pedidos else nomes
+
+    def colunas(self, nomes):
+        # id e criacao sempre: ligam as relações e posicionam o cursor da paginação
+        return {'id', 'criacao', *(coluna for nome in nomes for coluna in self.campos[nome].colunas)}
+
+    def valores(self, queryset, nomes):
+        return queryset.prefetch_related(None).values(*self.colunas(nomes))
+
+    def montar(self, linhas, request, nomes):
+        if not linhas:
+            return []
+        return self.preencher(linhas, request, nomes, self.carregar(linhas, request, nomes))
+
+    async def amontar(self, linhas, request, nomes):
+        # montar() no modo ASGI (app/assincrono.py): as consultas das relações
+        # vão juntas numa ida à thread do banco, a montagem fica no loop
+        if not linhas:
+            return []
+        extras = await sync_to_async(self.carregar)(linhas, request, nomes)
+        return self.preencher(linhas, request, nomes, extras)
+
+    def carregar(self, linhas, request, nomes):
+        ids = [linha['id'] for linha in linhas]
+        campos = [self.campos[nome] for nome in nomes]
+        return [campo.carregar(ids, request) if campo.carregar else None for campo in campos]
+
+    def preencher(self, linhas, request, nomes, extras):
+        plano = list(zip(nomes, [self.campos[nome].valor for nome in nomes], extras))
+        return [{nome: valor(linha, extra, request) for nome, valor, extra in plano} for linha in linhas]
+
+    def por_ids(self, ids, request, queryset=None):
+        # Objetos na ordem dos ids (ex.: ranking da busca)
+        nomes = self.nomes(request)
+        linhas = self.valores(self._por_ids(ids, queryset), nomes)
+        return self.montar(_em_ordem(linhas, ids), request, nomes)
+
+    async def apor_ids(self, ids, request, queryset=None):
+        nomes = self.nomes(request)
+        linhas = [linha async for linha in self.valores(self._por_ids(ids, queryset), nomes)]
+        return await self.amontar(_em_ordem(linhas, ids), request, nomes)
+
+    def _por_ids(self, ids, queryset):
+        return (self.model._default_manager.all() if queryset is None else queryset).filter(pk__in=ids)
+
+
+def _em_ordem(linhas, ids):
+    linhas = {linha['id']: linha for linha in linhas}
+    return [linhas[pk] for pk in ids if pk in linhas]
+
+
+class LeituraProduto(Leitura):
+    model = Produto
+    serializer = ProdutoSerializer
+    campos = {
+        **colunas('id', 'nome', 'descricao', 'loja', 'cor', 'composicao', 'ativo'),
+        **imagens(Produto, 'imagem'),
+        **datas('criacao', 'atualizacao'),
+        'categorias': ids(Produto, 'categorias'),
+        'favoritado': favoritado(ProdutoFavorito),
+    }
+
+
+class LeituraLoja(Leitura):
+    model = Loja
+    serializer = LojaSerializer
+    campos = {
+        **colunas(
+            'id', 'nome', 'descricao', 'setor', 'localizacao', 'lojista', 'Instagram', 'WhatsApp',
+            'Website', 'horario_funcionamento', 'ativo',
+        ),
+        **imagens(Loja, 'banner', 'logo', 'foto_da_loja'),
+        **datas('criacao', 'atualizacao'),
+        'produtos': ids(Loja, 'produtos'),
+        'categorias': ids(Loja, 'categorias'),
+        'avaliacoes': ids(Loja, 'avaliacoes_recebidas'),
+        # nota_media() de app/serializers.py
+        'nota_media': Campo(
+            ('nota', 'total_avaliacoes'),
+            lambda linha, extra, request: linha['nota'] if linha['total_avaliacoes'] else None,
+        ),
+        'favoritado': favoritado(LojaFavorita),
+    }
+
+
+class LeituraPesquisa(LeituraLoja):
+    serializer = PesquisaSerializer
+    campos = {**LeituraLoja.campos, 'produtos': aninhados(LeituraProduto(), 'loja')}
+
+
+class LeituraCategoria(Leitura):
+    model = Categoria
+    serializer = CategoriaSerializer
+    campos = {
+        **colunas('id', 'nome', 'ativo'),
+        **datas('criacao', 'atualizacao'),
+    }
+
+
+class JSONRapidoRenderer(JSONRenderer):
+    # Os mesmos bytes do JSONRenderer, codificados pelo orjson quando instalado.
+    # Floats muito grandes ou pequenos (1e16, 1e-05) sairiam com outra grafia:
+    # não há desses nas views que usam este renderer
+    _opcoes = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+    _padrao = encoders.JSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            conteudo = orjson.dumps(data, default=self._padrao, option=self._opcoes)
+        except (orjson.JSONEncodeError, TypeError):
+            return super().render(data, accepted_media_type, renderer_context)
+        # o JSONRenderer escapa os separadores de linha do JavaScript
+        return conteudo.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+RENDERERS = [JSONRapidoRenderer if classe is JSONRenderer else classe for classe in api_settings.DEFAULT_RENDERER_CLASSES]
+
+
+class LeituraRapidaMixin:
+    # list e retrieve pela Leitura da ViewSet (atributo `leitura`); escrita e
+    # actions seguem pelo serializer. Fica depois dos mixins de cache no MRO,
+    # que guardam o resultado daqui como guardariam o do serializer.
+    leitura = None
+    renderer_classes = RENDERERS
+
+    def list(self, request, *args, **kwargs):
+        nomes = self.leitura.nomes(request)
+        queryset = self.leitura.valores(self.filter_queryset(self.get_queryset()), nomes)
+        pagina = self.paginate_queryset(queryset)
+        return self.get_paginated_response(self.leitura.montar(pagina, request, nomes))
+
+    def retrieve(self, request, *args, **kwargs):
+        nomes = self.leitura.nomes(request)
+        queryset = self.leitura.valores(self.filter_queryset(self.get_queryset()), nomes)
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        linha = get_object_or_404(queryset, **{self.lookup_field: self.kwargs[lookup]})
+        return Response(self.leitura.montar([linha], request, nomes)[0])
@@ -0,0 +1,145 @@
+import json
+
+from django.db import transaction
+from django.dispatch import Signal
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from .models import Categoria, Loja, Produto
+from .serializers import ProdutoLoteSerializer
+
+
+# Gravação de produtos em lote. Todas as linhas são validadas antes de gravar:
+# os campos linha a linha, sem consultas, e os ids de lojas, categorias e
+# produtos com uma consulta cada para o lote todo; cada produto só pode
+# aparecer em uma linha. Com qualquer erro nada é
+# gravado e a resposta lista os erros de cada linha. Sem erros, tudo vai numa
+# transação: bulk_create dos novos, bulk_update dos existentes e bulk_create
+# das linhas de categorias.
+#
+# bulk_create/bulk_update não disparam post_save nem m2m_changed: quem grava
+# em lote envia `salvos_em_lote` e os receivers de app/signals.py cuidam do
+# índice de busca, do cache e dos ETags.
+
+MAXIMO_LINHAS = 10000
+TAMANHO_LOTE = 500
+
+# sender: o model; ids: pks gravados; lojas: lojas cuja lista de produtos mudou
+salvos_em_lote = Signal()
+
+
+class NDJSONParser(BaseParser):
+    # Um objeto JSON por linha; linhas em branco são ignoradas
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', 'utf-8')
+        linhas = []
+        for numero, linha in enumerate(stream, start=1):
+            linha = linha.strip()
+            if not linha:
+                continue
+            try:
+                linhas.append(json.loads(linha.decode(encoding)))
+            except ValueError as erro:
+                raise ParseError(f'JSON inválido na linha {numero}: {erro}')
+        return linhas
+
+
+def nao_existe(pk):
+    return serializers.PrimaryKeyRelatedField.default_error_messages['does_not_exist'].format(pk_value=pk)
+
+
+def importar_produtos(linhas):
+    # Linhas sem id criam produtos, com id atualizam só os campos enviados.
+    # Devolve (ids criados e atualizados, None) ou (None, erros)
+    if not isinstance(linhas, list):
+        return None, {'detail': 'Envie uma lista de produtos (JSON) ou um produto por linha (NDJSON).'}
+    if len(linhas) > MAXIMO_LINHAS:
+        return None, {'detail': f'Máximo de {MAXIMO_LINHAS} produtos por lote.'}
+
+    validadas, erros = validar(linhas)
+    lojas = set(Loja.objects.filter(
+        pk__in={dados['loja_id'] for _, dados in validadas if 'loja_id' in dados}
+    ).values_list('pk', flat=True))
+    categorias = set(Categoria.objects.filter(
+        pk__in={pk for _, dados in validadas for pk in dados.get('categorias', ())}
+    ).values_list('pk', flat=True))
+    produtos = Produto.objects.in_bulk([dados['id'] for _, dados in validadas if 'id' in dados])
+
+    vistos = set()
+    for numero, dados in validadas:
+        erro = {}
+        if 'id' in dados and dados['id'] not in produtos:
+            erro['id'] = [nao_existe(dados['id'])]
+        elif 'id' in dados and dados['id'] in vistos:
+            # duas linhas do mesmo produto gravariam as categorias duas vezes
+            erro['id'] = ['Produto repetido no lote.']
+        vistos.add(dados.get('id'))
+        if 'loja_id' in dados and dados['loja_id'] not in lojas:
+            erro['loja'] = [nao_existe(dados['loja_id'])]
+        faltando = [pk for pk in dados.get('categorias', ()) if pk not in categorias]
+        if faltando:
+            erro['categorias'] = [nao_existe(pk) for pk in faltando]
+        if erro:
+            erros[numero] = erro
+    if erros:
+        return None, {'erros': [{'linha': n, **erros[n]} for n in sorted(erros)]}
+
+    return gravar(produtos, [dados for _, dados in validadas]), None
+
+
+def validar(linhas):
+    # (número da linha, dados validados) e {número da linha: erros}
+    validadores = {False: ProdutoLoteSerializer(), True: ProdutoLoteSerializer(partial=True)}
+    validadas, erros = [], {}
+    for numero, linha in enumerate(linhas, start=1):
+        existente = isinstance(linha, dict) and linha.get('id') is not None
+        try:
+            validadas.append((numero, dict(validadores[existente].run_validation(linha))))
+        except serializers.ValidationError as erro:
+            erros[numero] = erro.detail
+    return validadas, erros
+
+
+def gravar(produtos, linhas):
+    agora = timezone.now()
+    criar, atualizar, campos, relacoes, lojas = [], {}, set(), [], set()
+    for dados in linhas:
+        categorias = dados.pop('categorias', None)
+        if 'id' in dados:
+            produto = produtos[dados.pop('id')]
+            if dados.get('loja_id', produto.loja_id) != produto.loja_id:
+                lojas |= {produto.loja_id, dados['loja_id']}
+            for campo, valor in dados.items():
+                setattr(produto, campo, valor)
+            campos.update(dados)
+            produto.atualizacao = agora  # bulk_update não aplica auto_now
+            atualizar[produto.pk] = produto
+        else:
+            produto = Produto(**dados)
+            lojas.add(produto.loja_id)
+            criar.append(produto)
+        if categorias is not None:
+            relacoes.append((produto, categorias))
+
+    campos = [campo.removesuffix('_id') for campo in campos] + ['atualizacao']
+    Relacao = Produto.categorias.through
+    with transaction.atomic():
+        Produto.objects.bulk_create(criar, batch_size=TAMANHO_LOTE)
+        Produto.objects.bulk_update(atualizar.values(), campos, batch_size=TAMANHO_LOTE)
+        Relacao.objects.filter(produto_id__in=[p.pk for p, _ in relacoes if p.pk in atualizar]).delete()
+        Relacao.objects.bulk_create(
+            [
+                Relacao(produto_id=produto.pk, categoria_id=categoria)
+                for produto, categorias in relacoes
+                for categoria in dict.fromkeys(categorias)
+            ],
+            batch_size=TAMANHO_LOTE,
+        )
+        ids = [produto.pk for produto in criar] + list(atualizar)
+        salvos_em_lote.send(sender=Produto, ids=ids, lojas=lojas)
+
+    return {'criados': [produto.pk for produto in criar], 'atualizados': list(atualizar)}
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from app.metricas import agregar_tudo
+
+
+class Command(BaseCommand):
+    help = 'Agrega as ações de usuário e os registros dos totens ainda não processados.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=10000, help='Eventos lidos por transação.')
+
+    def handle(self, *args, **options):
+        totais = agregar_tudo(options['lote'])
+        for nome, total in totais.items():
+            self.stdout.write(f'{nome}: {total} evento(s) agregado(s)')
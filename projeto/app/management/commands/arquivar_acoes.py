@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from app.retencao import arquivar
+
+
+class Command(BaseCommand):
+    help = (
+        'Move as ações de usuário dos meses anteriores ao horizonte de retenção para arquivos '
+        'comprimidos e as apaga do banco em lotes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--meses', type=int, help='Meses completos mantidos no banco (padrão: RETENCAO_ACOES).')
+
+    def handle(self, *args, **options):
+        arquivadas = arquivar(meses=options['meses'])
+        for mes, total in arquivadas.items():
+            self.stdout.write(self.style.SUCCESS(f'{mes:%Y-%m}: {total} ação(ões) arquivada(s).'))
+        if not arquivadas:
+            self.stdout.write('Nada a arquivar.')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from app.recomendacao import atualizar
+
+
+class Command(BaseCommand):
+    help = (
+        'Atualiza as recomendações pré-calculadas: refaz as listas dos clientes marcados '
+        'e mescla os itens alterados desde a última execução.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--completo', action='store_true', help='Recalcula as listas de todos os clientes.')
+
+    def handle(self, *args, **options):
+        totais = atualizar(completo=options['completo'])
+        for tipo, total in totais.items():
+            self.stdout.write(self.style.SUCCESS(
+                f"{tipo}: {total['recalculadas']} lista(s) recalculada(s), {total['mescladas']} mesclada(s)."
+            ))
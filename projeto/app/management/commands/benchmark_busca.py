@@ -0,0 +1,63 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.busca import IndiceInvertido, normalizar
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede a latência da busca no índice invertido com catálogos sintéticos de '
+        'tamanhos crescentes, comparando com a varredura linear (equivalente ao icontains).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanhos', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--consultas', type=int, default=200)
+        parser.add_argument('--vocabulario', type=int, default=20000)
+        parser.add_argument('--semente', type=int, default=42)
+
+    def handle(self, *args, **options):
+        aleatorio = random.Random(options['semente'])
+        vocabulario = [self.palavra(aleatorio) for _ in range(options['vocabulario'])]
+        # frequência das palavras segue uma distribuição de Zipf, como em texto real
+        pesos = [1 / (i + 1) for i in range(len(vocabulario))]
+
+        self.stdout.write(f"{'documentos':>10} {'índice p50':>12} {'índice p95':>12} {'varredura p50':>14}")
+        base = None
+        for tamanho in options['tamanhos']:
+            textos = [' '.join(aleatorio.choices(vocabulario, pesos, k=12)) for _ in range(tamanho)]
+            indice = IndiceInvertido()
+            for doc, texto in enumerate(textos):
+                indice.adicionar(doc, normalizar(texto))
+
+            consultas = [' '.join(aleatorio.choices(vocabulario, pesos, k=2)) for _ in range(options['consultas'])]
+            tempos_indice = self.medir(lambda c: indice.buscar(normalizar(c), 20), consultas)
+            tempos_varredura = self.medir(
+                lambda c: [d for d, t in enumerate(textos) if c.split()[0] in t][:20], consultas[:20]
+            )
+
+            p50 = statistics.median(tempos_indice)
+            p95 = statistics.quantiles(tempos_indice, n=20)[-1]
+            self.stdout.write(
+                f'{tamanho:>10} {p50:>10.3f}ms {p95:>10.3f}ms {statistics.median(tempos_varredura):>12.3f}ms'
+            )
+            base = base or (tamanho, p50)
+
+        tamanho_base, p50_base = base
+        self.stdout.write(
+            f'Crescimento do catálogo: {tamanho / tamanho_base:.0f}x; latência p50 do índice: {p50 / p50_base:.1f}x'
+        )
+
+    def medir(self, funcao, consultas):
+        tempos = []
+        for consulta in consultas:
+            inicio = time.perf_counter()
+            funcao(consulta)
+            tempos.append((time.perf_counter() - inicio) * 1000)
+        return tempos
+
+    def palavra(self, aleatorio):
+        return ''.join(aleatorio.choices('abcdefghijlmnoprstuvz', k=aleatorio.randint(4, 9)))
@@ -0,0 +1,59 @@
+import math
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.espacial import Grade, Ponto, filtro
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede a latência das consultas de lojas próximas e por região na grade espacial com '
+        'feiras sintéticas de tamanhos crescentes, comparando com a varredura de todas as lojas.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanhos', type=int, nargs='+', default=[1000, 5000, 20000])
+        parser.add_argument('--consultas', type=int, default=500)
+        parser.add_argument('--vizinhos', type=int, default=10)
+        parser.add_argument('--semente', type=int, default=42)
+
+    def handle(self, *args, **options):
+        aleatorio = random.Random(options['semente'])
+        k = options['vizinhos']
+        self.stdout.write(
+            f"{'lojas':>7} {'próximas p50':>13} {'p95':>9} {'c/ setor p50':>13} "
+            f"{'região p50':>11} {'varredura p50':>14}"
+        )
+        for tamanho in options['tamanhos']:
+            # barracas em ruas de uma feira de 8000x6000 px
+            pontos = [
+                Ponto(i, '', aleatorio.uniform(0, 8000), aleatorio.randrange(0, 6000, 40), i % 12, frozenset({i % 30}))
+                for i in range(tamanho)
+            ]
+            grade = Grade(pontos)
+            consultas = [(aleatorio.uniform(0, 8000), aleatorio.uniform(0, 6000)) for _ in range(options['consultas'])]
+
+            proximas = self.medir(lambda c: grade.proximas(*c, k), consultas)
+            setor = filtro(setor=3)
+            com_setor = self.medir(lambda c: grade.proximas(*c, k, setor), consultas)
+            regiao = self.medir(lambda c: grade.regiao(c[0], c[1], c[0] + 800, c[1] + 600), consultas)
+            varredura = self.medir(
+                lambda c: sorted(pontos, key=lambda p: math.dist((p.x, p.y), c))[:k], consultas[:50]
+            )
+            p95 = statistics.quantiles(proximas, n=20)[-1]
+            self.stdout.write(
+                f'{tamanho:>7} {statistics.median(proximas):>11.3f}ms {p95:>7.3f}ms '
+                f'{statistics.median(com_setor):>11.3f}ms {statistics.median(regiao):>9.3f}ms '
+                f'{statistics.median(varredura):>12.3f}ms'
+            )
+
+    def medir(self, funcao, consultas):
+        tempos = []
+        for consulta in consultas:
+            inicio = time.perf_counter()
+            funcao(consulta)
+            tempos.append((time.perf_counter() - inicio) * 1000)
+        return tempos
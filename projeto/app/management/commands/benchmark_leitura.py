@@ -0,0 +1,96 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from app.consultas import planejar_queryset
+from app.leitura import JSONRapidoRenderer, LeituraCategoria, LeituraLoja, LeituraProduto
+from app.models import Avaliacao, Categoria, Cliente, Loja, LojaFavorita, Lojista, Produto, ProdutoFavorito
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede a vazão da leitura rápida (app/leitura.py) contra os serializers do DRF numa página '
+        'de produtos, lojas e categorias: consultas, montagem dos dados e JSON. Cria um catálogo '
+        'sintético numa transação desfeita ao final.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lojas', type=int, default=300)
+        parser.add_argument('--produtos-por-loja', type=int, default=5)
+        parser.add_argument('--pagina', type=int, default=200)
+        parser.add_argument('--repeticoes', type=int, default=50)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            request = self.catalogo(options['lojas'], options['produtos_por_loja'])
+            self.stdout.write(f"{'recurso':>10} {'serializer':>16} {'leitura rápida':>18} {'ganho':>7}")
+            for leitura in (LeituraProduto(), LeituraLoja(), LeituraCategoria()):
+                queryset = leitura.model.objects.order_by('-criacao', '-pk')
+                tamanho = min(options['pagina'], queryset.count())
+                serializer = self.medir(
+                    lambda: self.serializer(leitura, queryset[:tamanho], request), options['repeticoes']
+                )
+                rapida = self.medir(
+                    lambda: self.rapida(leitura, queryset[:tamanho], request), options['repeticoes']
+                )
+                self.stdout.write(
+                    f'{leitura.model._meta.model_name:>10} {tamanho / serializer:>10.0f} itens/s '
+                    f'{tamanho / rapida:>12.0f} itens/s {serializer / rapida:>6.1f}x'
+                )
+            transaction.set_rollback(True)
+
+    def catalogo(self, n_lojas, produtos_por_loja):
+        user = User.objects.create_user(username='benchmark-leitura@feira.com')
+        cliente = Cliente.objects.create(user=user, nome='Benchmark', cpf='0', telefone='0', genero='-', tipo='Local')
+        lojista = Lojista.objects.create(
+            user=User.objects.create_user(username='benchmark-lojista@feira.com'), nome='Benchmark', telefone='0', cnpj='0'
+        )
+        categorias = Categoria.objects.bulk_create([Categoria(nome=f'Categoria {i}') for i in range(n_lojas)])
+        lojas = Loja.objects.bulk_create([
+            Loja(nome=f'Loja {i}', lojista=lojista, descricao='Barraca de artesanato', localizacao=f'Rua {i % 12}')
+            for i in range(n_lojas)
+        ])
+        produtos = Produto.objects.bulk_create([
+            Produto(nome=f'Produto {i}', descricao='Feito à mão', loja=loja, cor='azul', composicao='algodão')
+            for loja in lojas for i in range(produtos_por_loja)
+        ])
+        Loja.categorias.through.objects.bulk_create([
+            Loja.categorias.through(loja=loja, categoria=categorias[(loja.pk + i) % 30]) for loja in lojas for i in range(2)
+        ])
+        Produto.categorias.through.objects.bulk_create([
+            Produto.categorias.through(produto=produto, categoria=categorias[produto.pk % 30]) for produto in produtos
+        ])
+        Avaliacao.objects.bulk_create([Avaliacao(cliente=cliente, loja=loja, nota=4) for loja in lojas])
+        LojaFavorita.objects.bulk_create([LojaFavorita(cliente=cliente, loja=loja) for loja in lojas[::3]])
+        ProdutoFavorito.objects.bulk_create([ProdutoFavorito(cliente=cliente, produto=produto) for produto in produtos[::3]])
+
+        request = Request(APIRequestFactory().get('/api/'))
+        request.user = user
+        return request
+
+    def serializer(self, leitura, queryset, request):
+        contexto = {'request': request}
+        request.__dict__.pop('_ids_favoritos', None)
+        objetos = planejar_queryset(queryset, leitura.serializer(context=contexto))
+        return JSONRenderer().render(leitura.serializer(objetos, many=True, context=contexto).data)
+
+    def rapida(self, leitura, queryset, request):
+        request.__dict__.pop('_ids_favoritos', None)
+        nomes = leitura.nomes(request)
+        return JSONRapidoRenderer().render(leitura.montar(list(leitura.valores(queryset, nomes)), request, nomes))
+
+    def medir(self, funcao, repeticoes):
+        # mediana em segundos por página, depois de uma rodada de aquecimento
+        funcao()
+        tempos = []
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            funcao()
+            tempos.append(time.perf_counter() - inicio)
+        return statistics.median(tempos)
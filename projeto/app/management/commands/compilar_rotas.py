@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from app.models import Mapas
+from app.rotas import caminho, compilar
+
+
+class Command(BaseCommand):
+    help = (
+        'Compila os grafos de caminhos dos mapas (arrays compactos e distâncias entre todas as lojas) '
+        'usados por /mapa/<id>/rota/.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mapa', type=int, help='Compila só este mapa.')
+
+    def handle(self, *args, **options):
+        mapas = [options['mapa']] if options['mapa'] else Mapas.objects.exclude(caminhos={}).values_list('pk', flat=True)
+        for mapa in mapas:
+            lojas = compilar(mapa)
+            if caminho(mapa).exists():
+                self.stdout.write(self.style.SUCCESS(f'Mapa {mapa}: {lojas} loja(s) ligada(s) em {caminho(mapa)}.'))
+            else:
+                self.stdout.write(f'Mapa {mapa}: sem caminhos cadastrados.')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from app.pacotes import caminho, construir
+
+
+class Command(BaseCommand):
+    help = (
+        'Monta o pacote offline dos totens (catálogo, índice de busca e itens parecidos num arquivo '
+        'SQLite comprimido) e o publica em /pacotes/ se o conteúdo mudou desde a última versão.'
+    )
+
+    def handle(self, *args, **options):
+        versao, nova = construir()
+        if nova:
+            self.stdout.write(self.style.SUCCESS(f'Versão {versao} publicada em {caminho(versao)}.'))
+        else:
+            self.stdout.write(f'Nada mudou: a versão atual continua {versao}.')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from app.similares import FONTES, caminho, construir
+
+
+class Command(BaseCommand):
+    help = (
+        'Monta os índices de itens parecidos (co-ocorrência de favoritos e visualizações) '
+        'usados por /lojas/<id>/similares/ e /produtos/<id>/similares/.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tipo', choices=sorted(FONTES), help='Monta só o índice deste tipo.')
+
+    def handle(self, *args, **options):
+        tipos = [options['tipo']] if options['tipo'] else list(FONTES)
+        for tipo in tipos:
+            total = construir(tipo)
+            self.stdout.write(self.style.SUCCESS(f'{tipo}: {total} item(ns) com vizinhos em {caminho(tipo)}.'))
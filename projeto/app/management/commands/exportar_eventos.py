@@ -0,0 +1,43 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.exportacao import FONTES, FORMATOS, Exportacao
+from app.views import ler_data
+
+
+class Command(BaseCommand):
+    help = 'Exporta eventos brutos (ações, avaliações ou totens) em CSV, NDJSON ou Parquet, em fluxo.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('fonte', choices=sorted(FONTES))
+        parser.add_argument('--formato', choices=sorted(FORMATOS), default='ndjson')
+        parser.add_argument('--inicio', help='Data ou data e hora ISO.')
+        parser.add_argument('--fim', help='Data ou data e hora ISO.')
+        parser.add_argument('--cursor', help='Retoma depois da última linha de uma exportação anterior.')
+        parser.add_argument('--saida', help='Arquivo de saída (padrão: saída padrão).')
+
+    def handle(self, *args, **options):
+        datas = {}
+        for parametro in ('inicio', 'fim'):
+            if options[parametro]:
+                datas[parametro] = ler_data(options[parametro])
+                if datas[parametro] is None:
+                    raise CommandError(f'Data inválida em --{parametro}.')
+        try:
+            exportacao = Exportacao(options['fonte'], options['formato'], cursor=options['cursor'], **datas)
+        except ValueError as erro:
+            raise CommandError(str(erro))
+
+        # ao retomar, CSV e NDJSON continuam o mesmo arquivo; parquet gera outro
+        continuar = options['cursor'] and options['formato'] != 'parquet'
+        saida = open(options['saida'], 'ab' if continuar else 'wb') if options['saida'] else sys.stdout.buffer
+        try:
+            for pedaco in exportacao:
+                saida.write(pedaco)
+        finally:
+            if saida is not sys.stdout.buffer:
+                saida.close()
+            # em stderr, para não se misturar aos dados
+            if exportacao.cursor:
+                self.stderr.write(f'Cursor para continuar: {exportacao.cursor}')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from app.sincronizacao import podar
+
+
+class Command(BaseCommand):
+    help = (
+        'Apaga os registros de remoção da sincronização incremental mais antigos que '
+        'SINCRONIZACAO["RETENCAO_DIAS"]; tokens dessa época recomeçam do zero.'
+    )
+
+    def handle(self, *args, **options):
+        apagadas = podar()
+        self.stdout.write(self.style.SUCCESS(f'{apagadas} remoção(ões) apagada(s).'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from app import mosaico
+from app.imagens import pendentes, processar
+from app.models import Cliente, Loja, Lojista, Mapas, Produto
+
+MODELOS = {'lojas': Loja, 'produtos': Produto, 'lojistas': Lojista, 'clientes': Cliente, 'mapas': Mapas}
+
+
+class Command(BaseCommand):
+    help = (
+        'Gera as variantes (tamanhos menores em WebP/AVIF) das imagens e os mosaicos dos mapas '
+        'que ainda não os têm, como os enviados antes do processamento automático.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=sorted(MODELOS), help='Processa só este tipo de objeto.')
+
+    def handle(self, *args, **options):
+        modelos = [options['model']] if options['model'] else list(MODELOS)
+        for nome in modelos:
+            model = MODELOS[nome]
+            total = falhas = 0
+            for instancia in model.objects.iterator():
+                trabalhos = [
+                    (campo, processar, (model, instancia.pk, campo, getattr(instancia, campo).name))
+                    for campo in pendentes(instancia)
+                ]
+                if model is Mapas and mosaico.pendente(instancia):
+                    trabalhos.append(('mosaico', mosaico.processar, (instancia.pk, instancia.mapa.name)))
+                for campo, funcao, argumentos in trabalhos:
+                    try:
+                        funcao(*argumentos)
+                        total += 1
+                    except Exception as erro:
+                        falhas += 1
+                        self.stderr.write(f'{nome} {instancia.pk} ({campo}): {erro}')
+            self.stdout.write(self.style.SUCCESS(f'{nome}: {total} imagem(ns) processada(s), {falhas} falha(s).'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from app.cache import cache_respostas, etiquetas
+from app.notas import recalcular_notas
+
+
+class Command(BaseCommand):
+    help = 'Recalcula Loja.nota e Loja.total_avaliacoes a partir das avaliações.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loja', type=int, action='append', help='Recalcula apenas as lojas informadas.')
+
+    def handle(self, *args, **options):
+        from app.models import Loja
+
+        lojas = Loja.objects.filter(pk__in=options['loja']) if options['loja'] else None
+        total = recalcular_notas(lojas)
+        # UPDATE em lote, sem signals: invalida as respostas das lojas à mão
+        if lojas is None:
+            cache_respostas.limpar()
+        else:
+            cache_respostas.invalidar(etiquetas(Loja, options['loja']))
+        self.stdout.write(self.style.SUCCESS(f'{total} loja(s) recalculada(s).'))
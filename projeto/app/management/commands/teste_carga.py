@@ -0,0 +1,94 @@
+import http.client
+import statistics
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+ROTAS = [
+    '/api/produtos/',
+    '/api/lojas/?limite=20',
+    '/api/categorias/',
+    '/api/pesquisa/?nome=artesanato',
+    '/api/produtos-recomendados/',
+    '/api/meu-perfil/',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Teste de carga contra um servidor já rodando (ex.: gunicorn -c gunicorn.conf.py com '
+        'SERVIDOR=wsgi e depois com SERVIDOR=asgi): conexões keep-alive em paralelo pelas rotas de '
+        'leitura, autenticadas com um JWT do usuário, e requisições por segundo, p50 e p99 por rota.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--usuario', required=True, help='username de um cliente cadastrado')
+        parser.add_argument('--conexoes', type=int, default=32)
+        parser.add_argument('--duracao', type=float, default=20, help='segundos medidos')
+        parser.add_argument('--aquecimento', type=float, default=3, help='segundos descartados antes de medir')
+        parser.add_argument('--rota', action='append', dest='rotas', help=f'repetível; padrão: {", ".join(ROTAS)}')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['usuario']).first()
+        if user is None:
+            raise CommandError(f"Usuário '{options['usuario']}' não encontrado.")
+        endereco = urlsplit(options['url'])
+        cabecalhos = {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'}
+        rotas = options['rotas'] or ROTAS
+
+        inicio = time.monotonic() + options['aquecimento']
+        fim = inicio + options['duracao']
+        tempos, erros = defaultdict(list), defaultdict(int)
+        trava = threading.Lock()
+
+        def conexao(numero):
+            cliente = http.client.HTTPConnection(endereco.hostname, endereco.port or 80, timeout=30)
+            medidos, falhas = defaultdict(list), defaultdict(int)
+            i = numero
+            while (agora := time.monotonic()) < fim:
+                rota = rotas[i % len(rotas)]
+                i += 1
+                try:
+                    cliente.request('GET', rota, headers=cabecalhos)
+                    resposta = cliente.getresponse()
+                    resposta.read()
+                    ok = resposta.status == 200
+                except (OSError, http.client.HTTPException):
+                    cliente.close()
+                    ok = False
+                if agora >= inicio:
+                    if ok:
+                        medidos[rota].append(time.monotonic() - agora)
+                    else:
+                        falhas[rota] += 1
+            cliente.close()
+            with trava:
+                for rota, lista in medidos.items():
+                    tempos[rota].extend(lista)
+                for rota, total in falhas.items():
+                    erros[rota] += total
+
+        threads = [threading.Thread(target=conexao, args=(n, )) for n in range(options['conexoes'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.stdout.write(f"{'rota':<36} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'erros':>6}")
+        for rota in [*rotas, 'total']:
+            lista = [t for lista in tempos.values() for t in lista] if rota == 'total' else tempos[rota]
+            falhas = sum(erros.values()) if rota == 'total' else erros[rota]
+            if len(lista) < 2:
+                self.stdout.write(f'{rota:<36} {"-":>8} {"-":>8} {"-":>8} {falhas:>6}')
+                continue
+            percentis = statistics.quantiles(lista, n=100)
+            self.stdout.write(
+                f'{rota:<36} {len(lista) / options["duracao"]:>8.1f} {percentis[49] * 1000:>8.1f} '
+                f'{percentis[98] * 1000:>8.1f} {falhas:>6}'
+            )
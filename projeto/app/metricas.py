@@ -0,0 +1,112 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import AcaoUsuario, TotemPessoal, AgregadoAcao, AgregadoTotem, MarcaAgregacao
+
+
+# Agregação incremental de métricas. Cada fonte tem uma marca (MarcaAgregacao)
+# com o último id processado; cada execução lê só os eventos novos, conta por
+# hora e por dia e soma nos agregados existentes.
+
+PERIODOS = {
+    'hora': TruncHour,
+    'dia': TruncDay,
+}
+
+FONTES = {
+    'acoes': {
+        'model': AcaoUsuario,
+        'agregado': AgregadoAcao,
+        'data': 'timestamp',
+        'gravacao': 'gravado_em',
+        'dimensoes': ('acao', 'loja_id', 'produto_id'),
+    },
+    'totens': {
+        'model': TotemPessoal,
+        'agregado': AgregadoTotem,
+        'data': 'criacao',
+        'gravacao': 'criacao',
+        'dimensoes': ('tipo_usuario', 'faixa_etaria', 'genero', 'categoria_id'),
+    },
+}
+
+
+def agregar(nome, lote=10000):
+    # Processa até `lote` eventos novos da fonte; devolve quantos foram agregados
+    fonte = FONTES[nome]
+    model = fonte['model']
+
+    with transaction.atomic():
+        marca, _ = MarcaAgregacao.objects.select_for_update().get_or_create(nome=nome)
+        novos = model.objects.filter(pk__gt=marca.ultimo_id).order_by('pk')
+
+        # Eventos gravados há pouco ficam para a próxima execução: uma transação
+        # ainda aberta pode gravar um id menor depois que a marca já passou dele.
+        # Conta o momento do INSERT, não o do evento: as ações chegam em lotes
+        # da fila (app/eventos.py), com o timestamp de quando foram feitas
+        margem = getattr(settings, 'METRICAS_MARGEM_SEGUNDOS', 10)
+        recente = novos.filter(**{f"{fonte['gravacao']}__gte": timezone.now() - timedelta(seconds=margem)})
+        limite = recente.values_list('pk', flat=True).first()
+        if limite is not None:
+            novos = novos.filter(pk__lt=limite)
+
+        ids = list(novos.values_list('pk', flat=True)[:lote])
+        if not ids:
+            return 0
+        eventos = model.objects.filter(pk__gte=ids[0], pk__lte=ids[-1])
+
+        for periodo, truncar in PERIODOS.items():
+            contagens = (
+                eventos.annotate(inicio=truncar(fonte['data']))
+                .values('inicio', *fonte['dimensoes'])
+                .annotate(total=Count('pk'))
+                .order_by()
+            )
+            _somar(fonte['agregado'], periodo, fonte['dimensoes'], list(contagens))
+
+        marca.ultimo_id = ids[-1]
+        marca.save(update_fields=['ultimo_id', 'atualizacao'])
+    return len(ids)
+
+
+def agregar_tudo(lote=10000):
+    totais = {}
+    for nome in FONTES:
+        totais[nome] = 0
+        while True:
+            processados = agregar(nome, lote)
+            totais[nome] += processados
+            if processados < lote:
+                break
+    return totais
+
+
+def _somar(agregado, periodo, dimensoes, contagens):
+    if not contagens:
+        return
+    chave = lambda linha: (linha['inicio'],) + tuple(linha[d] for d in dimensoes)
+
+    existentes = {
+        chave(linha): (linha['pk'], linha['total'])
+        for linha in agregado.objects.filter(
+            periodo=periodo, inicio__in={c['inicio'] for c in contagens}
+        ).values('pk', 'total', 'inicio', *dimensoes)
+    }
+
+    atualizar, criar = [], []
+    for linha in contagens:
+        existente = existentes.get(chave(linha))
+        if existente is None:
+            campos = {d: linha[d] for d in ('inicio',) + dimensoes}
+            criar.append(agregado(periodo=periodo, total=linha['total'], **campos))
+        else:
+            pk, total = existente
+            atualizar.append(agregado(pk=pk, total=total + linha['total']))
+
+    agregado.objects.bulk_create(criar)
+    agregado.objects.bulk_update(atualizar, ['total'])
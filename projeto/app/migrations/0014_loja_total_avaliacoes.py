@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-18 15:31
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def preencher_notas(apps, schema_editor):
+    Loja = apps.get_model('app', 'Loja')
+    Avaliacao = apps.get_model('app', 'Avaliacao')
+    avaliacoes = Avaliacao.objects.filter(loja=OuterRef('pk')).order_by().values('loja')
+    Loja.objects.update(
+        nota=Coalesce(Subquery(avaliacoes.annotate(media=Avg('nota')).values('media')), 0.0),
+        total_avaliacoes=Coalesce(Subquery(avaliacoes.annotate(total=Count('pk')).values('total')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_rename_cpf_cnpj_lojista_cnpj_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loja',
+            name='total_avaliacoes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(preencher_notas, migrations.RunPython.noop),
+    ]
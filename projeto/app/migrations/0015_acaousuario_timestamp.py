@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 15:38
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_loja_total_avaliacoes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='acaousuario',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
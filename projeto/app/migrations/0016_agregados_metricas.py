@@ -0,0 +1,54 @@
+# Generated by Django 5.2 on 2026-10-18 15:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_acaousuario_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarcaAgregacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=50, unique=True)),
+                ('ultimo_id', models.BigIntegerField(default=0)),
+                ('atualizacao', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AgregadoAcao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodo', models.CharField(choices=[('hora', 'Hora'), ('dia', 'Dia')], max_length=4)),
+                ('inicio', models.DateTimeField()),
+                ('acao', models.CharField(max_length=100)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('loja', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='agregados_acoes', to='app.loja')),
+                ('produto', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='agregados_acoes', to='app.produto')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['periodo', 'inicio'], name='agregadoacao_periodo_inicio'), models.Index(fields=['loja', 'periodo', 'inicio'], name='agregadoacao_loja_periodo')],
+            },
+        ),
+        migrations.CreateModel(
+            name='AgregadoTotem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodo', models.CharField(choices=[('hora', 'Hora'), ('dia', 'Dia')], max_length=4)),
+                ('inicio', models.DateTimeField()),
+                ('tipo_usuario', models.CharField(max_length=20)),
+                ('faixa_etaria', models.CharField(max_length=10)),
+                ('genero', models.CharField(max_length=50)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('categoria', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='agregados_totem', to='app.categoria')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['periodo', 'inicio'], name='agregadototem_periodo_inicio')],
+            },
+        ),
+    ]
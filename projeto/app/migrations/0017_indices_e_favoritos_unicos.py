@@ -0,0 +1,68 @@
+# Generated by Django 5.2 on 2026-10-18 15:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def remover_favoritos_duplicados(apps, schema_editor):
+    # Mantém o registro mais antigo de cada par antes de criar as restrições únicas
+    for modelo, campo in (('ProdutoFavorito', 'produto'), ('LojaFavorita', 'loja')):
+        Favorito = apps.get_model('app', modelo)
+        manter = Favorito.objects.values('cliente', campo).annotate(primeiro=models.Min('id')).values('primeiro')
+        Favorito.objects.exclude(id__in=manter).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_agregados_metricas'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remover_favoritos_duplicados, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='acaousuario',
+            index=models.Index(fields=['-timestamp', '-id'], name='acaousuario_timestamp'),
+        ),
+        migrations.AddIndex(
+            model_name='acaousuario',
+            index=models.Index(fields=['loja', '-timestamp', '-id'], name='acaousuario_loja_timestamp'),
+        ),
+        migrations.AddIndex(
+            model_name='acaousuario',
+            index=models.Index(fields=['produto', '-timestamp', '-id'], name='acaousuario_produto_timestamp'),
+        ),
+        migrations.AddIndex(
+            model_name='acaousuario',
+            index=models.Index(fields=['usuario', '-timestamp'], name='acaousuario_usuario_timestamp'),
+        ),
+        migrations.AddIndex(
+            model_name='avaliacao',
+            index=models.Index(fields=['loja', '-criacao', '-id'], name='avaliacao_loja_criacao'),
+        ),
+        migrations.AddIndex(
+            model_name='loja',
+            index=models.Index(fields=['-criacao', '-id'], name='loja_criacao'),
+        ),
+        migrations.AddIndex(
+            model_name='loja',
+            index=models.Index(fields=['ativo', 'criacao'], name='loja_ativo_criacao'),
+        ),
+        migrations.AddIndex(
+            model_name='produto',
+            index=models.Index(fields=['-criacao', '-id'], name='produto_criacao'),
+        ),
+        migrations.AddIndex(
+            model_name='produto',
+            index=models.Index(fields=['ativo', 'criacao'], name='produto_ativo_criacao'),
+        ),
+        migrations.AddConstraint(
+            model_name='lojafavorita',
+            constraint=models.UniqueConstraint(fields=('cliente', 'loja'), name='lojafavorita_cliente_loja'),
+        ),
+        migrations.AddConstraint(
+            model_name='produtofavorito',
+            constraint=models.UniqueConstraint(fields=('cliente', 'produto'), name='produtofavorito_cliente_produto'),
+        ),
+    ]
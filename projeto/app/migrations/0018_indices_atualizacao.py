@@ -0,0 +1,21 @@
+# Generated by Django 5.2 on 2026-10-18 15:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_indices_e_favoritos_unicos'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='loja',
+            index=models.Index(fields=['atualizacao'], name='loja_atualizacao'),
+        ),
+        migrations.AddIndex(
+            model_name='produto',
+            index=models.Index(fields=['atualizacao'], name='produto_atualizacao'),
+        ),
+    ]
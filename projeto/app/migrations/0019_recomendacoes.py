@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-18 15:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0018_indices_atualizacao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Recomendacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('loja', 'Loja'), ('produto', 'Produto')], max_length=7)),
+                ('itens', models.JSONField(default=list)),
+                ('pontuacoes', models.JSONField(default=list)),
+                ('minimo', models.FloatField(blank=True, null=True)),
+                ('perfil', models.JSONField(default=dict)),
+                ('desatualizada_em', models.DateTimeField(blank=True, null=True)),
+                ('atualizacao', models.DateTimeField(auto_now=True)),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recomendacoes', to='app.cliente')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tipo', 'desatualizada_em'], name='recomendacao_desatualizada')],
+                'constraints': [models.UniqueConstraint(fields=('cliente', 'tipo'), name='recomendacao_cliente_tipo')],
+            },
+        ),
+    ]
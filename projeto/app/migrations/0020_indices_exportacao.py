@@ -0,0 +1,21 @@
+# Generated by Django 5.2 on 2026-10-18 16:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0019_recomendacoes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='avaliacao',
+            index=models.Index(fields=['criacao', 'id'], name='avaliacao_criacao'),
+        ),
+        migrations.AddIndex(
+            model_name='totempessoal',
+            index=models.Index(fields=['criacao', 'id'], name='totempessoal_criacao'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-18 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0020_indices_exportacao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArquivoAcoes',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateField()),
+                ('parte', models.PositiveIntegerField()),
+                ('arquivo', models.CharField(max_length=255)),
+                ('linhas', models.PositiveIntegerField()),
+                ('inicio', models.DateTimeField()),
+                ('fim', models.DateTimeField()),
+                ('ultimo_id', models.BigIntegerField()),
+                ('criacao', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('mes', 'parte'), name='arquivoacoes_mes_parte')],
+            },
+        ),
+    ]
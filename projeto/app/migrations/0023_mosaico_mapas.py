@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 16:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0022_variantes_imagens'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mapas',
+            name='mosaico',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-18 16:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0023_mosaico_mapas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PosicaoLoja',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('criacao', models.DateTimeField(auto_now_add=True)),
+                ('atualizacao', models.DateTimeField(auto_now=True)),
+                ('ativo', models.BooleanField(default=True)),
+                ('x', models.FloatField()),
+                ('y', models.FloatField()),
+                ('loja', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='posicoes', to='app.loja')),
+                ('mapa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='posicoes', to='app.mapas')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('mapa', 'loja'), name='posicaoloja_mapa_loja')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-18 16:37
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0025_caminhos_mapas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Remocao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=20)),
+                ('objeto_id', models.BigIntegerField()),
+                ('removido_em', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['removido_em', 'id'], name='remocao_removido_em')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 17:03
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0026_remocoes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='acaousuario',
+            name='gravado_em',
+            field=models.DateTimeField(db_default=django.db.models.functions.datetime.Now(), editable=False),
+        ),
+    ]
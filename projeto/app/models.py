@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models.functions import Now
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 class Base(models.Model):
@@ -12,11 +14,20 @@ class Base(models.Model):
 class AcaoUsuario(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE)
     acao = models.CharField(max_length=100)  # ex: "entrou na loja", "visualizou produto"
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)  # momento da ação, não da gravação do lote
+    gravado_em = models.DateTimeField(db_default=Now(), editable=False)  # momento do INSERT, pelo relógio do banco
     loja = models.ForeignKey('Loja', null=True, blank=True, on_delete=models.SET_NULL)
     produto = models.ForeignKey('Produto', null=True, blank=True, on_delete=models.SET_NULL)
     detalhes = models.TextField(blank=True)  # opcional, para info adicional (ex: navegador, IP)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-timestamp', '-id'], name='acaousuario_timestamp'),
+            models.Index(fields=['loja', '-timestamp', '-id'], name='acaousuario_loja_timestamp'),
+            models.Index(fields=['produto', '-timestamp', '-id'], name='acaousuario_produto_timestamp'),
+            models.Index(fields=['usuario', '-timestamp'], name='acaousuario_usuario_timestamp'),
+        ]
+
     def __str__(self):
         return f'{self.usuario} fez {self.acao} em {self.timestamp}'
 
@@ -25,6 +36,7 @@ class Lojista(Base):
     telefone = models.CharField(max_length=20)
     cnpj = models.CharField(max_length=20)
     foto = models.ImageField(upload_to='lojistas/', blank=True, null=True)
+    variantes = models.JSONField(default=dict, blank=True, editable=False)  # tamanhos gerados das imagens (app/imagens.py)
     genero = models.CharField(max_length=50, blank=True, null=True)
     user = models.OneToOneField(User, on_delete=models.CASCADE)
 
@@ -51,6 +63,11 @@ class TotemPessoal(Base):
     genero = models.CharField(max_length=50)
     categoria = models.ForeignKey('Categoria', on_delete=models.SET_NULL, null=True, related_name='pesquisas_totem')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['criacao', 'id'], name='totempessoal_criacao'),  # exportação
+        ]
+
     def __str__(self):
         return f'{self.tipo_usuario} - {self.faixa_etaria}'
 
@@ -76,6 +93,7 @@ class Cliente(Base):
     cpf = models.CharField(max_length=15)
     telefone = models.CharField(max_length=20)
     foto = models.ImageField(upload_to='clientes/', blank=True, null=True)
+    variantes = models.JSONField(default=dict, blank=True, editable=False)  # tamanhos gerados das imagens (app/imagens.py)
     data_nascimento = models.CharField(max_length=20, blank=True, null=True)
     genero = models.CharField(max_length=50)
     tipo = models.CharField(max_length=20, choices=TIPO_CHOICES)    
@@ -101,17 +119,28 @@ class Cliente(Base):
 class Mapas(Base):
     loja = models.ForeignKey('Loja', on_delete=models.SET_NULL, null=True, related_name='mapas_lojas')
     mapa = models.ImageField(upload_to='produtos/', blank=True, null=True)
+    variantes = models.JSONField(default=dict, blank=True, editable=False)  # tamanhos gerados das imagens (app/imagens.py)
+    mosaico = models.JSONField(default=dict, blank=True, editable=False)  # tiles do mapa (app/mosaico.py)
+    caminhos = models.JSONField(default=dict, blank=True, editable=False)  # grafo de corredores (app/rotas.py)
 
     
 class Produto(Base):
     nome = models.CharField(max_length=255)
     descricao = models.TextField()
     imagem = models.ImageField(upload_to='produtos/', blank=True, null=True)
+    variantes = models.JSONField(default=dict, blank=True, editable=False)  # tamanhos gerados das imagens (app/imagens.py)
     loja = models.ForeignKey('Loja', on_delete=models.CASCADE, related_name='produtos')
     categorias = models.ManyToManyField(Categoria, related_name="produtos")
     cor = models.CharField(max_length=50)
     composicao = models.TextField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-criacao', '-id'], name='produto_criacao'),
+            models.Index(fields=['ativo', 'criacao'], name='produto_ativo_criacao'),
+            models.Index(fields=['atualizacao'], name='produto_atualizacao'),  # ETag das listagens
+        ]
+
     def __str__(self):
         return self.nome
 
@@ -125,12 +154,21 @@ class Loja(Base):
     localizacao = models.CharField(max_length=255, blank=True, null=True)
     lojista = models.ForeignKey(Lojista, on_delete=models.CASCADE, related_name='lojas')
     foto_da_loja = models.ImageField(upload_to='lojas/fotos/', blank=True, null=True)
+    variantes = models.JSONField(default=dict, blank=True, editable=False)  # tamanhos gerados das imagens (app/imagens.py)
     Instagram = models.TextField(blank=True, null=True)
     WhatsApp = models.TextField(blank=True, null=True)
     Website = models.TextField(blank=True, null=True)
     horario_funcionamento = models.CharField(max_length=255,blank=True, null=True)
     avaliacoes = models.ManyToManyField('Avaliacao', related_name='lojas', blank=True)
-    nota = models.FloatField(default=0)
+    nota = models.FloatField(default=0)  # média das avaliações, mantida por app/notas.py
+    total_avaliacoes = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-criacao', '-id'], name='loja_criacao'),
+            models.Index(fields=['ativo', 'criacao'], name='loja_ativo_criacao'),
+            models.Index(fields=['atualizacao'], name='loja_atualizacao'),  # ETag das listagens
+        ]
 
     def __str__(self):
         return self.nome
@@ -141,6 +179,12 @@ class Avaliacao(Base):
     nota = models.FloatField()
     comentario = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['loja', '-criacao', '-id'], name='avaliacao_loja_criacao'),
+            models.Index(fields=['criacao', 'id'], name='avaliacao_criacao'),  # exportação
+        ]
+
     def __str__(self):
         return f'{self.cliente.nome} avaliou {self.loja.nome}'
 
@@ -158,6 +202,11 @@ class ProdutoFavorito(Base):
         related_query_name='cliente_favorito'
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cliente', 'produto'], name='produtofavorito_cliente_produto'),
+        ]
+
     def __str__(self):
         return f'{self.cliente.nome} favoritou {self.produto.nome}'
 
@@ -175,6 +224,150 @@ class LojaFavorita(Base):
         related_query_name='cliente_favorita'
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cliente', 'loja'], name='lojafavorita_cliente_loja'),
+        ]
+
     def __str__(self):
         return f'{self.cliente.nome} favoritou {self.loja.nome}'
 
+
+# Posições das lojas nos mapas da feira, em pixels da imagem do mapa (origem
+# no canto superior esquerdo, como os tiles de app/mosaico.py). As consultas
+# de proximidade usam o índice em memória de app/espacial.py.
+
+class PosicaoLoja(Base):
+    loja = models.ForeignKey(Loja, on_delete=models.CASCADE, related_name='posicoes')
+    mapa = models.ForeignKey(Mapas, on_delete=models.CASCADE, related_name='posicoes')
+    x = models.FloatField()
+    y = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['mapa', 'loja'], name='posicaoloja_mapa_loja'),
+        ]
+
+    def __str__(self):
+        return f'{self.loja.nome} em ({self.x}, {self.y}) no mapa {self.mapa_id}'
+
+
+
+# Agregados de métricas (app/metricas.py): contagens por hora e por dia,
+# alimentadas incrementalmente a partir de AcaoUsuario e TotemPessoal.
+
+PERIODO_CHOICES = [
+    ('hora', 'Hora'),
+    ('dia', 'Dia'),
+]
+
+class AgregadoAcao(models.Model):
+    periodo = models.CharField(max_length=4, choices=PERIODO_CHOICES)
+    inicio = models.DateTimeField()
+    acao = models.CharField(max_length=100)
+    loja = models.ForeignKey('Loja', null=True, blank=True, on_delete=models.CASCADE, related_name='agregados_acoes')
+    produto = models.ForeignKey('Produto', null=True, blank=True, on_delete=models.CASCADE, related_name='agregados_acoes')
+    total = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['periodo', 'inicio'], name='agregadoacao_periodo_inicio'),
+            models.Index(fields=['loja', 'periodo', 'inicio'], name='agregadoacao_loja_periodo'),
+        ]
+
+    def __str__(self):
+        return f'{self.acao} ({self.periodo} {self.inicio}): {self.total}'
+
+class AgregadoTotem(models.Model):
+    periodo = models.CharField(max_length=4, choices=PERIODO_CHOICES)
+    inicio = models.DateTimeField()
+    tipo_usuario = models.CharField(max_length=20)
+    faixa_etaria = models.CharField(max_length=10)
+    genero = models.CharField(max_length=50)
+    categoria = models.ForeignKey('Categoria', null=True, blank=True, on_delete=models.CASCADE, related_name='agregados_totem')
+    total = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['periodo', 'inicio'], name='agregadototem_periodo_inicio'),
+        ]
+
+    def __str__(self):
+        return f'{self.tipo_usuario} - {self.faixa_etaria} ({self.periodo} {self.inicio}): {self.total}'
+
+class MarcaAgregacao(models.Model):
+    # Último id já agregado de cada fonte
+    nome = models.CharField(max_length=50, unique=True)
+    ultimo_id = models.BigIntegerField(default=0)
+    atualizacao = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.nome}: {self.ultimo_id}'
+
+
+# Recomendações pré-calculadas (app/recomendacao.py): top-K de lojas e de
+# produtos por cliente, refeito pelo comando atualizar_recomendacoes.
+
+class Recomendacao(models.Model):
+    TIPO_CHOICES = [
+        ('loja', 'Loja'),
+        ('produto', 'Produto'),
+    ]
+    cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE, related_name='recomendacoes')
+    tipo = models.CharField(max_length=7, choices=TIPO_CHOICES)
+    itens = models.JSONField(default=list)  # ids em ordem de pontuação
+    pontuacoes = models.JSONField(default=list)
+    minimo = models.FloatField(null=True, blank=True)  # pontuação do k-ésimo item; nula se a lista não está cheia
+    perfil = models.JSONField(default=dict)  # peso de cada categoria para o cliente
+    desatualizada_em = models.DateTimeField(null=True, blank=True)  # entradas do cliente mudaram desde o cálculo
+    atualizacao = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cliente', 'tipo'], name='recomendacao_cliente_tipo'),
+        ]
+        indexes = [
+            models.Index(fields=['tipo', 'desatualizada_em'], name='recomendacao_desatualizada'),
+        ]
+
+    def __str__(self):
+        return f'{self.tipo}s recomendados para {self.cliente}'
+
+
+# Partes de AcaoUsuario movidas para arquivos comprimidos (app/retencao.py).
+# Cada execução do arquivar_acoes cria no máximo uma parte por mês.
+
+class ArquivoAcoes(models.Model):
+    mes = models.DateField()  # primeiro dia do mês
+    parte = models.PositiveIntegerField()
+    arquivo = models.CharField(max_length=255)  # relativo ao DIRETORIO da retenção
+    linhas = models.PositiveIntegerField()
+    inicio = models.DateTimeField()  # menor e maior timestamp da parte
+    fim = models.DateTimeField()
+    ultimo_id = models.BigIntegerField()  # ações do mês com id até este já estão no arquivo
+    criacao = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['mes', 'parte'], name='arquivoacoes_mes_parte'),
+        ]
+
+    def __str__(self):
+        return self.arquivo
+
+
+# Registro das exclusões do catálogo, para que a sincronização incremental
+# (app/sincronizacao.py) avise os clientes offline. Apagado após RETENCAO_DIAS.
+
+class Remocao(models.Model):
+    tipo = models.CharField(max_length=20)  # recurso da sincronização: lojas, produtos...
+    objeto_id = models.BigIntegerField()
+    removido_em = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['removido_em', 'id'], name='remocao_removido_em'),
+        ]
+
+    def __str__(self):
+        return f'{self.tipo} {self.objeto_id} removido em {self.removido_em}'
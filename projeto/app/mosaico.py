@@ -0,0 +1,135 @@
+import hashlib
+import io
+import json
+import math
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+from rest_framework.negotiation import BaseContentNegotiation
+
+from .cache import cache_respostas, etiquetas
+from .imagens import preparar
+from .models import Mapas
+
+
+# Mosaico dos mapas da feira. Depois do envio de um mapa, o pool de imagens
+# (app/imagens.py) corta a imagem em tiles quadrados de TAMANHO pixels numa
+# pirâmide de zooms: no zoom máximo a imagem fica no tamanho original e cada
+# zoom abaixo tem metade da largura e da altura, até caber num único tile. O
+# visualizador baixa só os tiles visíveis em vez do mapa inteiro.
+#
+# Os tiles ficam em PASTA/<sha256 do conteúdo>/<z>/<x>/<y>.webp e o
+# mosaico.json é gravado por último, marcando o mosaico como completo. O
+# endereço dos tiles leva a versão (início do hash), então nunca muda de
+# conteúdo e pode ficar em cache indefinidamente.
+#
+# Configuração (settings.MOSAICO):
+#   TAMANHO    lado dos tiles em pixels
+#   QUALIDADE  qualidade do WebP
+#   PASTA      pasta dos mosaicos no storage
+
+PADRAO = {
+    'TAMANHO': 256,
+    'QUALIDADE': 80,
+    'PASTA': 'mosaicos',
+}
+
+# um ano: o endereço muda junto com a imagem
+CACHE_TILES = 365 * 24 * 60 * 60
+
+
+def configuracao():
+    return {**PADRAO, **getattr(settings, 'MOSAICO', {})}
+
+
+def pendente(mapa):
+    return bool(mapa.mapa) and mapa.mosaico.get('original') != mapa.mapa.name
+
+
+def processar(pk, nome):
+    # Gera (ou reaproveita) o mosaico de `nome` e o registra no mapa
+    config = configuracao()
+    storage = Mapas._meta.get_field('mapa').storage
+    with storage.open(nome, 'rb') as arquivo:
+        dados = arquivo.read()
+    conteudo = hashlib.sha256(dados).hexdigest()
+    pasta = f"{config['PASTA']}/{conteudo[:2]}/{conteudo}"
+
+    manifesto = f'{pasta}/mosaico.json'
+    if storage.exists(manifesto):
+        with storage.open(manifesto, 'rb') as arquivo:
+            mosaico = json.load(arquivo)
+    else:
+        mosaico = {'versao': conteudo[:16], 'pasta': pasta, **gerar(dados, pasta, storage, config)}
+        storage.save(manifesto, ContentFile(json.dumps(mosaico).encode()))
+
+    with transaction.atomic():
+        atual = Mapas.objects.select_for_update().filter(pk=pk).values_list('mapa', flat=True).first()
+        # o mapa pode ter sido excluído ou ter recebido outra imagem nesse meio tempo
+        if atual != nome:
+            return
+        Mapas.objects.filter(pk=pk).update(mosaico={**mosaico, 'original': nome}, atualizacao=timezone.now())
+    cache_respostas.invalidar(etiquetas(Mapas, [pk]))
+
+
+def gerar(dados, pasta, storage, config):
+    tamanho = config['TAMANHO']
+    imagem = preparar(Image.open(io.BytesIO(dados)))
+    largura, altura = imagem.size
+    zoom_maximo = max(0, math.ceil(math.log2(max(largura, altura) / tamanho)))
+
+    # do zoom máximo para o 0, cada nível reduzido do anterior
+    for zoom in range(zoom_maximo, -1, -1):
+        if zoom < zoom_maximo:
+            imagem = imagem.resize(
+                (max(1, math.ceil(imagem.width / 2)), max(1, math.ceil(imagem.height / 2))),
+                Image.Resampling.LANCZOS,
+            )
+        for x in range(math.ceil(imagem.width / tamanho)):
+            for y in range(math.ceil(imagem.height / tamanho)):
+                tile = imagem.crop((x * tamanho, y * tamanho, (x + 1) * tamanho, (y + 1) * tamanho))
+                if (x + 1) * tamanho > imagem.width or (y + 1) * tamanho > imagem.height:
+                    # tiles da borda completados com transparência
+                    tile = tile.convert('RGBA')
+                    fundo = Image.new('RGBA', tile.size, (0, 0, 0, 0))
+                    fundo.paste(tile.crop((0, 0, imagem.width - x * tamanho, imagem.height - y * tamanho)))
+                    tile = fundo
+                saida = io.BytesIO()
+                tile.save(saida, 'WEBP', quality=config['QUALIDADE'])
+                destino = f'{pasta}/{zoom}/{x}/{y}.webp'
+                # sobra de uma geração interrompida: o storage salvaria com outro nome
+                if storage.exists(destino):
+                    storage.delete(destino)
+                storage.save(destino, ContentFile(saida.getvalue()))
+
+    return {'largura': largura, 'altura': altura, 'tamanho': tamanho, 'zoom_maximo': zoom_maximo}
+
+
+def caminho_tile(mosaico, versao, z, x, y):
+    # Nome do tile no storage, ou None se não existe nessa versão do mosaico
+    if not mosaico or mosaico['versao'] != versao or z > mosaico['zoom_maximo']:
+        return None
+    escala = 2 ** (mosaico['zoom_maximo'] - z)
+    colunas = math.ceil(math.ceil(mosaico['largura'] / escala) / mosaico['tamanho'])
+    linhas = math.ceil(math.ceil(mosaico['altura'] / escala) / mosaico['tamanho'])
+    if x >= colunas or y >= linhas:
+        return None
+    return f"{mosaico['pasta']}/{z}/{x}/{y}.webp"
+
+
+def abrir_tile(nome):
+    return Mapas._meta.get_field('mapa').storage.open(nome, 'rb')
+
+
+class SemNegociacao(BaseContentNegotiation):
+    # Os tiles são arquivos, não passam por renderer; erros saem no primeiro
+    # renderer da view, seja qual for o Accept (ex.: image/webp)
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
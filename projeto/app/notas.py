@@ -0,0 +1,51 @@
+from django.db.models import Avg, Case, Count, F, FloatField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Loja, Avaliacao
+
+
+# Loja.nota guarda a média das avaliações e Loja.total_avaliacoes a quantidade.
+# Cada mudança em Avaliacao ajusta os dois com um único UPDATE em O(1), sem
+# reagregar a tabela de avaliações. Os UPDATEs usam F() para serem atômicos
+# e também avançam `atualizacao`, que valida as respostas condicionais (ETag).
+
+def adicionar_nota(loja_id, nota):
+    Loja.objects.filter(pk=loja_id).update(
+        nota=(F('nota') * F('total_avaliacoes') + nota) / (F('total_avaliacoes') + 1.0),
+        total_avaliacoes=F('total_avaliacoes') + 1,
+        atualizacao=timezone.now(),
+    )
+
+
+def remover_nota(loja_id, nota):
+    Loja.objects.filter(pk=loja_id).update(
+        nota=Case(
+            When(total_avaliacoes__lte=1, then=Value(0.0)),
+            default=(F('nota') * F('total_avaliacoes') - nota) / (F('total_avaliacoes') - 1.0),
+            output_field=FloatField(),
+        ),
+        total_avaliacoes=Case(
+            When(total_avaliacoes__lte=1, then=Value(0)),
+            default=F('total_avaliacoes') - 1,
+        ),
+        atualizacao=timezone.now(),
+    )
+
+
+def trocar_nota(loja_id, anterior, nova):
+    Loja.objects.filter(pk=loja_id, total_avaliacoes__gt=0).update(
+        nota=F('nota') + (nova - anterior) / F('total_avaliacoes'),
+        atualizacao=timezone.now(),
+    )
+
+
+def recalcular_notas(lojas=None):
+    # Reconstrói os valores a partir das avaliações (backfill e correção de desvios)
+    avaliacoes = Avaliacao.objects.filter(loja=OuterRef('pk')).order_by().values('loja')
+    queryset = Loja.objects.all() if lojas is None else lojas
+    return queryset.update(
+        nota=Coalesce(Subquery(avaliacoes.annotate(media=Avg('nota')).values('media')), 0.0),
+        total_avaliacoes=Coalesce(Subquery(avaliacoes.annotate(total=Count('pk')).values('total')), 0),
+        atualizacao=timezone.now(),
+    )
@@ -0,0 +1,242 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from contextlib import closing
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from . import busca, similares, sincronizacao
+
+
+# Pacotes offline do catálogo para os totens. Um pacote é um único arquivo
+# SQLite (comprimido com gzip) com setores, categorias, lojas, produtos e
+# mapas, nos mesmos campos da sincronização (app/sincronizacao.py), mais o
+# índice de busca e os itens parecidos: com ele o totem responde às telas sem
+# chamar a API.
+#
+# Tudo fica numa só tabela, itens(secao, chave, hash, dados), com um JSON por
+# item e o hash desse JSON. A versão do pacote é o hash da lista de
+# (secao, chave, hash): montar de novo sem nada ter mudado dá a mesma versão, e
+# nenhum arquivo novo. A diferença entre duas versões sai dessa comparação
+# (só os itens novos ou alterados, mais a tabela remocoes) e é gravada na
+# primeira vez em que é pedida; os arquivos nunca mudam depois de publicados.
+#
+# Seções:
+#   setores, categorias, lojas, produtos, mapas   chave: id; dados: o objeto
+#   busca_loja, busca_produto                     chave: termo; dados: [[id, frequência], ...]
+#   tamanhos_loja, tamanhos_produto               chave: id; dados: termos do documento (BM25)
+#   similares_loja, similares_produto             chave: id; dados: ids parecidos, em ordem
+#   config                                        chave: busca; normalização e parâmetros do BM25
+#
+# Configuração (settings.PACOTES):
+#   DIRETORIO  onde ficam os pacotes e as diferenças
+#   MANTER     versões guardadas; diferenças só a partir delas
+#   LOTE       objetos lidos por consulta na montagem
+
+PADRAO = {
+    'DIRETORIO': Path(settings.BASE_DIR) / 'pacotes',
+    'MANTER': 5,
+    'LOTE': 1000,
+}
+
+FORMATO = 1
+
+ESQUEMA = '''
+    CREATE TABLE itens (
+        secao TEXT NOT NULL, chave TEXT NOT NULL, hash TEXT NOT NULL, dados TEXT NOT NULL,
+        PRIMARY KEY (secao, chave)
+    ) WITHOUT ROWID;
+    CREATE TABLE remocoes (secao TEXT NOT NULL, chave TEXT NOT NULL, PRIMARY KEY (secao, chave)) WITHOUT ROWID;
+    CREATE TABLE metadados (nome TEXT PRIMARY KEY, valor TEXT NOT NULL) WITHOUT ROWID;
+'''
+
+_trava = threading.Lock()
+
+
+def configuracao():
+    return {**PADRAO, **getattr(settings, 'PACOTES', {})}
+
+
+def diretorio():
+    return Path(configuracao()['DIRETORIO'])
+
+
+def caminho(versao, desde=None):
+    return diretorio() / (f'{desde}-{versao}.sqlite.gz' if desde else f'{versao}.sqlite.gz')
+
+
+def versoes():
+    # [{'versao', 'criado_em', 'tamanho'}], da mais nova para a mais antiga
+    try:
+        return json.loads((diretorio() / 'versoes.json').read_text())
+    except FileNotFoundError:
+        return []
+
+
+def construir():
+    # Monta o pacote e o publica se o conteúdo mudou; devolve (versao, nova)
+    destino = diretorio()
+    destino.mkdir(parents=True, exist_ok=True)
+    descritor, temporario = tempfile.mkstemp(dir=destino, suffix='.sqlite')
+    os.close(descritor)
+    try:
+        with _conectar(temporario) as conexao:
+            conexao.executescript(ESQUEMA)
+            conexao.executemany('INSERT INTO itens VALUES (?, ?, ?, ?)', _linhas(itens()))
+            conexao.commit()
+            versao = _versao(conexao)
+            anteriores = versoes()
+            if any(item['versao'] == versao for item in anteriores):
+                # o mesmo conteúdo de uma versão guardada (ex.: uma alteração desfeita)
+                _gravar_versoes(sorted(anteriores, key=lambda item: item['versao'] != versao))
+                return versao, False
+            criado_em = timezone.now().isoformat()
+            _gravar_metadados(conexao, versao=versao, criado_em=criado_em)
+        _publicar(temporario, caminho(versao))
+    finally:
+        os.unlink(temporario)
+
+    lista = [{'versao': versao, 'criado_em': criado_em, 'tamanho': caminho(versao).stat().st_size}, *anteriores]
+    _gravar_versoes(lista[:configuracao()['MANTER']])
+    for item in lista[configuracao()['MANTER']:]:
+        _apagar(item['versao'])
+    return versao, True
+
+
+def arquivo(versao, desde=None):
+    # Caminho do pacote completo ou da diferença desde `desde`; None se alguma
+    # das versões não está guardada
+    guardadas = {item['versao'] for item in versoes()}
+    if versao not in guardadas or (desde and desde not in guardadas):
+        return None
+    if not desde or desde == versao:
+        return caminho(versao)
+    destino = caminho(versao, desde)
+    if not destino.exists():
+        with _trava:
+            if not destino.exists():
+                _diferenca(desde, versao, destino)
+    return destino
+
+
+def itens():
+    # (secao, chave, dados) de tudo o que vai no pacote
+    lote = configuracao()['LOTE']
+    for nome, (model, montar) in sincronizacao.RECURSOS.items():
+        ultimo = 0
+        while True:
+            dados, lidas = montar(model._default_manager.filter(pk__gt=ultimo).order_by('pk')[:lote], None)
+            if not lidas:
+                break
+            for objeto in dados:
+                yield nome, objeto['id'], objeto
+            ultimo = lidas[-1][1]
+
+    for tipo in ('loja', 'produto'):
+        postings = defaultdict(list)
+        for pk, termos in busca.documentos(tipo):
+            yield f'tamanhos_{tipo}', pk, len(termos)
+            for termo, frequencia in Counter(termos).items():
+                postings[termo].append([pk, frequencia])
+        for termo, lista in postings.items():
+            yield f'busca_{tipo}', termo, sorted(lista)
+
+        tabela = similares.indice_similares.tabela(tipo)
+        if tabela is not None:
+            for linha in tabela:
+                ids = linha['ids']
+                yield f'similares_{tipo}', int(linha['id']), ids[ids > 0].tolist()
+
+    indice = busca.IndiceInvertido()
+    yield 'config', 'busca', {
+        'k1': indice.k1, 'b': indice.b, 'pesos': busca.PESOS, 'stopwords': sorted(busca.STOPWORDS),
+    }
+
+
+def _linhas(itens):
+    for secao, chave, dados in itens:
+        texto = json.dumps(dados, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':'))
+        yield secao, str(chave), hashlib.sha256(texto.encode()).hexdigest()[:16], texto
+
+
+def _versao(conexao):
+    resumo = hashlib.sha256(f'{FORMATO}\n'.encode())
+    for secao, chave, hash_ in conexao.execute('SELECT secao, chave, hash FROM itens ORDER BY secao, chave'):
+        resumo.update(f'{secao}\t{chave}\t{hash_}\n'.encode())
+    return resumo.hexdigest()[:24]
+
+
+def _diferenca(desde, versao, destino):
+    # Pacote só com o que mudou de `desde` para `versao`, montado pelo próprio
+    # SQLite sobre as duas versões descomprimidas
+    with tempfile.TemporaryDirectory(dir=diretorio()) as pasta:
+        antigo, novo, saida = (os.path.join(pasta, nome) for nome in ('antigo', 'novo', 'diferenca'))
+        for origem, copia in ((caminho(desde), antigo), (caminho(versao), novo)):
+            with gzip.open(origem, 'rb') as entrada, open(copia, 'wb') as saida_copia:
+                shutil.copyfileobj(entrada, saida_copia)
+
+        with _conectar(saida) as conexao:
+            conexao.executescript(ESQUEMA)
+            conexao.execute('ATTACH DATABASE ? AS antigo', (antigo, ))
+            conexao.execute('ATTACH DATABASE ? AS novo', (novo, ))
+            conexao.execute('''
+                INSERT INTO itens SELECT n.* FROM novo.itens n
+                LEFT JOIN antigo.itens a ON a.secao = n.secao AND a.chave = n.chave
+                WHERE a.hash IS NULL OR a.hash != n.hash
+            ''')
+            conexao.execute('''
+                INSERT INTO remocoes SELECT a.secao, a.chave FROM antigo.itens a
+                WHERE NOT EXISTS (SELECT 1 FROM novo.itens n WHERE n.secao = a.secao AND n.chave = a.chave)
+            ''')
+            criado_em = conexao.execute("SELECT valor FROM novo.metadados WHERE nome = 'criado_em'").fetchone()[0]
+            conexao.commit()
+            conexao.execute('DETACH DATABASE antigo')
+            conexao.execute('DETACH DATABASE novo')
+            _gravar_metadados(conexao, versao=versao, criado_em=criado_em, desde=desde)
+        _publicar(saida, destino)
+
+
+def _conectar(nome):
+    return closing(sqlite3.connect(nome))
+
+
+def _gravar_metadados(conexao, **valores):
+    conexao.executemany(
+        'INSERT INTO metadados VALUES (?, ?)', [('formato', str(FORMATO)), *valores.items()]
+    )
+    conexao.commit()
+    conexao.execute('VACUUM')
+
+
+def _publicar(origem, destino):
+    descritor, temporario = tempfile.mkstemp(dir=destino.parent, suffix='.gz')
+    try:
+        with open(origem, 'rb') as entrada, os.fdopen(descritor, 'wb') as bruto:
+            with gzip.GzipFile(fileobj=bruto, mode='wb', mtime=0) as saida:
+                shutil.copyfileobj(entrada, saida)
+        os.replace(temporario, destino)
+    except BaseException:
+        os.unlink(temporario)
+        raise
+
+
+def _gravar_versoes(lista):
+    descritor, temporario = tempfile.mkstemp(dir=diretorio(), suffix='.json')
+    with os.fdopen(descritor, 'w') as arquivo:
+        json.dump(lista, arquivo)
+    os.replace(temporario, diretorio() / 'versoes.json')
+
+
+def _apagar(versao):
+    # o pacote e as diferenças de ou para ele
+    for arquivo in diretorio().glob(f'*{versao}*.sqlite.gz'):
+        arquivo.unlink(missing_ok=True)
@@ -0,0 +1,111 @@
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class CursorPaginacao(BasePagination):
+    # Paginação por cursor (keyset) em (criacao, id), do mais novo para o mais antigo.
+    # O cursor guarda a posição do último item da página, então cada página é um
+    # único SELECT ... WHERE (criacao, id) < (x, y) LIMIT n, sem OFFSET.
+    # Modelos sem `criacao` (AcaoUsuario) usam `timestamp`.
+
+    page_size = api_settings.PAGE_SIZE or 50
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limite'
+    campos_ordem = ('criacao', 'timestamp')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.fechar(list(self.fatiar(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        # a mesma página pelo ORM assíncrono (app/assincrono.py)
+        return self.fechar([item async for item in self.fatiar(queryset, request)])
+
+    def fatiar(self, queryset, request):
+        self.request = request
+        self.campo = self.campo_ordem(queryset.model)
+        self.limite = self.get_page_size(request)
+
+        queryset = queryset.order_by(f'-{self.campo}', '-pk')
+        posicao = self.decodificar(request.query_params.get(self.cursor_query_param))
+        if posicao is not None:
+            valor, pk = posicao
+            queryset = queryset.filter(
+                Q(**{f'{self.campo}__lt': valor}) | Q(**{self.campo: valor, 'pk__lt': pk})
+            )
+        return queryset[:self.limite + 1]
+
+    def fechar(self, pagina):
+        self.proximo = None
+        if len(pagina) > self.limite:
+            pagina = pagina[:self.limite]
+            self.proximo = self.codificar(*self.posicao(pagina[-1]))
+        return pagina
+
+    def posicao(self, item):
+        # a leitura rápida (app/leitura.py) pagina linhas de values()
+        if isinstance(item, dict):
+            return item[self.campo], item['id']
+        return getattr(item, self.campo), item.pk
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if self.proximo is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.proximo)
+
+    def get_page_size(self, request):
+        try:
+            limite = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            limite = self.page_size
+        return max(1, min(limite, self.max_page_size))
+
+    def campo_ordem(self, model):
+        nomes = {campo.name for campo in model._meta.get_fields()}
+        for campo in self.campos_ordem:
+            if campo in nomes:
+                return campo
+        return 'pk'
+
+    def codificar(self, valor, pk):
+        texto = f'{valor.isoformat() if hasattr(valor, "isoformat") else valor}|{pk}'
+        return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+    def decodificar(self, cursor):
+        if not cursor:
+            return None
+        try:
+            texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+            valor, pk = texto.rsplit('|', 1)
+            valor = int(valor) if self.campo == 'pk' else parse_datetime(valor)
+            pk = int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            valor = None
+        if valor is None:
+            raise NotFound('Cursor inválido.')
+        return valor, pk
@@ -0,0 +1,345 @@
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .models import (
+    AcaoUsuario, Categoria, Cliente, Loja, LojaFavorita, MarcaAgregacao, Produto,
+    ProdutoFavorito, Recomendacao
+)
+
+
+# Recomendações de lojas e produtos. Cada cliente tem um perfil de categorias
+# (desejadas, dos favoritos e das visualizações recentes, cada fonte
+# normalizada e ponderada) e cada item um vetor das suas categorias. A
+# pontuação é afinidade (perfil · item) + peso * nota da loja, só para itens
+# com afinidade positiva. As contas são feitas em blocos de clientes com NumPy
+# e o top-K de cada cliente fica em Recomendacao; as views só leem essa linha.
+# Um cliente ainda sem lista recebe as lojas e produtos de melhor nota das
+# categorias desejadas até a próxima atualização, que calcula as que faltam.
+#
+# Atualização incremental (atualizar(), agendado como o agregar_metricas):
+#   - signals marcam as listas dos clientes cujas entradas mudaram
+#     (categorias desejadas, favoritos) e novas AcaoUsuario marcam as dos
+#     usuários que visualizaram algo; essas listas são refeitas por completo
+#   - itens com `atualizacao` posterior à última execução são pontuados para
+#     todos os clientes (com o perfil guardado) e entram nas listas que superam.
+#     Um item que piorou ou saiu só deixa a lista na próxima execução completa
+#     (--completo); até lá as views descartam itens inativos ou excluídos.
+#
+# Configuração (settings.RECOMENDACOES):
+#   TOP_K           itens guardados por cliente
+#   HISTORICO_DIAS  janela das visualizações consideradas no perfil
+#   PESOS           peso de cada fonte do perfil e da nota
+
+PADRAO = {
+    'TOP_K': 50,
+    'HISTORICO_DIAS': 90,
+    'PESOS': {
+        'categorias': 1.0,
+        'favoritos': 0.6,
+        'visualizacoes': 0.3,
+        'nota': 0.2,
+    },
+}
+
+TIPOS = {
+    'loja': Loja,
+    'produto': Produto,
+}
+
+# memória máxima da matriz de pontuações de um bloco de clientes
+BLOCO_BYTES = 64 * 2 ** 20
+
+
+def configuracao():
+    config = {**PADRAO, **getattr(settings, 'RECOMENDACOES', {})}
+    config['PESOS'] = {**PADRAO['PESOS'], **config['PESOS']}
+    return config
+
+
+def marcar_desatualizadas(clientes):
+    # clientes: ids ou queryset de Cliente
+    Recomendacao.objects.filter(cliente__in=clientes).update(desatualizada_em=timezone.now())
+
+
+def recomendados(cliente, tipo, limite=None):
+    # Ids recomendados em ordem
+    itens = Recomendacao.objects.filter(cliente=cliente, tipo=tipo).values_list('itens', flat=True).first()
+    if itens is None:
+        return melhores(cliente, tipo, limite or configuracao()['TOP_K'])
+    return itens[:limite]
+
+
+def melhores(cliente, tipo, limite):
+    # A lista de quem ainda não tem uma calculada: os itens ativos de melhor
+    # nota nas categorias desejadas ou, sem nenhum, em todo o catálogo
+    nota = 'nota' if tipo == 'loja' else 'loja__nota'
+    queryset = TIPOS[tipo].objects.filter(ativo=True).order_by(f'-{nota}', 'pk')
+    desejados = queryset.filter(categorias__in=cliente.categorias_desejadas.all()).distinct()
+    return (
+        list(desejados.values_list('pk', flat=True)[:limite])
+        or list(queryset.values_list('pk', flat=True)[:limite])
+    )
+
+
+def atualizar(completo=False):
+    inicio = timezone.now()
+    # nesta marca, ultimo_id é a última AcaoUsuario vista e atualizacao o
+    # início da última execução (itens alterados depois dela são mesclados)
+    marca, criada = MarcaAgregacao.objects.get_or_create(nome='recomendacoes')
+    ultimo_id = _marcar_visualizacoes(marca.ultimo_id)
+
+    totais = {}
+    for tipo in TIPOS:
+        recomendador = Recomendador(tipo)
+        if completo or criada:
+            mescladas = 0
+            clientes = Cliente.objects.all()
+        else:
+            mescladas = recomendador.mesclar(desde=marca.atualizacao)
+            listas = Recomendacao.objects.filter(tipo=tipo)
+            clientes = Cliente.objects.filter(
+                Q(pk__in=listas.filter(desatualizada_em__isnull=False).values('cliente_id'))
+                | ~Q(pk__in=listas.values('cliente_id'))
+            )
+        totais[tipo] = {'recalculadas': recomendador.recalcular(clientes), 'mescladas': mescladas}
+
+    MarcaAgregacao.objects.filter(pk=marca.pk).update(ultimo_id=ultimo_id, atualizacao=inicio)
+    return totais
+
+
+def _marcar_visualizacoes(ultimo_id):
+    novas = AcaoUsuario.objects.filter(pk__gt=ultimo_id)
+    maior = novas.aggregate(maior=Max('pk'))['maior']
+    if maior is None:
+        return ultimo_id
+    usuarios = novas.filter(pk__lte=maior).values('usuario_id')
+    marcar_desatualizadas(Cliente.objects.filter(user__in=usuarios))
+    return maior
+
+
+# Operações com matrizes, sem banco (também usadas pelo benchmark_recomendacoes)
+
+def pontuar(perfis, itens, nota, peso_nota):
+    # perfis: clientes x categorias, itens: itens x categorias, nota: 0 a 1 por item
+    pontos = perfis @ itens.T
+    sem_afinidade = pontos <= 0
+    pontos += np.float32(peso_nota) * nota
+    pontos[sem_afinidade] = -np.inf
+    return pontos
+
+
+def top_k(pontos, k):
+    # Índices e pontuações dos k maiores de cada linha, em ordem decrescente.
+    # Particiona a matriz negada (no lugar, a matriz é alterada): com muitos
+    # -inf repetidos o argpartition fica até 10x mais lento pelo lado de cima
+    k = min(k, pontos.shape[1])
+    if k == 0:
+        vazio = np.empty((pontos.shape[0], 0))
+        return vazio.astype(np.int64), vazio.astype(pontos.dtype)
+    custos = np.negative(pontos, out=pontos)
+    indices = np.argpartition(custos, k - 1, axis=1)[:, :k]
+    valores = np.take_along_axis(custos, indices, axis=1)
+    ordem = np.argsort(valores, axis=1, kind='stable')
+    return np.take_along_axis(indices, ordem, axis=1), -np.take_along_axis(valores, ordem, axis=1)
+
+
+def candidatos(vetores, nota, k):
+    # Itens com o mesmo vetor de categorias têm a mesma afinidade com qualquer
+    # cliente, então em cada grupo só os k de maior nota podem entrar num top-k.
+    # O número de candidatos fica limitado por grupos x k, não pelo catálogo.
+    if not len(vetores):
+        return np.arange(0)
+    _, grupos = np.unique(vetores, axis=0, return_inverse=True)
+    grupos = grupos.ravel()
+    ordem = np.lexsort((-nota, grupos))
+    agrupados = grupos[ordem]
+    posicao = np.arange(len(ordem)) - np.searchsorted(agrupados, agrupados)
+    return np.sort(ordem[posicao < k])
+
+
+def linhas_por_bloco(total_itens):
+    return max(1, BLOCO_BYTES // (4 * max(total_itens, 1)))
+
+
+def normalizar_linhas(matriz):
+    soma = matriz.sum(axis=1, keepdims=True)
+    np.divide(matriz, soma, out=matriz, where=soma > 0)
+    return matriz
+
+
+def _acumular(linhas, colunas, dados):
+    # Matriz linhas x colunas a partir de (id da linha, id da coluna, quantidade);
+    # linhas e colunas são arrays ordenados de ids, pares fora deles são ignorados
+    matriz = np.zeros((len(linhas), len(colunas)), dtype=np.float32)
+    dados = np.array([d for d in dados if d[1] is not None], dtype=np.int64).reshape(-1, 3)
+    if not len(dados) or not len(linhas) or not len(colunas):
+        return matriz
+    i = np.minimum(np.searchsorted(linhas, dados[:, 0]), len(linhas) - 1)
+    j = np.minimum(np.searchsorted(colunas, dados[:, 1]), len(colunas) - 1)
+    validos = (linhas[i] == dados[:, 0]) & (colunas[j] == dados[:, 1])
+    np.add.at(matriz, (i[validos], j[validos]), dados[validos, 2])
+    return matriz
+
+
+class Catalogo:
+    # Itens ativos de um tipo que podem entrar num top-k: ids ordenados,
+    # vetores de categorias e nota (0 a 1)
+
+    def __init__(self, tipo, colunas, k, desde=None):
+        model = TIPOS[tipo]
+        queryset = model.objects.filter(ativo=True)
+        if desde is not None:
+            filtro = Q(atualizacao__gte=desde)
+            if tipo == 'produto':
+                # a nota do produto é a da loja
+                filtro |= Q(loja__atualizacao__gte=desde)
+            queryset = queryset.filter(filtro)
+
+        nota = 'nota' if tipo == 'loja' else 'loja__nota'
+        linhas = list(queryset.order_by('pk').values_list('pk', nota))
+        self.ids = np.array([pk for pk, _ in linhas], dtype=np.int64)
+        self.nota = np.array([n or 0.0 for _, n in linhas], dtype=np.float32) / 5
+
+        through = model.categorias.through
+        coluna = through._meta.get_field(model._meta.model_name).attname
+        pares = through.objects.filter(**{f'{coluna}__in': queryset.values('pk')}).values_list(coluna, 'categoria_id')
+        self.vetores = _acumular(self.ids, colunas, ((pk, categoria, 1) for pk, categoria in pares))
+        # itens com muitas categorias não ganham afinidade com todo mundo
+        tamanhos = np.sqrt(self.vetores.sum(axis=1, keepdims=True))
+        np.divide(self.vetores, tamanhos, out=self.vetores, where=tamanhos > 0)
+
+        escolhidos = candidatos(self.vetores, self.nota, k)
+        self.ids, self.vetores, self.nota = self.ids[escolhidos], self.vetores[escolhidos], self.nota[escolhidos]
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class Recomendador:
+
+    def __init__(self, tipo, config=None):
+        self.tipo = tipo
+        self.config = config or configuracao()
+        self.colunas = np.array(sorted(Categoria.objects.values_list('pk', flat=True)), dtype=np.int64)
+        self._catalogo = None
+
+    @property
+    def catalogo(self):
+        if self._catalogo is None:
+            self._catalogo = Catalogo(self.tipo, self.colunas, self.config['TOP_K'])
+        return self._catalogo
+
+    def perfis(self, clientes):
+        # Ids ordenados dos clientes (queryset) e a matriz cliente x categoria
+        ids = np.array(list(clientes.order_by('pk').values_list('pk', flat=True)), dtype=np.int64)
+        filtro = clientes.values('pk')
+        recentes = AcaoUsuario.objects.filter(
+            usuario__cliente__in=filtro,
+            timestamp__gte=timezone.now() - timedelta(days=self.config['HISTORICO_DIAS']),
+        ).order_by()
+
+        fontes = {
+            'categorias': [
+                Cliente.categorias_desejadas.through.objects.filter(cliente__in=filtro)
+                .values_list('cliente_id', 'categoria_id'),
+            ],
+            'favoritos': [
+                ProdutoFavorito.objects.filter(cliente__in=filtro).values_list('cliente_id', 'produto__categorias'),
+                LojaFavorita.objects.filter(cliente__in=filtro).values_list('cliente_id', 'loja__categorias'),
+            ],
+            'visualizacoes': [
+                recentes.filter(produto__isnull=False).values_list('usuario__cliente', 'produto__categorias'),
+                recentes.filter(loja__isnull=False).values_list('usuario__cliente', 'loja__categorias'),
+            ],
+        }
+        perfis = np.zeros((len(ids), len(self.colunas)), dtype=np.float32)
+        for fonte, consultas in fontes.items():
+            dados = [linha for consulta in consultas for linha in consulta.annotate(n=Count('pk')).order_by()]
+            perfis += self.config['PESOS'][fonte] * normalizar_linhas(_acumular(ids, self.colunas, dados))
+        return ids, perfis
+
+    def recalcular(self, clientes):
+        # Perfil e top-K completos dos clientes; devolve quantos foram recalculados
+        inicio = timezone.now()
+        ids, perfis = self.perfis(clientes)
+        catalogo = self.catalogo
+        bloco = linhas_por_bloco(len(catalogo))
+
+        for comeco in range(0, len(ids), bloco):
+            fatia = slice(comeco, comeco + bloco)
+            pontos = pontuar(perfis[fatia], catalogo.vetores, catalogo.nota, self.config['PESOS']['nota'])
+            indices, valores = top_k(pontos, self.config['TOP_K'])
+
+            objetos = []
+            for cliente, perfil, linha_indices, linha_valores in zip(ids[fatia], perfis[fatia], indices, valores):
+                validos = np.isfinite(linha_valores)
+                objetos.append(self._lista(
+                    Recomendacao(cliente_id=int(cliente), tipo=self.tipo, perfil=self._perfil_json(perfil)),
+                    catalogo.ids[linha_indices[validos]].tolist(),
+                    linha_valores[validos].tolist(),
+                ))
+            Recomendacao.objects.bulk_create(
+                objetos, update_conflicts=True, unique_fields=['cliente', 'tipo'],
+                update_fields=['itens', 'pontuacoes', 'minimo', 'perfil', 'atualizacao'],
+            )
+            # marcadas durante o cálculo continuam pendentes
+            Recomendacao.objects.filter(
+                tipo=self.tipo, cliente_id__in=ids[fatia].tolist(), desatualizada_em__lte=inicio
+            ).update(desatualizada_em=None)
+        return len(ids)
+
+    def mesclar(self, desde):
+        # Pontua os itens alterados desde `desde` para todos os clientes com lista
+        # em dia e os insere onde superam o k-ésimo; devolve quantas listas mudaram
+        alterados = Catalogo(self.tipo, self.colunas, self.config['TOP_K'], desde)
+        if not len(alterados):
+            return 0
+
+        linhas = list(
+            Recomendacao.objects.filter(tipo=self.tipo, desatualizada_em__isnull=True)
+            .order_by('pk').values_list('pk', 'minimo', 'perfil')
+        )
+        perfis = np.zeros((len(linhas), len(self.colunas)), dtype=np.float32)
+        posicoes = {categoria: j for j, categoria in enumerate(self.colunas.tolist())}
+        for i, (_, _, perfil) in enumerate(linhas):
+            for categoria, peso in perfil.items():
+                if int(categoria) in posicoes:
+                    perfis[i, posicoes[int(categoria)]] = peso
+        minimos = np.array([-np.inf if m is None else m for _, m, _ in linhas], dtype=np.float32)
+
+        novos = {}
+        bloco = linhas_por_bloco(len(alterados))
+        for comeco in range(0, len(linhas), bloco):
+            fatia = slice(comeco, comeco + bloco)
+            pontos = pontuar(perfis[fatia], alterados.vetores, alterados.nota, self.config['PESOS']['nota'])
+            for i in np.flatnonzero((pontos > minimos[fatia, None]).any(axis=1)):
+                novos[linhas[comeco + i][0]] = pontos[i]
+
+        pks = list(novos)
+        alterados_ids = set(alterados.ids.tolist())
+        for comeco in range(0, len(pks), 500):
+            objetos = list(Recomendacao.objects.filter(pk__in=pks[comeco:comeco + 500]).only('pk', 'itens', 'pontuacoes'))
+            for objeto in objetos:
+                pontuacoes = {
+                    item: ponto for item, ponto in zip(objeto.itens, objeto.pontuacoes) if item not in alterados_ids
+                }
+                for item, ponto in zip(alterados.ids.tolist(), novos[objeto.pk].tolist()):
+                    if np.isfinite(ponto):
+                        pontuacoes[item] = ponto
+                ordem = sorted(pontuacoes, key=pontuacoes.get, reverse=True)[:self.config['TOP_K']]
+                self._lista(objeto, ordem, [pontuacoes[item] for item in ordem])
+            Recomendacao.objects.bulk_update(objetos, ['itens', 'pontuacoes', 'minimo'])
+        return len(pks)
+
+    def _lista(self, objeto, itens, pontuacoes):
+        objeto.itens = itens
+        objeto.pontuacoes = [round(p, 6) for p in pontuacoes]
+        objeto.minimo = objeto.pontuacoes[-1] if len(itens) >= self.config['TOP_K'] else None
+        return objeto
+
+    def _perfil_json(self, perfil):
+        return {str(c): round(float(p), 6) for c, p in zip(self.colunas.tolist(), perfil) if p > 0}
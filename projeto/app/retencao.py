@@ -0,0 +1,161 @@
+import gzip
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .exportacao import FONTES, ler_em_lotes
+from .models import AcaoUsuario, ArquivoAcoes, MarcaAgregacao
+
+
+# Retenção de AcaoUsuario. Os meses inteiros mais antigos que o horizonte saem
+# da tabela para arquivos NDJSON comprimidos (um por mês e execução, em ordem
+# de timestamp e id) registrados em ArquivoAcoes, e são apagados em lotes
+# pequenos, cada um na sua transação, sem segurar locks longos. A tabela fica
+# só com os meses recentes; os arquivados continuam disponíveis na exportação
+# (app/exportacao.py) e nos agregados de métricas, que já os contaram.
+#
+# Só são arquivadas ações já agregadas pelas métricas (até a marca 'acoes'). Se
+# uma execução for interrompida, a próxima apaga o que já estava no arquivo e
+# grava o restante do mês numa nova parte.
+#
+# Configuração (settings.RETENCAO_ACOES):
+#   MESES      meses completos mantidos no banco, além do mês atual
+#   DIRETORIO  onde ficam os arquivos
+#   LOTE       linhas por consulta de leitura e por DELETE
+#   PAUSA      segundos entre dois DELETEs, para aliviar o banco
+
+PADRAO = {
+    'MESES': 6,
+    'DIRETORIO': Path(settings.BASE_DIR) / 'arquivo',
+    'LOTE': 5000,
+    'PAUSA': 0,
+}
+
+CAMPOS = FONTES['acoes']['campos']
+
+
+def configuracao():
+    return {**PADRAO, **getattr(settings, 'RETENCAO_ACOES', {})}
+
+
+def inicio_do_mes(data, meses_atras=0):
+    mes = data.year * 12 + data.month - 1 - meses_atras
+    return data.replace(year=mes // 12, month=mes % 12 + 1, day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def arquivar(meses=None):
+    # Arquiva os meses anteriores ao horizonte; devolve {mês: ações arquivadas}
+    config = configuracao()
+    if meses is not None:
+        config['MESES'] = meses
+    corte = inicio_do_mes(timezone.now(), config['MESES'])
+    agregadas = MarcaAgregacao.objects.filter(nome='acoes').values_list('ultimo_id', flat=True).first() or 0
+
+    arquivadas = {}
+    primeira = AcaoUsuario.objects.filter(timestamp__lt=corte).aggregate(Min('timestamp'))['timestamp__min']
+    mes = inicio_do_mes(primeira) if primeira else corte
+    while mes < corte:
+        seguinte = inicio_do_mes(mes, -1)
+        total = arquivar_mes(mes, seguinte, agregadas, config)
+        if total:
+            arquivadas[mes.date()] = total
+        mes = seguinte
+    return arquivadas
+
+
+def arquivar_mes(inicio, fim, agregadas, config):
+    no_mes = AcaoUsuario.objects.filter(timestamp__gte=inicio, timestamp__lt=fim)
+    partes = ArquivoAcoes.objects.filter(mes=inicio.date())
+
+    # sobras de uma execução interrompida entre a gravação do arquivo e o DELETE
+    ja_arquivadas = partes.aggregate(Max('ultimo_id'))['ultimo_id__max'] or 0
+    apagar(no_mes.filter(pk__lte=ja_arquivadas), config)
+
+    novas = no_mes.filter(pk__gt=ja_arquivadas, pk__lte=agregadas)
+    if not novas.exists():
+        return 0
+    parte = (partes.aggregate(Max('parte'))['parte__max'] or 0) + 1
+    arquivo = f'acoes/{inicio:%Y-%m}.{parte}.ndjson.gz'
+    resumo = gravar(novas, Path(config['DIRETORIO']) / arquivo, config['LOTE'])
+    ArquivoAcoes.objects.create(mes=inicio.date(), parte=parte, arquivo=arquivo, **resumo)
+    # todas as ações do mês com id até o último gravado estavam no arquivo
+    apagar(no_mes.filter(pk__lte=resumo['ultimo_id']), config)
+    return resumo['linhas']
+
+
+def gravar(queryset, destino, lote):
+    # Grava em arquivo temporário e só publica o arquivo completo
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    descritor, temporario = tempfile.mkstemp(dir=destino.parent, suffix='.tmp')
+    resumo = {'linhas': 0, 'inicio': None, 'fim': None, 'ultimo_id': 0}
+    try:
+        with os.fdopen(descritor, 'wb') as bruto:
+            with gzip.open(bruto, 'wt', encoding='utf-8') as arquivo:
+                for linha in ler_em_lotes(queryset, 'timestamp', CAMPOS, lote=lote):
+                    dados = dict(zip(CAMPOS, linha))
+                    resumo['linhas'] += 1
+                    resumo['inicio'] = resumo['inicio'] or dados['timestamp']
+                    resumo['fim'] = dados['timestamp']
+                    resumo['ultimo_id'] = max(resumo['ultimo_id'], dados['id'])
+                    dados['timestamp'] = dados['timestamp'].isoformat()
+                    arquivo.write(json.dumps(dados, ensure_ascii=False) + '\n')
+            # o arquivo só é registrado depois de estar inteiro no disco
+            bruto.flush()
+            os.fsync(bruto.fileno())
+        os.replace(temporario, destino)
+    except BaseException:
+        os.unlink(temporario)
+        raise
+    return resumo
+
+
+def apagar(queryset, config):
+    # DELETEs de até LOTE linhas por id, cada um na sua transação
+    total = 0
+    while True:
+        ids = list(queryset.values_list('pk', flat=True)[:config['LOTE']])
+        if not ids:
+            return total
+        AcaoUsuario.objects.filter(pk__in=ids).delete()
+        total += len(ids)
+        if config['PAUSA']:
+            time.sleep(config['PAUSA'])
+
+
+def ainda_no_banco():
+    # Q das ações gravadas num arquivo que uma execução interrompida não chegou
+    # a apagar (a próxima apaga); a exportação as lê só do arquivo
+    filtro = Q()
+    meses = ArquivoAcoes.objects.values('mes').annotate(ultimo=Max('ultimo_id')).values_list('mes', 'ultimo')
+    for mes, ultimo in meses:
+        inicio = datetime(mes.year, mes.month, 1, tzinfo=dt_timezone.utc)
+        filtro |= Q(timestamp__gte=inicio, timestamp__lt=inicio_do_mes(inicio, -1), pk__lte=ultimo)
+    return filtro
+
+
+def partes(desde=None, ate=None):
+    # Partes arquivadas com ações entre `desde` e `ate`
+    queryset = ArquivoAcoes.objects.order_by('mes', 'parte')
+    if desde:
+        queryset = queryset.filter(fim__gte=desde)
+    if ate:
+        queryset = queryset.filter(inicio__lte=ate)
+    return list(queryset)
+
+
+def ler(parte):
+    # Tuplas de CAMPOS, na ordem em que foram gravadas (timestamp, id)
+    caminho = Path(configuracao()['DIRETORIO']) / parte.arquivo
+    with gzip.open(caminho, 'rt', encoding='utf-8') as arquivo:
+        for linha in arquivo:
+            dados = json.loads(linha)
+            dados['timestamp'] = parse_datetime(dados['timestamp'])
+            yield tuple(dados[campo] for campo in CAMPOS)
@@ -0,0 +1,350 @@
+import heapq
+import math
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .models import Mapas, PosicaoLoja
+
+
+# Rotas a pé dentro da feira. Cada mapa pode ter um grafo de caminhos
+# (Mapas.caminhos): nós em pixels do mapa e corredores entre pares de nós,
+# com o comprimento da reta entre eles. Fora das requisições o grafo é
+# compilado (compilar) para arrays compactos (vizinhos em CSR) e cada loja com
+# posição no mapa é ligada ao nó mais próximo; uma busca de Dijkstra a partir
+# de cada loja dá a matriz de distâncias entre todas as lojas do mapa. Tudo
+# vai para um único .npz por mapa, substituído de uma vez (os.replace) e
+# reaberto na próxima consulta, como os índices de app/similares.py.
+#
+# Na consulta, o ponto de partida (o totem) é ligado ao nó mais próximo; as
+# distâncias dele até as lojas saem de um Dijkstra guardado por nó de origem,
+# já que os totens ficam sempre no mesmo lugar. A ordem das paradas vem da
+# matriz (vizinho mais próximo melhorado com 2-opt) e o trajeto de cada
+# trecho, de um A* com a distância em linha reta como heurística.
+#
+# O grafo é recompilado no pool de trabalhos em segundo plano (app/imagens.py)
+# quando os caminhos ou as posições das lojas mudam.
+#
+# Configuração (settings.ROTAS):
+#   DIRETORIO         onde ficam os grafos compilados
+#   MAXIMO_NOS        nós por mapa
+#   MAXIMO_PARADAS    lojas numa rota
+#   ORIGENS_EM_CACHE  pontos de partida com distâncias guardadas, por mapa
+
+PADRAO = {
+    'DIRETORIO': Path(settings.BASE_DIR) / 'rotas',
+    'MAXIMO_NOS': 50000,
+    'MAXIMO_PARADAS': 30,
+    'ORIGENS_EM_CACHE': 256,
+}
+
+
+def configuracao():
+    return {**PADRAO, **getattr(settings, 'ROTAS', {})}
+
+
+def caminho(mapa):
+    return Path(configuracao()['DIRETORIO']) / f'mapa-{mapa}.npz'
+
+
+def validar_caminhos(dados):
+    # ({'nos': [[x, y], ...], 'corredores': [[a, b], ...]}, None) ou (None, erros)
+    if not isinstance(dados, dict):
+        return None, {'detail': "Envie {'nos': [[x, y], ...], 'corredores': [[a, b], ...]}."}
+    nos, corredores = dados.get('nos'), dados.get('corredores', [])
+    erros = {}
+    if not isinstance(nos, list) or not nos:
+        erros['nos'] = ['Informe a lista de nós [x, y].']
+    elif len(nos) > configuracao()['MAXIMO_NOS']:
+        erros['nos'] = [f"Máximo de {configuracao()['MAXIMO_NOS']} nós."]
+    elif not all(_par(no, _coordenada) for no in nos):
+        erros['nos'] = ['Cada nó deve ser [x, y] com números não negativos.']
+    if not isinstance(corredores, list):
+        erros['corredores'] = ['Informe a lista de corredores [a, b].']
+    elif 'nos' not in erros:
+        validos = lambda valor: type(valor) is int and 0 <= valor < len(nos)
+        if not all(_par(corredor, validos) and corredor[0] != corredor[1] for corredor in corredores):
+            erros['corredores'] = ['Cada corredor deve ser [a, b] com índices de dois nós diferentes.']
+    if erros:
+        return None, erros
+    nos = [[float(x), float(y)] for x, y in nos]
+    return {'nos': nos, 'corredores': [list(corredor) for corredor in corredores]}, None
+
+
+def _par(valor, valido):
+    return isinstance(valor, list) and len(valor) == 2 and all(valido(item) for item in valor)
+
+
+def _coordenada(valor):
+    return type(valor) in (int, float) and math.isfinite(valor) and valor >= 0
+
+
+# Compilação
+
+_geracoes = {}
+_trava_geracoes = threading.Lock()
+
+
+def agendar(mapa):
+    # Recompila depois do commit; várias alterações seguidas viram uma compilação
+    transaction.on_commit(lambda: _enfileirar(mapa))
+
+
+def _enfileirar(mapa):
+    from .imagens import processador_imagens
+    with _trava_geracoes:
+        geracao = _geracoes[mapa] = _geracoes.get(mapa, 0) + 1
+    processador_imagens.enviar(_compilar_se_ultima, mapa, geracao)
+
+
+def _compilar_se_ultima(mapa, geracao):
+    # uma compilação enfileirada depois desta já vai ler o estado mais novo
+    if _geracoes.get(mapa) == geracao:
+        compilar(mapa)
+
+
+def compilar(mapa):
+    # Compila o grafo do mapa; devolve o número de lojas ligadas a ele
+    caminhos = Mapas.objects.filter(pk=mapa).values_list('caminhos', flat=True).first()
+    destino = caminho(mapa)
+    if not caminhos or not caminhos.get('nos'):
+        destino.unlink(missing_ok=True)
+        return 0
+
+    coordenadas = np.array(caminhos['nos'], dtype=np.float32).reshape(-1, 2)
+    corredores = np.array(caminhos['corredores'], dtype=np.int32).reshape(-1, 2)
+    indptr, vizinhos, pesos = csr(coordenadas, corredores)
+
+    posicoes = list(
+        PosicaoLoja.objects.filter(mapa_id=mapa, ativo=True).order_by('loja_id').values_list('loja_id', 'x', 'y')
+    )
+    lojas = np.array([loja for loja, _, _ in posicoes], dtype=np.int32)
+    pontos = np.array([(x, y) for _, x, y in posicoes], dtype=np.float32).reshape(-1, 2)
+    nos_lojas, ligacoes = mais_proximos(coordenadas, pontos)
+
+    grafo = Grafo(coordenadas, indptr, vizinhos, pesos, lojas, pontos, nos_lojas, ligacoes, None)
+    distancias = np.empty((len(lojas), len(lojas)), dtype=np.float32)
+    for i, no in enumerate(nos_lojas.tolist()):
+        distancias[i] = np.asarray(grafo.dijkstra(no), dtype=np.float32)[nos_lojas] + ligacoes[i] + ligacoes
+        distancias[i, i] = 0
+
+    publicar(destino, {
+        'coordenadas': coordenadas, 'indptr': indptr, 'vizinhos': vizinhos, 'pesos': pesos,
+        'lojas': lojas, 'posicoes': pontos, 'nos_lojas': nos_lojas, 'ligacoes': ligacoes, 'distancias': distancias,
+    })
+    return len(lojas)
+
+
+def csr(coordenadas, corredores):
+    # Corredores nos dois sentidos, agrupados pelo nó de origem
+    origens = np.concatenate([corredores[:, 0], corredores[:, 1]])
+    destinos = np.concatenate([corredores[:, 1], corredores[:, 0]])
+    ordem = np.argsort(origens, kind='stable')
+    indptr = np.zeros(len(coordenadas) + 1, dtype=np.int32)
+    np.cumsum(np.bincount(origens, minlength=len(coordenadas)), out=indptr[1:])
+    vizinhos = destinos[ordem].astype(np.int32)
+    pesos = np.linalg.norm(coordenadas[origens[ordem]] - coordenadas[vizinhos], axis=1).astype(np.float32)
+    return indptr, vizinhos, pesos
+
+
+def mais_proximos(coordenadas, pontos):
+    # Nó mais próximo de cada ponto e a distância até ele
+    nos = np.empty(len(pontos), dtype=np.int32)
+    for i, ponto in enumerate(pontos):
+        nos[i] = np.argmin(((coordenadas - ponto) ** 2).sum(axis=1))
+    return nos, np.linalg.norm(coordenadas[nos] - pontos, axis=1).astype(np.float32)
+
+
+def publicar(destino, arrays):
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    descritor, temporario = tempfile.mkstemp(dir=destino.parent, suffix='.npz')
+    try:
+        with os.fdopen(descritor, 'wb') as arquivo:
+            np.savez(arquivo, **arrays)
+        os.replace(temporario, destino)
+    except BaseException:
+        os.unlink(temporario)
+        raise
+
+
+class Grafo:
+    # Grafo compilado de um mapa; as buscas usam listas Python, mais rápidas
+    # que indexar arrays numpy elemento a elemento
+
+    def __init__(self, coordenadas, indptr, vizinhos, pesos, lojas, posicoes, nos_lojas, ligacoes, distancias):
+        self.coordenadas = coordenadas
+        self.xs, self.ys = coordenadas[:, 0].tolist(), coordenadas[:, 1].tolist()
+        self.indptr, self.vizinhos, self.pesos = indptr.tolist(), vizinhos.tolist(), pesos.tolist()
+        self.lojas = lojas
+        self.posicoes = posicoes
+        self.indice_lojas = {loja: i for i, loja in enumerate(lojas.tolist())}
+        self.nos_lojas = nos_lojas
+        self.ligacoes = ligacoes
+        self.distancias = distancias
+        self._origens = {}
+        self._trava = threading.Lock()
+
+    @classmethod
+    def abrir(cls, arquivo):
+        with np.load(arquivo) as dados:
+            return cls(**{nome: dados[nome] for nome in dados.files})
+
+    def mais_proximo(self, x, y):
+        nos, ligacoes = mais_proximos(self.coordenadas, np.array([[x, y]], dtype=np.float32))
+        return int(nos[0]), float(ligacoes[0])
+
+    def dijkstra(self, origem):
+        distancias = [math.inf] * len(self.xs)
+        distancias[origem] = 0.0
+        fila = [(0.0, origem)]
+        while fila:
+            distancia, no = heapq.heappop(fila)
+            if distancia > distancias[no]:
+                continue
+            for i in range(self.indptr[no], self.indptr[no + 1]):
+                vizinho, nova = self.vizinhos[i], distancia + self.pesos[i]
+                if nova < distancias[vizinho]:
+                    distancias[vizinho] = nova
+                    heapq.heappush(fila, (nova, vizinho))
+        return distancias
+
+    def distancias_de(self, origem):
+        # Distâncias (no grafo) do nó até o nó de cada loja, guardadas por origem
+        linha = self._origens.get(origem)
+        if linha is None:
+            linha = np.asarray(self.dijkstra(origem), dtype=np.float32)[self.nos_lojas]
+            with self._trava:
+                if len(self._origens) >= configuracao()['ORIGENS_EM_CACHE']:
+                    self._origens.pop(next(iter(self._origens)))
+                self._origens[origem] = linha
+        return linha
+
+    def a_estrela(self, origem, destino):
+        # Lista de nós do menor caminho, ou None se não há caminho
+        xd, yd = self.xs[destino], self.ys[destino]
+        custos = {origem: 0.0}
+        anteriores = {origem: None}
+        fila = [(math.hypot(self.xs[origem] - xd, self.ys[origem] - yd), 0.0, origem)]
+        while fila:
+            _, custo, no = heapq.heappop(fila)
+            if no == destino:
+                nos = []
+                while no is not None:
+                    nos.append(no)
+                    no = anteriores[no]
+                return nos[::-1]
+            if custo > custos[no]:
+                continue
+            for i in range(self.indptr[no], self.indptr[no + 1]):
+                vizinho, novo = self.vizinhos[i], custo + self.pesos[i]
+                if novo < custos.get(vizinho, math.inf):
+                    custos[vizinho] = novo
+                    anteriores[vizinho] = no
+                    estimativa = novo + math.hypot(self.xs[vizinho] - xd, self.ys[vizinho] - yd)
+                    heapq.heappush(fila, (estimativa, novo, vizinho))
+        return None
+
+    def ponto(self, no):
+        return [self.xs[no], self.ys[no]]
+
+
+def ordenar_paradas(partida, matriz):
+    # Ordem de visita (caminho aberto a partir da partida): vizinho mais
+    # próximo, depois 2-opt (inverter um trecho) e or-opt (mudar de lugar um
+    # trecho de até 3 paradas) até nenhum dos dois encurtar a rota.
+    # partida[j]: distância da partida à parada j; matriz[i][j]: entre paradas
+    restantes = set(range(len(partida)))
+    ordem = []
+    atual = partida
+    while restantes:
+        proxima = min(restantes, key=lambda j: (atual[j], j))
+        ordem.append(proxima)
+        restantes.remove(proxima)
+        atual = matriz[proxima]
+
+    custo = lambda rota: partida[rota[0]] + sum(matriz[a][b] for a, b in zip(rota, rota[1:]))
+    melhor = custo(ordem) if ordem else 0.0
+    melhorou = True
+    while melhorou:
+        melhorou = False
+        for vizinha in _vizinhas(ordem):
+            distancia = custo(vizinha)
+            if distancia < melhor - 1e-6:
+                ordem, melhor, melhorou = vizinha, distancia, True
+                break
+    return ordem
+
+
+def _vizinhas(ordem):
+    n = len(ordem)
+    for i in range(n):
+        for j in range(i + 1, n):
+            yield ordem[:i] + ordem[i:j + 1][::-1] + ordem[j + 1:]
+    for tamanho in (1, 2, 3):
+        for i in range(n - tamanho + 1):
+            trecho, resto = ordem[i:i + tamanho], ordem[:i] + ordem[i + tamanho:]
+            for j in range(len(resto) + 1):
+                if j != i:
+                    yield resto[:j] + trecho + resto[j:]
+
+
+def planejar(grafo, x, y, lojas):
+    # Rota a pé de (x, y) passando por todas as `lojas` alcançáveis
+    lojas = list(dict.fromkeys(lojas))
+    origem, ligacao = grafo.mais_proximo(x, y)
+    paradas = [grafo.indice_lojas[loja] for loja in lojas if loja in grafo.indice_lojas]
+    partida = grafo.distancias_de(origem)[paradas] + ligacao + grafo.ligacoes[paradas]
+    alcancaveis = [parada for parada, distancia in zip(paradas, partida.tolist()) if math.isfinite(distancia)]
+    partida = partida[np.isfinite(partida)].tolist()
+    matriz = grafo.distancias[np.ix_(alcancaveis, alcancaveis)].tolist()
+    ordem = ordenar_paradas(partida, matriz)
+
+    trajeto = [[x, y]]
+    visitadas = []
+    total, no_atual = 0.0, origem
+    for posicao, i in enumerate(ordem):
+        parada = alcancaveis[i]
+        no = int(grafo.nos_lojas[parada])
+        # da porta da loja anterior (ou do ponto de partida) ao nó, pelos corredores e à porta
+        trajeto.extend(grafo.ponto(n) for n in grafo.a_estrela(no_atual, no))
+        trajeto.append(grafo.posicoes[parada].tolist())
+        total += partida[i] if posicao == 0 else matriz[ordem[posicao - 1]][i]
+        visitadas.append({'loja': int(grafo.lojas[parada]), 'distancia': round(total, 2)})
+        no_atual = no
+
+    atendidas = {parada['loja'] for parada in visitadas}
+    return {
+        'distancia': round(total, 2),
+        'paradas': visitadas,
+        'trajeto': trajeto,
+        'inalcancaveis': [loja for loja in lojas if loja not in atendidas],
+    }
+
+
+class Roteador:
+
+    def __init__(self):
+        self._abertos = {}
+        self._trava = threading.Lock()
+
+    def grafo(self, mapa):
+        # Grafo compilado do mapa, reaberto quando o arquivo muda; None se não há
+        arquivo = caminho(mapa)
+        try:
+            versao = arquivo.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+        aberto = self._abertos.get(mapa)
+        if aberto is None or aberto[0] != versao:
+            with self._trava:
+                aberto = (versao, Grafo.abrir(arquivo))
+                self._abertos[mapa] = aberto
+        return aberto[1]
+
+
+roteador = Roteador()
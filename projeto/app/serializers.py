@@ -1,11 +1,94 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.reverse import reverse
 from django.contrib.auth.models import User
 from .models import (
     Lojista, Cliente, Loja, Produto, Categoria, Avaliacao, 
-    ProdutoFavorito, LojaFavorita, Setor, TotemPessoal, Mapas, AcaoUsuario
+    ProdutoFavorito, LojaFavorita, Setor, TotemPessoal, Mapas, AcaoUsuario, PosicaoLoja
 )
 
-class AcaoUsuarioSerializer(serializers.ModelSerializer):
+# Ids favoritados pelo cliente da requisição, carregados uma única vez por
+# requisição (ficam guardados no próprio request) em vez de um EXISTS por linha.
+_CAMPO_FAVORITO = {
+    ProdutoFavorito: 'produto_id',
+    LojaFavorita: 'loja_id',
+}
+
+def ids_favoritos(context, modelo):
+    request = context.get('request')
+    user = getattr(request, 'user', None)
+    if not user or not user.is_authenticated or not hasattr(user, 'cliente'):
+        return frozenset()
+
+    cache = getattr(request, '_ids_favoritos', None)
+    if cache is None:
+        cache = request._ids_favoritos = {}
+    if modelo not in cache:
+        cache[modelo] = frozenset(
+            modelo.objects.filter(cliente=user.cliente).values_list(_CAMPO_FAVORITO[modelo], flat=True)
+        )
+    return cache[modelo]
+
+# Loja.nota é mantida incrementalmente (app/notas.py); sem avaliações a média é nula
+def nota_media(loja):
+    return loja.nota if loja.total_avaliacoes else None
+
+class VariantesImagemField(serializers.Field):
+    # URLs das variantes de uma imagem (app/imagens.py) por tamanho e formato,
+    # lidas do campo `variantes` do próprio objeto; nulo enquanto o arquivo
+    # atual não foi processado
+    def __init__(self, campo, **kwargs):
+        self.campo = campo
+        kwargs.update(source='*', read_only=True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, instancia):
+        arquivo = getattr(instancia, self.campo)
+        return urls_variantes(arquivo.storage, arquivo.name, instancia.variantes.get(self.campo), self.context.get('request'))
+
+def urls_variantes(storage, nome, dados, request):
+    if not nome or not dados or dados['original'] != nome:
+        return None
+    url = lambda caminho: request.build_absolute_uri(storage.url(caminho)) if request else storage.url(caminho)
+    return {
+        tamanho: {formato: url(caminho) for formato, caminho in arquivos.items()}
+        for tamanho, arquivos in dados['tamanhos'].items()
+    }
+
+class CamposDinamicosMixin:
+    # ?fields=id,nome,... limita os campos das respostas de leitura. Vale só para o
+    # serializer principal da resposta (ou os itens de uma listagem), não para os
+    # aninhados, e evita calcular campos caros como favoritado e produtos.
+    #
+    # ?expand=campo1,... troca as listas de ids dos campos de Meta.expansiveis
+    # pelos objetos completos, com as mesmas regras. O planejamento de consultas
+    # (app/consultas.py) enxerga os campos já trocados e faz o prefetch deles.
+
+    def get_fields(self):
+        campos = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS or not self._principal():
+            return campos
+        pedidos = lista_parametro(request, 'fields')
+        if pedidos:
+            campos = {nome: campo for nome, campo in campos.items() if nome in pedidos}
+        expandir = lista_parametro(request, 'expand')
+        for nome, serializer in getattr(self.Meta, 'expansiveis', {}).items():
+            if nome in expandir and nome in campos:
+                campos[nome] = serializer(many=True, read_only=True)
+        return campos
+
+    def _principal(self):
+        if self.parent is None:
+            return True
+        return isinstance(self.parent, serializers.ListSerializer) and self.parent.parent is None
+
+def lista_parametro(request, parametro):
+    # ?parametro=a,b,c -> {'a', 'b', 'c'}
+    valor = request.query_params.get(parametro)
+    return {nome.strip() for nome in valor.split(',')} if valor else set()
+
+class AcaoUsuarioSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     class Meta:
         model = AcaoUsuario
         fields = '__all__'
@@ -24,12 +107,13 @@ class LojistaRegisterSerializer(serializers.Serializer):
         lojista = Lojista.objects.create(user=user, nome=nome, **validated_data)
         return lojista
     
-class LojistaSerializer(serializers.ModelSerializer):
+class LojistaSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     email = serializers.EmailField(source='user.email', read_only=True)
+    foto_variantes = VariantesImagemField('foto')
     class Meta:
         model = Lojista
         fields = (
-            'id', 'nome', 'email', 'telefone','genero', 'cnpj', 'foto',
+            'id', 'nome', 'email', 'telefone','genero', 'cnpj', 'foto', 'foto_variantes',
             'criacao', 'atualizacao', 'ativo'
         )
         extra_kwargs = {
@@ -42,8 +126,9 @@ class LojistaSerializer(serializers.ModelSerializer):
         
 
 
-class ProdutoSerializer(serializers.ModelSerializer):
+class ProdutoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     favoritado = serializers.SerializerMethodField()
+    imagem_variantes = VariantesImagemField('imagem')
     categorias = serializers.PrimaryKeyRelatedField(
         many=True,
         queryset=Categoria.objects.all()
@@ -51,7 +136,7 @@ class ProdutoSerializer(serializers.ModelSerializer):
     class Meta:
         model = Produto
         fields = (
-            'id', 'nome', 'descricao', 'loja', 'imagem', 'categorias', 'cor', 
+            'id', 'nome', 'descricao', 'loja', 'imagem', 'imagem_variantes', 'categorias', 'cor', 
             'composicao', 'criacao', 'atualizacao', 'ativo', 'favoritado'
         )
         extra_kwargs = {
@@ -62,17 +147,37 @@ class ProdutoSerializer(serializers.ModelSerializer):
         }
     
     def get_favoritado(self, obj):
-        request = self.context.get('request')
-        user = request.user if request and request.user.is_authenticated else None
+        return obj.pk in ids_favoritos(self.context, ProdutoFavorito)
+
+
+class ProdutoLoteSerializer(serializers.ModelSerializer):
+    # Uma linha da importação em lote (app/lote.py): loja e categorias chegam
+    # como ids e são conferidas de uma vez para o lote todo, não por linha
+    id = serializers.IntegerField(required=False, min_value=1)
+    loja = serializers.IntegerField(source='loja_id', min_value=1)
+    categorias = serializers.ListField(child=serializers.IntegerField(min_value=1))
+
+    class Meta:
+        model = Produto
+        fields = ('id', 'nome', 'descricao', 'loja', 'categorias', 'cor', 'composicao')
 
-        if user and hasattr(user, 'cliente'):
-            return ProdutoFavorito.objects.filter(produto=obj, cliente=user.cliente).exists()
-        return False
 
+class FavoritoLoteSerializer(serializers.Serializer):
+    # Uma operação da sincronização de favoritos (app/favoritos.py): os ids
+    # são conferidos depois, para o lote todo
+    acao = serializers.ChoiceField(choices=('adicionar', 'remover'))
+    produto = serializers.IntegerField(required=False, min_value=1)
+    loja = serializers.IntegerField(required=False, min_value=1)
 
-class PesquisaSerializer(serializers.ModelSerializer):
+    def validate(self, dados):
+        if ('produto' in dados) == ('loja' in dados):
+            raise serializers.ValidationError('Informe um produto ou uma loja.')
+        return dados
 
-    nota_media = serializers.FloatField(read_only=True)
+
+class PesquisaSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+
+    nota_media = serializers.SerializerMethodField()
     produtos = ProdutoSerializer(many=True)
     categorias = serializers.PrimaryKeyRelatedField(
         many=True,
@@ -102,9 +207,15 @@ class PesquisaSerializer(serializers.ModelSerializer):
             'ativo': {'read_only': True},
         }
 
-class LojaSerializer(serializers.ModelSerializer):
+    def get_nota_media(self, obj):
+        return nota_media(obj)
+
+class LojaSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     favoritado = serializers.SerializerMethodField()
-    nota_media = serializers.FloatField(read_only=True)
+    nota_media = serializers.SerializerMethodField()
+    banner_variantes = VariantesImagemField('banner')
+    logo_variantes = VariantesImagemField('logo')
+    foto_da_loja_variantes = VariantesImagemField('foto_da_loja')
     produtos = serializers.PrimaryKeyRelatedField(
         many=True,
         read_only=True
@@ -123,9 +234,9 @@ class LojaSerializer(serializers.ModelSerializer):
     class Meta:
         model = Loja
         fields = (
-            'id', 'nome', 'banner', 'logo', 'descricao','produtos','setor', 'categorias', 'localizacao',
-            'lojista', 'foto_da_loja', 'Instagram','WhatsApp','Website', 'horario_funcionamento', 
-            'avaliacoes', 'nota_media', 'criacao', 'atualizacao', 'ativo', 'favoritado'
+            'id', 'nome', 'banner', 'banner_variantes', 'logo', 'logo_variantes', 'descricao','produtos','setor',
+            'categorias', 'localizacao', 'lojista', 'foto_da_loja', 'foto_da_loja_variantes', 'Instagram','WhatsApp',
+            'Website', 'horario_funcionamento', 'avaliacoes', 'nota_media', 'criacao', 'atualizacao', 'ativo', 'favoritado'
         )
         
         extra_kwargs = {
@@ -138,13 +249,11 @@ class LojaSerializer(serializers.ModelSerializer):
             'ativo': {'read_only': True},
         }
 
-    def get_favoritado(self, obj):
-        request = self.context.get('request')
-        user = request.user if request and request.user.is_authenticated else None
+    def get_nota_media(self, obj):
+        return nota_media(obj)
 
-        if user and hasattr(user, 'cliente'):
-            return LojaFavorita.objects.filter(loja=obj, cliente=user.cliente).exists()
-        return False
+    def get_favoritado(self, obj):
+        return obj.pk in ids_favoritos(self.context, LojaFavorita)
 
 
 
@@ -165,16 +274,18 @@ class ClienteRegisterSerializer(serializers.ModelSerializer):
         cliente = Cliente.objects.create(user=user, nome=nome, **validated_data)
         return cliente
 
-class ClienteSerializer(serializers.ModelSerializer):
+class ClienteSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     email = serializers.EmailField(source='user.email', read_only=True)
     categorias_desejadas = serializers.PrimaryKeyRelatedField(
         many=True,
         queryset=Categoria.objects.all()
     )
 
-    produtos_favoritos = ProdutoSerializer(many=True, read_only=True)
-    lojas_favoritas = LojaSerializer(many=True, read_only=True)
+    # ids por padrão; objetos completos com ?expand= (ver CamposDinamicosMixin)
+    produtos_favoritos = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+    lojas_favoritas = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
     user = serializers.PrimaryKeyRelatedField(read_only=True) 
+    foto_variantes = VariantesImagemField('foto')
 
     def update(self, instance, validated_data):
         validated_data.pop('user', None)  # impede sobrescrita
@@ -183,9 +294,13 @@ class ClienteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Cliente
         fields = (
-            'id','user', 'nome','email', 'cpf', 'telefone', 'foto', 'data_nascimento',
+            'id','user', 'nome','email', 'cpf', 'telefone', 'foto', 'foto_variantes', 'data_nascimento',
             'genero', 'tipo', 'categorias_desejadas','produtos_favoritos', 'lojas_favoritas', 'criacao', 'atualizacao', 'ativo'
         )
+        expansiveis = {
+            'produtos_favoritos': ProdutoSerializer,
+            'lojas_favoritas': LojaSerializer,
+        }
         extra_kwargs = {
             'id': {'read_only': True},
             'criacao': {'read_only': True},
@@ -194,7 +309,7 @@ class ClienteSerializer(serializers.ModelSerializer):
             'user': {'read_only': True},
         }
 
-class CategoriaSerializer(serializers.ModelSerializer):
+class CategoriaSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     class Meta:
         model = Categoria
         fields = (
@@ -207,7 +322,7 @@ class CategoriaSerializer(serializers.ModelSerializer):
             'ativo': {'read_only': True},
         }
 
-class AvaliacaoSerializer(serializers.ModelSerializer):
+class AvaliacaoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     nome_cliente = serializers.SerializerMethodField()
 
     class Meta:
@@ -228,7 +343,7 @@ class AvaliacaoSerializer(serializers.ModelSerializer):
 
 
 
-class ProdutoFavoritoSerializer(serializers.ModelSerializer):
+class ProdutoFavoritoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     class Meta:
         model = ProdutoFavorito
         fields = (
@@ -240,11 +355,13 @@ class ProdutoFavoritoSerializer(serializers.ModelSerializer):
             'atualizacao': {'read_only': True},
             'ativo': {'read_only': True},
         }
-class MapasSerializer(serializers.ModelSerializer):
+class MapasSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    mapa_variantes = VariantesImagemField('mapa')
+    mosaico = serializers.SerializerMethodField()
     class Meta:
         model = Mapas
         fields = (
-            'id', 'loja', 'mapa', 'criacao', 'atualizacao', 'ativo'
+            'id', 'loja', 'mapa', 'mapa_variantes', 'mosaico', 'criacao', 'atualizacao', 'ativo'
         )
         extra_kwargs = {
             'id': {'read_only': True},
@@ -253,7 +370,21 @@ class MapasSerializer(serializers.ModelSerializer):
             'ativo': {'read_only': True},
         }
 
-class LojaFavoritaSerializer(serializers.ModelSerializer):
+    def get_mosaico(self, obj):
+        # Tamanho da imagem, zooms e o modelo de endereço dos tiles (app/mosaico.py)
+        mosaico = obj.mosaico
+        if not obj.mapa or mosaico.get('original') != obj.mapa.name:
+            return None
+        base = reverse('mapas-detail', args=[obj.pk], request=self.context.get('request'))
+        return {
+            'largura': mosaico['largura'],
+            'altura': mosaico['altura'],
+            'tamanho': mosaico['tamanho'],
+            'zoom_maximo': mosaico['zoom_maximo'],
+            'tiles': f"{base}tiles/{mosaico['versao']}/{{z}}/{{x}}/{{y}}/",
+        }
+
+class LojaFavoritaSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     class Meta:
         model = LojaFavorita
         fields = (
@@ -266,7 +397,7 @@ class LojaFavoritaSerializer(serializers.ModelSerializer):
             'ativo': {'read_only': True},
         }
 
-class SetorSerializer(serializers.ModelSerializer):
+class SetorSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Setor
@@ -280,7 +411,32 @@ class SetorSerializer(serializers.ModelSerializer):
             'ativo': {'read_only': True},
         }
 
-class TotemPessoalSerializer(serializers.ModelSerializer):
+class PosicaoLojaSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    x = serializers.FloatField(min_value=0)
+    y = serializers.FloatField(min_value=0)
+
+    class Meta:
+        model = PosicaoLoja
+        fields = (
+            'id', 'loja', 'mapa', 'x', 'y', 'criacao', 'atualizacao', 'ativo'
+        )
+        extra_kwargs = {
+            'id': {'read_only': True},
+            'criacao': {'read_only': True},
+            'atualizacao': {'read_only': True},
+            'ativo': {'read_only': True},
+        }
+
+    def validate(self, dados):
+        # dentro da imagem do mapa, quando o tamanho já é conhecido (app/mosaico.py)
+        mapa = dados.get('mapa', getattr(self.instance, 'mapa', None))
+        mosaico = mapa.mosaico if mapa else {}
+        for eixo, limite in (('x', 'largura'), ('y', 'altura')):
+            if eixo in dados and limite in mosaico and dados[eixo] > mosaico[limite]:
+                raise serializers.ValidationError({eixo: f'Fora do mapa ({limite} {mosaico[limite]}px).'})
+        return dados
+
+class TotemPessoalSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     class Meta:
         model = TotemPessoal
         fields = (
@@ -0,0 +1,349 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import (
+    Avaliacao, Loja, Produto, Categoria, Setor, Mapas, Cliente, Lojista, ProdutoFavorito, LojaFavorita,
+    PosicaoLoja
+)
+from . import busca, espacial, imagens, mosaico, notas, recomendacao, rotas, sincronizacao
+from .cache import cache_respostas, etiquetas
+from .favoritos import favoritos_em_lote
+from .lote import salvos_em_lote
+
+
+@receiver(pre_save, sender=Avaliacao)
+def guardar_nota_anterior(sender, instance, **kwargs):
+    instance._nota_anterior = None
+    if instance.pk:
+        instance._nota_anterior = (
+            Avaliacao.objects.filter(pk=instance.pk).values_list('loja_id', 'nota').first()
+        )
+
+
+@receiver(post_save, sender=Avaliacao)
+def atualizar_nota_loja(sender, instance, created, **kwargs):
+    anterior = getattr(instance, '_nota_anterior', None)
+    if created or anterior is None:
+        notas.adicionar_nota(instance.loja_id, instance.nota)
+        return
+
+    loja_anterior, nota_anterior = anterior
+    if loja_anterior != instance.loja_id:
+        notas.remover_nota(loja_anterior, nota_anterior)
+        notas.adicionar_nota(instance.loja_id, instance.nota)
+    elif nota_anterior != instance.nota:
+        notas.trocar_nota(instance.loja_id, nota_anterior, instance.nota)
+
+
+@receiver(post_delete, sender=Avaliacao)
+def remover_nota_loja(sender, instance, **kwargs):
+    notas.remover_nota(instance.loja_id, instance.nota)
+
+
+# Índice de busca (app/busca.py): reindexa após o commit, lendo o estado salvo
+
+def _reindexar(tipo, ids):
+    transaction.on_commit(lambda: busca.motor.reindexar(tipo, list(ids)))
+
+
+@receiver(post_save, sender=Loja)
+def indexar_loja(sender, instance, **kwargs):
+    _reindexar('loja', [instance.pk])
+
+
+@receiver(post_save, sender=Produto)
+def indexar_produto(sender, instance, **kwargs):
+    _reindexar('produto', [instance.pk])
+
+
+@receiver(post_delete, sender=Loja)
+def desindexar_loja(sender, instance, **kwargs):
+    busca.motor.remover('loja', [instance.pk])
+
+
+@receiver(post_delete, sender=Produto)
+def desindexar_produto(sender, instance, **kwargs):
+    busca.motor.remover('produto', [instance.pk])
+
+
+@receiver(post_save, sender=Categoria)
+def indexar_categoria(sender, instance, created, **kwargs):
+    if not created:
+        _reindexar('loja', instance.lojas.values_list('pk', flat=True))
+        _reindexar('produto', instance.produtos.values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=Loja.categorias.through)
+@receiver(m2m_changed, sender=Produto.categorias.through)
+def indexar_categorias(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    tipo = 'loja' if sender is Loja.categorias.through else 'produto'
+    if not reverse:
+        _reindexar(tipo, [instance.pk])
+    elif pk_set:
+        _reindexar(tipo, pk_set)
+    else:
+        # clear() a partir da categoria: os ids removidos não são informados
+        busca.motor.limpar()
+
+
+@receiver(post_delete, sender=Categoria)
+def desindexar_categoria(sender, instance, **kwargs):
+    # as relações somem em cascata, sem m2m_changed; o índice é remontado
+    busca.motor.limpar()
+
+
+# Cache de respostas e ETags (app/cache.py): invalida as etiquetas dos objetos
+# alterados. Quando a resposta de um objeto muda sem que a linha dele seja
+# salva (produtos de uma loja, categorias), `atualizacao` também avança, já que
+# é dela que saem os ETags.
+
+def _resposta_mudou(model, ids):
+    ids = [pk for pk in ids if pk is not None]
+    cache_respostas.invalidar(etiquetas(model, ids))
+    if ids:
+        model.objects.filter(pk__in=ids).update(atualizacao=timezone.now())
+
+
+@receiver(post_save, sender=Loja)
+@receiver(post_delete, sender=Loja)
+@receiver(post_save, sender=Categoria)
+@receiver(post_save, sender=Setor)
+@receiver(post_delete, sender=Setor)
+@receiver(post_save, sender=Mapas)
+@receiver(post_delete, sender=Mapas)
+def invalidar_cache(sender, instance, **kwargs):
+    cache_respostas.invalidar(etiquetas(sender, [instance.pk]))
+
+
+@receiver(pre_save, sender=Produto)
+def guardar_loja_anterior(sender, instance, **kwargs):
+    instance._loja_anterior = None
+    if instance.pk:
+        instance._loja_anterior = Produto.objects.filter(pk=instance.pk).values_list('loja_id', flat=True).first()
+
+
+@receiver(post_save, sender=Produto)
+@receiver(post_delete, sender=Produto)
+def invalidar_cache_produto(sender, instance, created=False, **kwargs):
+    cache_respostas.invalidar(etiquetas(Produto, [instance.pk]))
+    # a loja lista os ids dos seus produtos: muda ao criar, excluir ou mover
+    anterior = getattr(instance, '_loja_anterior', None)
+    if created or kwargs['signal'] is post_delete or anterior != instance.loja_id:
+        _resposta_mudou(Loja, {instance.loja_id, anterior})
+
+
+@receiver(post_save, sender=Avaliacao)
+@receiver(post_delete, sender=Avaliacao)
+def invalidar_cache_avaliacao(sender, instance, **kwargs):
+    # muda a nota e a lista de avaliações da loja
+    anterior = getattr(instance, '_nota_anterior', None)
+    lojas = [instance.loja_id, anterior[0] if anterior else None]
+    cache_respostas.invalidar(etiquetas(Loja, lojas))
+
+
+@receiver(pre_delete, sender=Loja)
+def invalidar_cache_mapas_da_loja(sender, instance, **kwargs):
+    # os mapas ficam com loja nula por um UPDATE, sem signals
+    _resposta_mudou(Mapas, Mapas.objects.filter(loja=instance).values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Categoria)
+def invalidar_cache_categoria(sender, instance, **kwargs):
+    # as relações com lojas e produtos somem em cascata, sem m2m_changed
+    cache_respostas.invalidar(etiquetas(Categoria, [instance.pk]))
+    _resposta_mudou(Loja, instance.lojas.values_list('pk', flat=True))
+    _resposta_mudou(Produto, instance.produtos.values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=Loja.categorias.through)
+@receiver(m2m_changed, sender=Produto.categorias.through)
+def invalidar_cache_categorias(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            _resposta_mudou(type(instance), [instance.pk])
+    elif action == 'pre_clear':
+        # clear() a partir da categoria: os ids só estão disponíveis antes
+        _resposta_mudou(model, model.objects.filter(categorias=instance).values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        _resposta_mudou(model, pk_set)
+
+
+def _invalidar_favoritos(clientes):
+    usuarios = Cliente.objects.filter(pk__in=clientes).values_list('user_id', flat=True)
+    cache_respostas.invalidar({f'favoritos:{user_id}' for user_id in usuarios})
+
+
+@receiver(post_save, sender=ProdutoFavorito)
+@receiver(post_delete, sender=ProdutoFavorito)
+@receiver(post_save, sender=LojaFavorita)
+@receiver(post_delete, sender=LojaFavorita)
+def invalidar_cache_favorito(sender, instance, **kwargs):
+    _invalidar_favoritos([instance.cliente_id])
+
+
+@receiver(m2m_changed, sender=ProdutoFavorito)
+@receiver(m2m_changed, sender=LojaFavorita)
+def invalidar_cache_favoritos(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            _invalidar_favoritos([instance.pk])
+    elif action == 'pre_clear':
+        _invalidar_favoritos(instance.clientes_que_favoritaram.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        _invalidar_favoritos(pk_set)
+
+
+@receiver(favoritos_em_lote, sender=ProdutoFavorito)
+@receiver(favoritos_em_lote, sender=LojaFavorita)
+def invalidar_cache_favoritos_em_lote(sender, clientes, **kwargs):
+    _invalidar_favoritos(clientes)
+
+
+# Recomendações (app/recomendacao.py): marca as listas dos clientes cujas
+# entradas mudaram; o comando atualizar_recomendacoes as refaz
+
+@receiver(m2m_changed, sender=Cliente.categorias_desejadas.through)
+def desatualizar_recomendacoes_categorias(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            recomendacao.marcar_desatualizadas([instance.pk])
+    elif action == 'pre_clear':
+        recomendacao.marcar_desatualizadas(Cliente.objects.filter(categorias_desejadas=instance))
+    elif action in ('post_add', 'post_remove'):
+        recomendacao.marcar_desatualizadas(pk_set)
+
+
+@receiver(pre_delete, sender=Categoria)
+def desatualizar_recomendacoes_categoria(sender, instance, **kwargs):
+    recomendacao.marcar_desatualizadas(Cliente.objects.filter(categorias_desejadas=instance))
+
+
+@receiver(post_save, sender=ProdutoFavorito)
+@receiver(post_delete, sender=ProdutoFavorito)
+@receiver(post_save, sender=LojaFavorita)
+@receiver(post_delete, sender=LojaFavorita)
+def desatualizar_recomendacoes_favorito(sender, instance, **kwargs):
+    recomendacao.marcar_desatualizadas([instance.cliente_id])
+
+
+@receiver(m2m_changed, sender=ProdutoFavorito)
+@receiver(m2m_changed, sender=LojaFavorita)
+def desatualizar_recomendacoes_favoritos(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            recomendacao.marcar_desatualizadas([instance.pk])
+    elif action == 'pre_clear':
+        recomendacao.marcar_desatualizadas(instance.clientes_que_favoritaram.all())
+    elif action in ('post_add', 'post_remove'):
+        recomendacao.marcar_desatualizadas(pk_set)
+
+
+@receiver(favoritos_em_lote, sender=ProdutoFavorito)
+@receiver(favoritos_em_lote, sender=LojaFavorita)
+def desatualizar_recomendacoes_favoritos_em_lote(sender, clientes, **kwargs):
+    recomendacao.marcar_desatualizadas(clientes)
+
+
+# Variantes de imagens (app/imagens.py): geradas no pool, depois do commit,
+# só quando o arquivo da imagem mudou
+
+@receiver(post_save, sender=Loja)
+@receiver(post_save, sender=Produto)
+@receiver(post_save, sender=Lojista)
+@receiver(post_save, sender=Cliente)
+@receiver(post_save, sender=Mapas)
+def processar_imagens(sender, instance, **kwargs):
+    for campo in imagens.pendentes(instance):
+        argumentos = (imagens.processar, sender, instance.pk, campo, getattr(instance, campo).name)
+        transaction.on_commit(lambda argumentos=argumentos: imagens.processador_imagens.enviar(*argumentos))
+
+
+@receiver(post_save, sender=Mapas)
+def gerar_mosaico(sender, instance, **kwargs):
+    # tiles do mapa (app/mosaico.py), no mesmo pool das variantes
+    if mosaico.pendente(instance):
+        argumentos = (mosaico.processar, instance.pk, instance.mapa.name)
+        transaction.on_commit(lambda: imagens.processador_imagens.enviar(*argumentos))
+
+
+# Índice espacial (app/espacial.py): descarta as grades dos mapas afetados,
+# depois do commit, para que a próxima consulta as remonte
+
+def _invalidar_grades(mapas=(), lojas=()):
+    mapas, lojas = list(mapas), list(lojas)
+
+    def invalidar():
+        espacial.indice_posicoes.invalidar_mapas(mapas)
+        espacial.indice_posicoes.invalidar_lojas(lojas)
+    transaction.on_commit(invalidar)
+
+
+@receiver(post_save, sender=PosicaoLoja)
+@receiver(post_delete, sender=PosicaoLoja)
+def invalidar_posicoes(sender, instance, **kwargs):
+    # pela loja, também o mapa anterior se a posição mudou de mapa
+    _invalidar_grades(mapas=[instance.mapa_id], lojas=[instance.loja_id])
+
+
+@receiver(post_save, sender=Loja)
+@receiver(post_delete, sender=Loja)
+def invalidar_posicoes_loja(sender, instance, **kwargs):
+    # nome, setor e ativo ficam na grade
+    _invalidar_grades(lojas=[instance.pk])
+
+
+@receiver(post_save, sender=Mapas)
+@receiver(post_delete, sender=Mapas)
+def invalidar_posicoes_mapa(sender, instance, **kwargs):
+    _invalidar_grades(mapas=[instance.pk])
+
+
+@receiver(m2m_changed, sender=Loja.categorias.through)
+def invalidar_posicoes_categorias(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        _invalidar_grades(lojas=[instance.pk])
+    elif pk_set:
+        _invalidar_grades(lojas=pk_set)
+    else:
+        transaction.on_commit(espacial.indice_posicoes.limpar)
+
+
+# Rotas (app/rotas.py): o grafo compilado do mapa guarda as posições das lojas
+
+@receiver(post_save, sender=PosicaoLoja)
+@receiver(post_delete, sender=PosicaoLoja)
+def recompilar_rotas(sender, instance, **kwargs):
+    rotas.agendar(instance.mapa_id)
+
+
+@receiver(post_delete, sender=Mapas)
+def remover_rotas(sender, instance, **kwargs):
+    rotas.agendar(instance.pk)
+
+
+# Sincronização incremental (app/sincronizacao.py): registra os ids removidos,
+# inclusive os excluídos em cascata
+
+@receiver(post_delete, sender=Setor)
+@receiver(post_delete, sender=Categoria)
+@receiver(post_delete, sender=Loja)
+@receiver(post_delete, sender=Produto)
+@receiver(post_delete, sender=Mapas)
+def registrar_remocao(sender, instance, **kwargs):
+    sincronizacao.registrar_remocao(sender, instance.pk)
+
+
+# Gravações em lote (app/lote.py), que não disparam os signals de cada objeto.
+# `atualizacao` dos produtos já é gravada junto
+
+@receiver(salvos_em_lote, sender=Produto)
+def produtos_salvos_em_lote(sender, ids, lojas, **kwargs):
+    _reindexar('produto', ids)
+    cache_respostas.invalidar(etiquetas(Produto, ids))
+    _resposta_mudou(Loja, lojas)
@@ -0,0 +1,212 @@
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import AcaoUsuario, LojaFavorita, ProdutoFavorito
+
+
+# Itens parecidos ("clientes também favoritaram"). O índice é montado fora das
+# requisições (comando construir_similares): cada cliente é uma linha de
+# interações ponderadas (favoritos e visualizações recentes), a co-ocorrência
+# item x item vem da soma dos pares de itens de cada cliente e a similaridade
+# é o cosseno entre as colunas. Ficam só os VIZINHOS mais parecidos de cada item.
+#
+# O resultado é um único .npy por tipo, uma linha por item com vizinhos, em
+# ordem de id (coluna 'id'), aberto com mmap: a consulta é uma busca binária
+# nessa coluna, sem banco e sem carregar o arquivo todo. O tamanho acompanha o
+# número de itens, não o maior id. Um novo índice substitui o anterior de uma
+# vez (os.replace) e é reaberto na próxima consulta.
+#
+# Configuração (settings.SIMILARES):
+#   DIRETORIO        onde ficam os índices
+#   VIZINHOS         vizinhos guardados por item
+#   HISTORICO_DIAS   janela das visualizações consideradas
+#   MAXIMO_CLIENTE   interações mais fortes de cada cliente usadas (limita os pares)
+#   PESOS            peso de cada fonte
+
+PADRAO = {
+    'DIRETORIO': Path(settings.BASE_DIR) / 'indices',
+    'VIZINHOS': 20,
+    'HISTORICO_DIAS': 90,
+    'MAXIMO_CLIENTE': 200,
+    'PESOS': {
+        'favoritos': 1.0,
+        'visualizacoes': 0.3,
+    },
+}
+
+FONTES = {
+    'produto': {
+        'favoritos': lambda: ProdutoFavorito.objects.values_list('cliente_id', 'produto_id'),
+        'visualizacoes': lambda: AcaoUsuario.objects.filter(produto__isnull=False)
+        .values_list('usuario__cliente', 'produto_id'),
+    },
+    'loja': {
+        'favoritos': lambda: LojaFavorita.objects.values_list('cliente_id', 'loja_id'),
+        'visualizacoes': lambda: AcaoUsuario.objects.filter(loja__isnull=False)
+        .values_list('usuario__cliente', 'loja_id'),
+    },
+}
+
+
+def configuracao():
+    config = {**PADRAO, **getattr(settings, 'SIMILARES', {})}
+    config['PESOS'] = {**PADRAO['PESOS'], **config['PESOS']}
+    return config
+
+
+def caminho(tipo):
+    return Path(configuracao()['DIRETORIO']) / f'similares_{tipo}.npy'
+
+
+def construir(tipo):
+    # Monta e publica o índice do tipo; devolve quantos itens têm vizinhos
+    config = configuracao()
+    clientes, itens, pesos = interacoes(tipo, config)
+    origem, destino, pontos = similaridades(clientes, itens, pesos, config['MAXIMO_CLIENTE'])
+    tabela = tabela_vizinhos(origem, destino, pontos, config['VIZINHOS'])
+    publicar(tabela, caminho(tipo))
+    return len(tabela)
+
+
+def interacoes(tipo, config):
+    # Trios (cliente, item, peso); cada fonte conta uma vez por par e é ponderada
+    desde = timezone.now() - timedelta(days=config['HISTORICO_DIAS'])
+    partes = []
+    for fonte, consulta in FONTES[tipo].items():
+        consulta = consulta()
+        if fonte == 'visualizacoes':
+            consulta = consulta.filter(timestamp__gte=desde)
+        pares = np.array(list(consulta.distinct().order_by()), dtype=np.float64).reshape(-1, 2)
+        pares = pares[~np.isnan(pares).any(axis=1)]  # usuários sem cliente
+        partes.append(np.column_stack([pares, np.full(len(pares), config['PESOS'][fonte])]))
+
+    trios = np.concatenate(partes)
+    if not len(trios):
+        vazio = np.empty(0, dtype=np.int64)
+        return vazio, vazio, np.empty(0)
+    # o mesmo par em várias fontes soma os pesos
+    clientes, itens = trios[:, 0].astype(np.int64), trios[:, 1].astype(np.int64)
+    base = int(itens.max()) + 1
+    chaves, inverso = np.unique(clientes * base + itens, return_inverse=True)
+    clientes, itens = np.divmod(chaves, base)
+    return clientes, itens, np.bincount(inverso, weights=trios[:, 2])
+
+
+def similaridades(clientes, itens, pesos, maximo_cliente):
+    # Cosseno entre itens: pares (origem, destino, similaridade) com origem != destino
+    if not len(itens):
+        vazio = np.empty(0, dtype=np.int64)
+        return vazio, vazio, np.empty(0)
+
+    # por cliente, só as `maximo_cliente` interações mais fortes (os pares crescem com o quadrado)
+    ordem = np.lexsort((-pesos, clientes))
+    clientes, itens, pesos = clientes[ordem], itens[ordem], pesos[ordem]
+    inicio_grupo = np.flatnonzero(np.r_[True, clientes[1:] != clientes[:-1]])
+    tamanhos = np.diff(np.r_[inicio_grupo, len(clientes)])
+    posicao = np.arange(len(clientes)) - np.repeat(inicio_grupo, tamanhos)
+    manter = posicao < maximo_cliente
+    clientes, itens, pesos = clientes[manter], itens[manter], pesos[manter]
+    inicio_grupo = np.flatnonzero(np.r_[True, clientes[1:] != clientes[:-1]])
+    tamanhos = np.diff(np.r_[inicio_grupo, len(clientes)])
+
+    # todos os pares de itens dentro de cada cliente, sem laço em Python
+    por_elemento = np.repeat(tamanhos, tamanhos)
+    esquerda = np.repeat(np.arange(len(itens)), por_elemento)
+    deslocamento = np.arange(len(esquerda)) - np.repeat(np.cumsum(por_elemento) - por_elemento, por_elemento)
+    direita = np.repeat(np.repeat(inicio_grupo, tamanhos), por_elemento) + deslocamento
+    diferentes = esquerda != direita
+    esquerda, direita = esquerda[diferentes], direita[diferentes]
+
+    # co-ocorrência esparsa: soma por par, com o par codificado num único inteiro
+    ids_itens, colunas = np.unique(itens, return_inverse=True)
+    total = len(ids_itens)
+    chaves, inverso = np.unique(colunas[esquerda] * total + colunas[direita], return_inverse=True)
+    coocorrencia = np.bincount(inverso, weights=pesos[esquerda] * pesos[direita])
+
+    origem, destino = np.divmod(chaves, total)
+    normas = np.sqrt(np.bincount(colunas, weights=pesos ** 2))
+    pontos = coocorrencia / (normas[origem] * normas[destino])
+    return ids_itens[origem], ids_itens[destino], pontos
+
+
+def tabela_vizinhos(origem, destino, pontos, vizinhos):
+    # Uma linha por item de origem, em ordem de id: os `vizinhos` destinos mais
+    # parecidos, em ordem (posições vazias com id 0)
+    dtype = np.dtype([('id', np.int64), ('ids', np.int64, (vizinhos,)), ('pontos', np.float32, (vizinhos,))])
+    if not len(origem):
+        return np.zeros(0, dtype=dtype)
+
+    ordem = np.lexsort((destino, -pontos, origem))
+    origem, destino, pontos = origem[ordem], destino[ordem], pontos[ordem]
+    inicio_grupo = np.flatnonzero(np.r_[True, origem[1:] != origem[:-1]])
+    tamanhos = np.diff(np.r_[inicio_grupo, len(origem)])
+    linha = np.repeat(np.arange(len(inicio_grupo)), tamanhos)
+    posicao = np.arange(len(origem)) - np.repeat(inicio_grupo, tamanhos)
+    manter = posicao < vizinhos
+
+    tabela = np.zeros(len(inicio_grupo), dtype=dtype)
+    tabela['id'] = origem[inicio_grupo]
+    tabela['ids'][linha[manter], posicao[manter]] = destino[manter]
+    tabela['pontos'][linha[manter], posicao[manter]] = pontos[manter]
+    return tabela
+
+
+def linha(tabela, pk):
+    # Posição do item `pk` na tabela, ou None
+    i = int(np.searchsorted(tabela['id'], pk))
+    return i if i < len(tabela) and tabela['id'][i] == pk else None
+
+
+def publicar(tabela, destino):
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    descritor, temporario = tempfile.mkstemp(dir=destino.parent, suffix='.npy')
+    try:
+        with os.fdopen(descritor, 'wb') as arquivo:
+            np.save(arquivo, tabela)
+        os.replace(temporario, destino)
+    except BaseException:
+        os.unlink(temporario)
+        raise
+
+
+class IndiceSimilares:
+
+    def __init__(self):
+        self._abertos = {}
+        self._trava = threading.Lock()
+
+    def vizinhos(self, tipo, pk, limite=None):
+        # Ids parecidos com `pk`, do mais parecido para o menos; [] sem índice ou sem dados
+        tabela = self.tabela(tipo)
+        i = linha(tabela, pk) if tabela is not None else None
+        if i is None:
+            return []
+        ids = tabela[i]['ids']
+        return ids[ids > 0][:limite].tolist()
+
+    def tabela(self, tipo):
+        arquivo = caminho(tipo)
+        try:
+            versao = arquivo.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+        aberto = self._abertos.get(tipo)
+        if aberto is None or aberto[0] != (arquivo, versao):
+            with self._trava:
+                tabela = np.load(arquivo, mmap_mode='r')
+                # índice do formato anterior (uma linha por pk): sem vizinhos até o próximo construir_similares
+                if tabela.dtype.names[0] != 'id':
+                    tabela = None
+                aberto = ((arquivo, versao), tabela)
+                self._abertos[tipo] = aberto
+        return aberto[1]
+
+
+indice_similares = IndiceSimilares()
@@ -0,0 +1,180 @@
+import base64
+import binascii
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .consultas import planejar_queryset
+from .leitura import LeituraCategoria, LeituraLoja, LeituraProduto
+from .models import Categoria, Loja, Mapas, Produto, Remocao, Setor
+from .serializers import MapasSerializer, SetorSerializer
+
+
+# Sincronização incremental do catálogo para os totens e o app offline. O
+# token guarda, por recurso, a posição (atualizacao, id) do último objeto
+# entregue e a da última remoção. Cada chamada devolve, em ordem de
+# atualização, até `limite` objetos criados ou alterados depois dessas
+# posições, os ids removidos (Remocao, gravada pelos signals de app/signals.py)
+# e o token seguinte; `mais` indica que há outra página. Sem token, começa do
+# zero: o catálogo inteiro, em páginas. Os objetos têm os mesmos campos das
+# listagens, menos favoritado, que é do usuário e não do catálogo.
+#
+# Só entram alterações com mais de MARGEM_SEGUNDOS: `atualizacao` é gravada
+# antes do commit, e uma transação ainda aberta poderia commitar uma linha
+# atrás de uma posição já entregue.
+#
+# Configuração (settings.SINCRONIZACAO):
+#   MARGEM_SEGUNDOS  idade mínima de uma alteração para ser entregue
+#   LIMITE           objetos por página, por padrão
+#   MAXIMO_LIMITE    máximo de ?limite=
+#   RETENCAO_DIAS    por quanto tempo as remoções ficam registradas; tokens
+#                    mais antigos recomeçam do zero (reiniciar: true)
+
+PADRAO = {
+    'MARGEM_SEGUNDOS': 5,
+    'LIMITE': 500,
+    'MAXIMO_LIMITE': 2000,
+    'RETENCAO_DIAS': 30,
+}
+
+VERSAO_TOKEN = 1
+
+
+def configuracao():
+    return {**PADRAO, **getattr(settings, 'SINCRONIZACAO', {})}
+
+
+class TokenInvalido(ValueError):
+    pass
+
+
+def _leitura(leitura):
+    nomes = [nome for nome in leitura.nomes() if nome != 'favoritado']
+
+    def montar(queryset, request):
+        linhas = list(leitura.valores(queryset, nomes))
+        return leitura.montar(linhas, request, nomes), [(linha['atualizacao'], linha['id']) for linha in linhas]
+    return montar
+
+
+def _serializer(serializer):
+    def montar(queryset, request):
+        contexto = {'request': request}
+        objetos = list(planejar_queryset(queryset, serializer(context=contexto)))
+        return serializer(objetos, many=True, context=contexto).data, [(obj.atualizacao, obj.pk) for obj in objetos]
+    return montar
+
+
+# nome na resposta -> (model, montagem dos objetos), na ordem em que são entregues
+RECURSOS = {
+    'setores': (Setor, _serializer(SetorSerializer)),
+    'categorias': (Categoria, _leitura(LeituraCategoria())),
+    'lojas': (Loja, _leitura(LeituraLoja())),
+    'produtos': (Produto, _leitura(LeituraProduto())),
+    'mapas': (Mapas, _serializer(MapasSerializer)),
+}
+
+TIPOS = {model: nome for nome, (model, _) in RECURSOS.items()}
+
+
+def registrar_remocao(model, pk):
+    Remocao.objects.create(tipo=TIPOS[model], objeto_id=pk)
+
+
+def podar():
+    limite = timezone.now() - timedelta(days=configuracao()['RETENCAO_DIAS'])
+    apagadas, _ = Remocao.objects.filter(removido_em__lt=limite).delete()
+    return apagadas
+
+
+def alteracoes(token, limite, request):
+    config = configuracao()
+    agora = timezone.now()
+    horizonte = agora - timedelta(seconds=config['MARGEM_SEGUNDOS'])
+    posicoes = decodificar(token)
+
+    reiniciar = posicoes is not None and posicoes['emitido'] < agora - timedelta(days=config['RETENCAO_DIAS'])
+    if posicoes is None or reiniciar:
+        # do zero: remoções anteriores não interessam, os objetos já não existem
+        posicoes = {'recursos': {}, 'remocoes': (horizonte, 0)}
+
+    alterados, mais, restante = {}, False, limite
+    for nome, (model, montar) in RECURSOS.items():
+        alterados[nome] = []
+        if not restante:
+            mais = True
+            continue
+        queryset = _depois(
+            model._default_manager.filter(atualizacao__lte=horizonte), 'atualizacao', posicoes['recursos'].get(nome)
+        )
+        dados, lidas = montar(queryset.order_by('atualizacao', 'pk')[:restante + 1], request)
+        if len(lidas) > restante:
+            dados, lidas, mais = dados[:restante], lidas[:restante], True
+        if lidas:
+            posicoes['recursos'][nome] = lidas[-1]
+        alterados[nome] = dados
+        restante -= len(lidas)
+
+    removidos = {nome: [] for nome in RECURSOS}
+    queryset = _depois(Remocao.objects.filter(removido_em__lte=horizonte), 'removido_em', posicoes['remocoes'])
+    remocoes = list(
+        queryset.order_by('removido_em', 'pk').values_list('tipo', 'objeto_id', 'removido_em', 'pk')[:limite + 1]
+    )
+    if len(remocoes) > limite:
+        remocoes, mais = remocoes[:limite], True
+    for tipo, objeto, removido_em, pk in remocoes:
+        removidos.setdefault(tipo, []).append(objeto)
+        posicoes['remocoes'] = (removido_em, pk)
+
+    return {
+        'token': codificar({**posicoes, 'emitido': horizonte}),
+        'mais': mais,
+        'reiniciar': reiniciar,
+        'alteracoes': alterados,
+        'remocoes': removidos,
+    }
+
+
+def _depois(queryset, campo, posicao):
+    if posicao is None:
+        return queryset
+    momento, pk = posicao
+    return queryset.filter(Q(**{f'{campo}__gt': momento}) | Q(**{campo: momento, 'pk__gt': pk}))
+
+
+def codificar(posicoes):
+    texto = json.dumps({
+        'v': VERSAO_TOKEN,
+        'emitido': posicoes['emitido'].isoformat(),
+        'recursos': {nome: [momento.isoformat(), pk] for nome, (momento, pk) in posicoes['recursos'].items()},
+        'remocoes': [posicoes['remocoes'][0].isoformat(), posicoes['remocoes'][1]],
+    }, separators=(',', ':'))
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+
+def decodificar(token):
+    # None sem token; TokenInvalido se o token não é deste servidor
+    if not token:
+        return None
+    try:
+        dados = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if dados['v'] != VERSAO_TOKEN:
+            raise ValueError(dados['v'])
+        return {
+            'emitido': _momento(dados['emitido']),
+            'recursos': {nome: (_momento(m), int(pk)) for nome, (m, pk) in dados['recursos'].items() if nome in RECURSOS},
+            'remocoes': (_momento(dados['remocoes'][0]), int(dados['remocoes'][1])),
+        }
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError, AttributeError):
+        raise TokenInvalido('Token de sincronização inválido.')
+
+
+def _momento(texto):
+    momento = parse_datetime(texto)
+    if momento is None or timezone.is_naive(momento):
+        raise ValueError(texto)
+    return momento
@@ -1,3 +1,1916 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import math
+import random
+import sqlite3
+import tempfile
+import threading
+import warnings
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from urllib.parse import quote
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import AsyncClient, TestCase, override_settings
+from django.urls import include, path, resolve
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+import numpy as np
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import (
+    Lojista, Cliente, Loja, Produto, Categoria, Avaliacao,
+    ProdutoFavorito, LojaFavorita, Setor, AcaoUsuario, TotemPessoal, ArquivoAcoes, Mapas,
+    PosicaoLoja, Remocao
+)
+from . import busca, urls
+from .eventos import FilaAcoes
+from .cache import cache_respostas
+from . import espacial, imagens, metricas, pacotes, recomendacao, retencao, rotas, similares, sincronizacao
+from .consultas import em_ordem, lojas_queryset, planejar_queryset
+from .exportacao import Exportacao
+from .leitura import JSONRapidoRenderer
+from .serializers import CategoriaSerializer, LojaSerializer, PesquisaSerializer, ProdutoSerializer
+
+
+@override_settings(
+    ACOES_FILA={'SINCRONO': True},
+    CACHE_RESPOSTAS={'ATIVO': False},
+    IMAGENS={'SINCRONO': True},
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class CatalogoTestCase(TestCase):
+    # Catálogo mínimo: um cliente autenticado, um lojista e n lojas com produtos.
+
+    def setUp(self):
+        busca.motor.limpar()
+        espacial.indice_posicoes.limpar()
+        cache_respostas.limpar()
+        self.categoria = Categoria.objects.create(nome='Praia')
+        user_lojista = User.objects.create_user(username='lojista@feira.com', password='x')
+        self.lojista = Lojista.objects.create(user=user_lojista, nome='Lojista', telefone='1', cnpj='1')
+
+        self.user = User.objects.create_user(username='cliente@feira.com', email='cliente@feira.com', password='x')
+        self.cliente = Cliente.objects.create(user=self.user, nome='Cliente', cpf='1', telefone='1', genero='F', tipo='Local')
+        self.cliente.categorias_desejadas.add(self.categoria)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def criar_lojas(self, n, favoritar=True):
+        for i in range(n):
+            loja = Loja.objects.create(nome=f'Loja {i}', lojista=self.lojista)
+            loja.categorias.add(self.categoria)
+            produto = Produto.objects.create(
+                nome=f'Produto {i}', descricao='d', loja=loja, cor='azul', composicao='algodão'
+            )
+            produto.categorias.add(self.categoria)
+            Avaliacao.objects.create(cliente=self.cliente, loja=loja, nota=4)
+            if favoritar:
+                ProdutoFavorito.objects.create(cliente=self.cliente, produto=produto)
+                LojaFavorita.objects.create(cliente=self.cliente, loja=loja)
+
+    def consultas(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            resposta = self.client.get(url)
+        self.assertEqual(resposta.status_code, 200)
+        return resposta, [q['sql'] for q in ctx.captured_queries]
+
+
+class FavoritadoConsultasTests(CatalogoTestCase):
+    ENDPOINTS = ['/api/produtos/', '/api/lojas/', '/api/pesquisa/?nome=', '/api/produtos-recomendados/']
+
+    def consultas_favoritos(self, url):
+        _, sqls = self.consultas(url)
+        return [sql for sql in sqls if 'app_produtofavorito' in sql or 'app_lojafavorita' in sql]
+
+    def test_favoritado_carrega_ids_uma_vez_por_requisicao(self):
+        # recomendações pré-calculadas, para que a listagem cresça junto
+        self.criar_lojas(2)
+        recomendacao.atualizar(completo=True)
+        poucas = {url: len(self.consultas_favoritos(url)) for url in self.ENDPOINTS}
+        self.criar_lojas(8)
+        recomendacao.atualizar(completo=True)
+        for url in self.ENDPOINTS:
+            with self.subTest(url=url):
+                self.assertLessEqual(len(self.consultas_favoritos(url)), 2)
+                self.assertEqual(len(self.consultas_favoritos(url)), poucas[url])
+
+    def test_favoritado_reflete_favoritos_do_cliente(self):
+        self.criar_lojas(1)
+        self.criar_lojas(1, favoritar=False)
+        produtos = self.client.get('/api/produtos/').json()['results']
+        self.assertEqual(sorted(p['favoritado'] for p in produtos), [False, True])
+        lojas = self.client.get('/api/lojas/').json()['results']
+        self.assertEqual(sorted(l['favoritado'] for l in lojas), [False, True])
+
+    def test_favoritado_em_serializer_aninhado(self):
+        self.criar_lojas(3)
+        cliente = self.client.get(f'/api/clientes/{self.cliente.pk}/?expand=produtos_favoritos,lojas_favoritas').json()
+        self.assertTrue(all(p['favoritado'] for p in cliente['produtos_favoritos']))
+        self.assertTrue(all(l['favoritado'] for l in cliente['lojas_favoritas']))
+
+
+class PlanejamentoConsultasTests(CatalogoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.setor = Setor.objects.create(nome='Artesanato')
+
+    def criar_lojas(self, n, favoritar=True):
+        super().criar_lojas(n, favoritar)
+        Loja.objects.update(setor=self.setor)
+
+    def endpoints(self):
+        return [
+            '/api/lojas/',
+            '/api/produtos/',
+            f'/api/categorias/{self.categoria.pk}/lojas/',
+            f'/api/setores/{self.setor.pk}/lojas/',
+            f'/api/clientes/{self.cliente.pk}/lojas_favoritas/',
+            f'/api/clientes/{self.cliente.pk}/produtos_favoritos/',
+            '/api/lojas-recomendadas/',
+            '/api/pesquisa/?nome=Loja',
+        ]
+
+    def test_listagens_custam_numero_constante_de_queries(self):
+        self.criar_lojas(2)
+        for url in self.endpoints():
+            self.consultas(url)  # monta o índice de busca
+        poucas = {url: len(self.consultas(url)[1]) for url in self.endpoints()}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.criar_lojas(10)
+        for url in self.endpoints():
+            with self.subTest(url=url):
+                self.assertEqual(len(self.consultas(url)[1]), poucas[url])
+
+    def test_listagem_de_lojas_mantem_relacoes(self):
+        self.criar_lojas(1)
+        loja = self.client.get('/api/lojas/').json()['results'][0]
+        produto = Produto.objects.get()
+        self.assertEqual(loja['produtos'], [produto.pk])
+        self.assertEqual(loja['categorias'], [self.categoria.pk])
+        self.assertEqual(loja['avaliacoes'], list(Avaliacao.objects.values_list('pk', flat=True)))
+        self.assertEqual(loja['nota_media'], 4.0)
+
+
+class NotaLojaTests(CatalogoTestCase):
+
+    def nota(self, loja):
+        loja.refresh_from_db()
+        return loja.nota, loja.total_avaliacoes
+
+    def test_nota_incremental_acompanha_avaliacoes(self):
+        loja = Loja.objects.create(nome='A', lojista=self.lojista)
+        outra = Loja.objects.create(nome='B', lojista=self.lojista)
+
+        a1 = Avaliacao.objects.create(cliente=self.cliente, loja=loja, nota=5)
+        a2 = Avaliacao.objects.create(cliente=self.cliente, loja=loja, nota=2)
+        self.assertEqual(self.nota(loja), (3.5, 2))
+
+        a2.nota = 4
+        a2.save()
+        self.assertEqual(self.nota(loja), (4.5, 2))
+
+        a1.loja = outra
+        a1.save()
+        self.assertEqual(self.nota(loja), (4.0, 1))
+        self.assertEqual(self.nota(outra), (5.0, 1))
+
+        a2.delete()
+        self.assertEqual(self.nota(loja), (0.0, 0))
+
+    def test_recalcular_notas_corrige_desvios(self):
+        loja = Loja.objects.create(nome='A', lojista=self.lojista)
+        Avaliacao.objects.create(cliente=self.cliente, loja=loja, nota=3)
+        Avaliacao.objects.create(cliente=self.cliente, loja=loja, nota=4)
+        Loja.objects.update(nota=0, total_avaliacoes=0)
+        call_command('recalcular_notas', stdout=StringIO())
+        self.assertEqual(self.nota(loja), (3.5, 2))
+
+    def test_nota_media_nula_sem_avaliacoes(self):
+        Loja.objects.create(nome='A', lojista=self.lojista)
+        self.assertIsNone(self.client.get('/api/lojas/').json()['results'][0]['nota_media'])
+
+
+class BuscaTests(CatalogoTestCase):
+
+    def test_normalizar_remove_acentos_e_plurais(self):
+        self.assertEqual(busca.normalizar('Chapéus de PRAIA'), busca.normalizar('chapeu praias'))
+        self.assertEqual(busca.normalizar('Calções'), busca.normalizar('calcao'))
+        self.assertEqual(busca.normalizar('a de para'), [])
+
+    def test_bm25_prioriza_nome(self):
+        indice = busca.IndiceInvertido()
+        indice.adicionar(1, busca.normalizar('vestido floral') * 3 + busca.normalizar('algodão'))
+        indice.adicionar(2, busca.normalizar('camisa') * 3 + busca.normalizar('combina com vestido'))
+        indice.adicionar(3, busca.normalizar('sunga') * 3)
+        self.assertEqual(indice.buscar(busca.normalizar('vestidos')), [1, 2])
+        self.assertEqual(indice.buscar(busca.normalizar('vest')), [1, 2])
+        indice.remover(1)
+        self.assertEqual(indice.buscar(busca.normalizar('vestido')), [2])
+
+    def test_pesquisa_ranqueia_e_pagina(self):
+        loja = Loja.objects.create(nome='Rota do Mar', lojista=self.lojista)
+        for i in range(3):
+            Produto.objects.create(nome=f'Sunga {i}', descricao='moda praia', loja=loja, cor='azul', composicao='lycra')
+        Produto.objects.create(nome='Chapéu', descricao='chapéu de palha para sunga', loja=loja, cor='bege', composicao='palha')
+
+        resposta = self.client.get('/api/pesquisa/?nome=sungas&limite=3').json()
+        self.assertEqual([p['nome'] for p in resposta['produtos']], ['Sunga 0', 'Sunga 1', 'Sunga 2'])
+        self.assertEqual(resposta['proximo_cursor'], '3')
+
+        resposta = self.client.get('/api/pesquisa/?nome=sungas&limite=3&cursor=3').json()
+        self.assertEqual([p['nome'] for p in resposta['produtos']], ['Chapéu'])
+        self.assertIsNone(resposta['proximo_cursor'])
+
+    def test_termo_sem_palavras_nao_lista_tudo(self):
+        Loja.objects.create(nome='Loja de Praia', lojista=self.lojista)
+        for termo in ('de', '!!!', 'a de para'):
+            resposta = self.client.get('/api/pesquisa/', {'nome': termo}).json()
+            self.assertEqual((resposta['lojas'], resposta['produtos']), ([], []), termo)
+        self.assertEqual(len(self.client.get('/api/pesquisa/', {'nome': ' '}).json()['lojas']), 1)
+
+    def test_indice_atualiza_em_save_e_delete(self):
+        loja = Loja.objects.create(nome='Casa do Bebê', lojista=self.lojista)
+        self.assertEqual(busca.motor.buscar('loja', 'bebe'), [loja.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            loja.nome = 'Rota do Mar'
+            loja.save()
+            loja.categorias.add(self.categoria)
+        self.assertEqual(busca.motor.buscar('loja', 'bebe'), [])
+        self.assertEqual(busca.motor.buscar('loja', 'praia'), [loja.pk])
+
+        loja.delete()
+        self.assertEqual(busca.motor.buscar('loja', 'mar'), [])
+
+    def test_remontagem_fora_da_trava(self):
+        loja = Loja.objects.create(nome='Casa do Bebê', lojista=self.lojista)
+        self.assertEqual(busca.motor.buscar('loja', 'bebe'), [loja.pk])
+        documentos, durante = busca.documentos, {}
+
+        def lendo_o_banco(tipo, ids=None):
+            linhas = list(documentos(tipo, ids))
+            if ids is None and tipo == 'loja':
+                # outra thread busca no índice anterior enquanto o novo é montado
+                thread = threading.Thread(target=lambda: durante.update(busca=busca.motor.buscar('loja', 'bebe')))
+                thread.start()
+                thread.join(5)
+                # e uma loja salva no meio entra no índice novo
+                durante['nova'] = Loja.objects.create(nome='Bebê a Bordo', lojista=self.lojista)
+                busca.motor.reindexar('loja', [durante['nova'].pk])
+            return linhas
+
+        with override_settings(BUSCA_REMONTAR_SEGUNDOS=0), mock.patch.object(busca, 'documentos', lendo_o_banco):
+            busca.motor.buscar('loja', 'bebe')
+        self.assertEqual(durante['busca'], [loja.pk])
+        self.assertCountEqual(busca.motor.buscar('loja', 'bebe'), [loja.pk, durante['nova'].pk])
+
+
+class FilaAcoesTests(CatalogoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loja = Loja.objects.create(nome='Loja', lojista=self.lojista)
+
+    @override_settings(ACOES_FILA={'LOTE': 2})
+    def test_acoes_sao_gravadas_em_lote(self):
+        fila = FilaAcoes(iniciar_trabalhador=False)
+        for _ in range(3):
+            fila.registrar(self.user, 'visualizou loja', loja=self.loja)
+        self.assertEqual(AcaoUsuario.objects.count(), 0)
+
+        with self.assertNumQueries(2):
+            fila.esvaziar()
+        self.assertEqual(AcaoUsuario.objects.filter(loja=self.loja, usuario=self.user).count(), 3)
+        self.assertEqual(fila.estatisticas(), {
+            'enfileiradas': 3, 'gravadas': 3, 'descartadas': 0, 'falhas': 0, 'pendentes': 0,
+        })
+
+    @override_settings(ACOES_FILA={})
+    def test_referencia_excluida_nao_derruba_o_lote(self):
+        fila = FilaAcoes(iniciar_trabalhador=False)
+        outro = User.objects.create_user(username='outro@feira.com', password='x')
+        produto = Produto.objects.create(nome='Sunga', descricao='d', loja=self.loja, cor='azul', composicao='lycra')
+        fila.registrar(self.user, 'visualizou loja', loja=self.loja)
+        fila.registrar(outro, 'visualizou loja', loja=self.loja)
+        fila.registrar(self.user, 'visualizou produto', produto=produto)
+        outro.delete()
+        produto.delete()
+
+        # a checagem das chaves estrangeiras só falha no commit, fora da transação do teste
+        bulk_create, falhas = AcaoUsuario.objects.bulk_create, [IntegrityError('FOREIGN KEY constraint failed')]
+
+        def falhando_uma_vez(objetos, *args, **kwargs):
+            if falhas:
+                raise falhas.pop()
+            return bulk_create(objetos, *args, **kwargs)
+
+        with mock.patch.object(AcaoUsuario.objects, 'bulk_create', falhando_uma_vez):
+            fila.esvaziar()
+        self.assertEqual(
+            list(AcaoUsuario.objects.order_by('pk').values_list('usuario_id', 'loja_id', 'produto_id')),
+            [(self.user.pk, self.loja.pk, None), (self.user.pk, None, None)],
+        )
+        self.assertEqual((fila.estatisticas()['gravadas'], fila.estatisticas()['falhas']), (2, 1))
+
+    @override_settings(ACOES_FILA={'TAMANHO_MAXIMO': 2, 'ESPERA_MAXIMA': 0})
+    def test_fila_cheia_descarta_e_conta(self):
+        fila = FilaAcoes(iniciar_trabalhador=False)
+        for _ in range(3):
+            fila.registrar(self.user, 'visualizou loja', loja=self.loja)
+        self.assertEqual(fila.estatisticas()['descartadas'], 1)
+        self.assertEqual(fila.estatisticas()['pendentes'], 2)
+
+    def test_detalhe_registra_acao(self):
+        self.client.get(f'/api/lojas/{self.loja.pk}/')
+        self.assertTrue(AcaoUsuario.objects.filter(loja=self.loja, acao='visualizou loja').exists())
+
+
+class MetricasTests(CatalogoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loja = Loja.objects.create(nome='Loja', lojista=self.lojista)
+
+    def acao(self, quando):
+        AcaoUsuario.objects.create(
+            usuario=self.user, acao='visualizou loja', loja=self.loja, timestamp=quando, gravado_em=quando
+        )
+
+    def test_agregacao_incremental_por_hora_e_dia(self):
+        hora = datetime(2025, 6, 10, 14, tzinfo=dt_timezone.utc)
+        self.acao(hora + timedelta(minutes=5))
+        self.acao(hora + timedelta(minutes=50))
+        self.acao(hora + timedelta(hours=1))
+        self.assertEqual(metricas.agregar_tudo(), {'acoes': 3, 'totens': 0})
+
+        self.acao(hora + timedelta(minutes=30))
+        self.assertEqual(metricas.agregar_tudo(), {'acoes': 1, 'totens': 0})
+        self.assertEqual(metricas.agregar_tudo(), {'acoes': 0, 'totens': 0})
+
+        with self.assertNumQueries(1):
+            por_hora = self.client.get(f'/api/metricas/acoes/?periodo=hora&loja={self.loja.pk}').json()
+        self.assertEqual([linha['total'] for linha in por_hora], [3, 1])
+        por_dia = self.client.get('/api/metricas/acoes/?agrupar=loja&inicio=2025-06-10&fim=2025-06-10').json()
+        self.assertEqual(por_dia, [{'inicio': '2025-06-10T00:00:00Z', 'loja': self.loja.pk, 'total': 4}])
+
+    def test_dimensoes_com_id_invalido(self):
+        for url in ('/api/metricas/acoes/?loja=abc', '/api/metricas/acoes/?produto=1.5', '/api/metricas/totens/?categoria=x'):
+            resposta = self.client.get(url)
+            self.assertEqual(resposta.status_code, 400, url)
+            self.assertIn('deve ser inteiro', resposta.json()['detail'])
+        self.assertEqual(self.client.get('/api/metricas/totens/?genero=abc').json(), [])
+
+    def test_eventos_recentes_ficam_para_depois(self):
+        self.acao(datetime.now(dt_timezone.utc))
+        self.assertEqual(metricas.agregar('acoes'), 0)
+
+    def test_margem_conta_a_gravacao_e_nao_o_evento(self):
+        # um lote da fila gravado agora com ações de minutos atrás
+        AcaoUsuario.objects.create(
+            usuario=self.user, acao='visualizou loja', timestamp=datetime.now(dt_timezone.utc) - timedelta(minutes=5)
+        )
+        self.assertEqual(metricas.agregar('acoes'), 0)
+        AcaoUsuario.objects.update(gravado_em=datetime.now(dt_timezone.utc) - timedelta(minutes=1))
+        self.assertEqual(metricas.agregar('acoes'), 1)
+
+    def test_totens_por_faixa_etaria_e_categoria(self):
+        for faixa in ('18-25', '18-25', '26-35'):
+            TotemPessoal.objects.create(tipo_usuario='Turista', faixa_etaria=faixa, genero='F', categoria=self.categoria)
+        TotemPessoal.objects.update(criacao=datetime(2025, 6, 10, 9, tzinfo=dt_timezone.utc))
+        metricas.agregar_tudo()
+        linhas = self.client.get('/api/metricas/totens/?agrupar=faixa_etaria,categoria').json()
+        self.assertEqual(
+            [(l['faixa_etaria'], l['categoria'], l['total']) for l in linhas],
+            [('18-25', self.categoria.pk, 2), ('26-35', self.categoria.pk, 1)],
+        )
+
+
+class PaginacaoTests(CatalogoTestCase):
+
+    def paginas(self, url):
+        itens = []
+        while url:
+            resposta = self.client.get(url).json()
+            itens.extend(resposta['results'])
+            url = resposta['next']
+        return itens
+
+    def test_cursor_percorre_tudo_mesmo_com_criacao_empatada(self):
+        self.criar_lojas(7)
+        Produto.objects.update(criacao=datetime(2025, 6, 10, tzinfo=dt_timezone.utc))
+        produtos = self.paginas('/api/produtos/?limite=3')
+        ids = list(Produto.objects.order_by('-pk').values_list('pk', flat=True))
+        self.assertEqual([p['id'] for p in produtos], ids)
+
+    def test_actions_paginadas(self):
+        self.criar_lojas(3)
+        loja = Loja.objects.first()
+        for i in range(4):
+            AcaoUsuario.objects.create(usuario=self.user, acao=f'acao {i}', loja=loja)
+        acoes = self.paginas(f'/api/lojas/{loja.pk}/acoes/?limite=3')
+        self.assertEqual([a['acao'] for a in acoes], ['acao 3', 'acao 2', 'acao 1', 'acao 0'])
+        self.assertEqual(len(self.paginas(f'/api/categorias/{self.categoria.pk}/lojas/?limite=2')), 3)
+
+    def test_cursor_invalido(self):
+        self.assertEqual(self.client.get('/api/produtos/?cursor=xyz').status_code, 404)
+
+    def test_fields_limita_campos_e_consultas(self):
+        self.criar_lojas(3)
+        _, todas = self.consultas('/api/lojas/')
+        resposta, enxutas = self.consultas('/api/lojas/?fields=id,nome')
+        self.assertEqual(set(resposta.json()['results'][0]), {'id', 'nome'})
+        self.assertLess(len(enxutas), len(todas))
+        self.assertFalse([sql for sql in enxutas if 'app_lojafavorita' in sql or 'app_produto' in sql])
+
+
+class PlanoConsultasTests(CatalogoTestCase):
+    # Executa os endpoints principais, roda EXPLAIN em cada query que toca uma
+    # tabela quente e exige acesso por índice (SQLite e PostgreSQL).
+
+    TABELAS = (
+        'app_acaousuario', 'app_avaliacao', 'app_produtofavorito', 'app_lojafavorita',
+        'app_produto', 'app_loja',
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.criar_lojas(3)
+        self.loja = Loja.objects.first()
+        self.produto = Produto.objects.first()
+        for _ in range(3):
+            AcaoUsuario.objects.create(usuario=self.user, acao='visualizou loja', loja=self.loja, produto=self.produto)
+
+    def endpoints(self):
+        return [
+            '/api/lojas/',
+            '/api/produtos/',
+            '/api/acoes/',
+            f'/api/lojas/{self.loja.pk}/acoes/',
+            f'/api/lojas/{self.loja.pk}/avaliacoes/',
+            f'/api/lojas/{self.loja.pk}/favoritas/',
+            f'/api/produtos/{self.produto.pk}/favoritos/',
+            f'/api/clientes/{self.cliente.pk}/produtos_favoritos/',
+        ]
+
+    def planos(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                return [linha[-1] for linha in cursor.fetchall()]
+            # com tabelas pequenas o PostgreSQL prefere Seq Scan; desligado, só sobra se não houver índice
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql)
+            return [linha[0] for linha in cursor.fetchall()]
+
+    def varreduras_sem_indice(self, sql):
+        problemas = []
+        for plano in self.planos(sql):
+            for tabela in self.TABELAS:
+                if connection.vendor == 'sqlite':
+                    sem_indice = plano.startswith(f'SCAN {tabela}') and 'USING' not in plano
+                else:
+                    sem_indice = f'Seq Scan on {tabela}' in plano
+                if sem_indice:
+                    problemas.append(plano)
+        return problemas
+
+    def test_endpoints_usam_indices(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest('Planos verificados apenas em SQLite e PostgreSQL')
+        for url in self.endpoints():
+            _, sqls = self.consultas(url)
+            for sql in sqls:
+                if sql.startswith('SELECT') and any(tabela in sql for tabela in self.TABELAS):
+                    with self.subTest(url=url, sql=sql):
+                        self.assertEqual(self.varreduras_sem_indice(sql), [])
+
+    def test_favorito_duplicado_e_rejeitado(self):
+        resposta = self.client.post('/api/produtos_favoritos/', {'cliente': self.cliente.pk, 'produto': self.produto.pk})
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(ProdutoFavorito.objects.filter(cliente=self.cliente, produto=self.produto).count(), 1)
+
+
+@override_settings(CACHE_RESPOSTAS={'BACKEND': 'local', 'CAPACIDADE': 100, 'TTL': 60})
+class CacheRespostasTests(CatalogoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.criar_lojas(2)
+        self.loja, self.outra = Loja.objects.order_by('pk')
+        self.admin = User.objects.create_superuser(username='admin@feira.com', password='x')
+
+    def contadores(self):
+        return {k: v for k, v in cache_respostas.estatisticas().items() if isinstance(v, int)}
+
+    def test_segunda_leitura_nao_consulta_o_banco(self):
+        for url in ('/api/lojas/', '/api/produtos/', '/api/categorias/', f'/api/lojas/{self.loja.pk}/'):
+            with self.subTest(url=url):
+                primeira, _ = self.consultas(url)
+                segunda, sqls = self.consultas(url)
+                self.assertEqual(segunda.json(), primeira.json())
+                self.assertEqual([sql for sql in sqls if sql.startswith('SELECT')], [])
+
+    def test_alteracao_invalida_apenas_o_objeto(self):
+        self.client.get('/api/lojas/')
+        self.client.get(f'/api/lojas/{self.loja.pk}/')
+        self.client.get(f'/api/lojas/{self.outra.pk}/')
+
+        self.loja.nome = 'Renomeada'
+        self.loja.save()
+
+        self.assertEqual(self.client.get(f'/api/lojas/{self.loja.pk}/').json()['nome'], 'Renomeada')
+        self.assertIn('Renomeada', [l['nome'] for l in self.client.get('/api/lojas/').json()['results']])
+        _, sqls = self.consultas(f'/api/lojas/{self.outra.pk}/')
+        self.assertEqual([sql for sql in sqls if sql.startswith('SELECT')], [])
+
+    def test_relacionados_invalidam_a_loja(self):
+        url = f'/api/lojas/{self.loja.pk}/'
+        self.client.get(url)
+        Avaliacao.objects.create(cliente=self.cliente, loja=self.loja, nota=2)
+        self.assertEqual(self.client.get(url).json()['nota_media'], 3.0)
+
+        produto = Produto.objects.create(nome='Novo', descricao='d', loja=self.loja, cor='c', composicao='c')
+        self.assertIn(produto.pk, self.client.get(url).json()['produtos'])
+
+        self.categoria.lojas.clear()
+        self.assertEqual(self.client.get(url).json()['categorias'], [])
+
+    def test_favoritado_e_por_usuario(self):
+        url = f'/api/lojas/{self.loja.pk}/'
+        self.assertTrue(self.client.get(url).json()['favoritado'])
+
+        outro = User.objects.create_user(username='outro@feira.com', password='x')
+        Cliente.objects.create(user=outro, nome='Outro', cpf='2', telefone='2', genero='M', tipo='Local')
+        cliente_outro = APIClient()
+        cliente_outro.force_authenticate(outro)
+        self.assertFalse(cliente_outro.get(url).json()['favoritado'])
+
+        self.cliente.lojas_favoritas.remove(self.loja)
+        self.assertFalse(self.client.get(url).json()['favoritado'])
+
+    def test_visualizacao_registrada_mesmo_com_cache(self):
+        for _ in range(2):
+            self.client.get(f'/api/lojas/{self.loja.pk}/')
+        self.assertEqual(AcaoUsuario.objects.filter(loja=self.loja).count(), 2)
+
+    @override_settings(CACHE_RESPOSTAS={'BACKEND': 'local', 'CAPACIDADE': 2, 'TTL': 60})
+    def test_lru_despeja_as_menos_usadas(self):
+        antes = self.contadores()
+        for url in ('/api/categorias/', '/api/setores/', '/api/categorias/', '/api/mapa/'):
+            self.client.get(url)
+        depois = self.contadores()
+        self.assertEqual(depois['acertos'] - antes['acertos'], 1)
+        self.assertEqual(depois['despejadas'] - antes.get('despejadas', 0), 1)
+        # /api/setores/ foi a menos usada e saiu; /api/categorias/ continua
+        _, sqls = self.consultas('/api/categorias/')
+        self.assertEqual(sqls, [])
+        _, sqls = self.consultas('/api/setores/')
+        self.assertNotEqual(sqls, [])
+
+    @override_settings(CACHE_RESPOSTAS={'BACKEND': 'local', 'TTL': 0})
+    def test_ttl_expira_as_entradas(self):
+        self.client.get('/api/categorias/')
+        _, sqls = self.consultas('/api/categorias/')
+        self.assertNotEqual(sqls, [])
+        self.assertEqual(self.contadores()['expiradas'], 1)
+
+    @override_settings(CACHE_RESPOSTAS={'BACKEND': 'django', 'ALIAS': 'default', 'TTL': 60})
+    def test_backend_compartilhado(self):
+        url = f'/api/produtos/{Produto.objects.first().pk}/'
+        self.client.get(url)
+        _, sqls = self.consultas(url)
+        self.assertEqual([sql for sql in sqls if sql.startswith('SELECT')], [])
+
+        Produto.objects.filter(pk=Produto.objects.first().pk).first().save()
+        _, sqls = self.consultas(url)
+        self.assertNotEqual([sql for sql in sqls if sql.startswith('SELECT')], [])
+
+    def test_estatisticas_so_para_admin(self):
+        self.assertEqual(self.client.get('/api/cache/').status_code, 403)
+        self.client.force_authenticate(self.admin)
+        dados = self.client.get('/api/cache/').json()
+        self.assertEqual(dados['backend'], 'local')
+        self.assertIn('taxa_acertos', dados)
+
+
+class RespostaCondicionalTests(CatalogoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.criar_lojas(2)
+        self.loja, self.outra = Loja.objects.order_by('pk')
+
+    def etag(self, url):
+        resposta = self.client.get(url)
+        self.assertEqual(resposta.status_code, 200)
+        return resposta['ETag']
+
+    def test_if_none_match_responde_304(self):
+        for url in ('/api/lojas/', '/api/categorias/', '/api/setores/', f'/api/lojas/{self.loja.pk}/'):
+            with self.subTest(url=url):
+                etag = self.etag(url)
+                resposta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(resposta.status_code, 304)
+                self.assertEqual(resposta['ETag'], etag)
+                self.assertEqual(resposta.content, b'')
+
+    def test_304_nao_serializa(self):
+        url = '/api/lojas/'
+        etag = self.etag(url)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        # só o agregado das lojas e o dos favoritos do usuário
+        self.assertEqual(len(ctx.captured_queries), 2)
+
+    def test_etag_muda_com_os_dados(self):
+        url = f'/api/lojas/{self.loja.pk}/'
+        etags = [self.etag(url), self.etag('/api/lojas/')]
+
+        def mudou():
+            novas = [self.etag(url), self.etag('/api/lojas/')]
+            self.assertNotEqual(novas[0], etags[0])
+            self.assertNotEqual(novas[1], etags[1])
+            etags[:] = novas
+
+        Avaliacao.objects.create(cliente=self.cliente, loja=self.loja, nota=1)
+        mudou()
+        Produto.objects.create(nome='Novo', descricao='d', loja=self.loja, cor='c', composicao='c')
+        mudou()
+        self.loja.categorias.clear()
+        mudou()
+        self.cliente.lojas_favoritas.remove(self.loja)
+        mudou()
+
+        lista = self.etag('/api/lojas/')
+        self.outra.delete()
+        self.assertNotEqual(self.etag('/api/lojas/'), lista)
+
+    def test_if_modified_since_no_detalhe(self):
+        url = f'/api/produtos/{Produto.objects.first().pk}/'
+        ultima = self.client.get(url)['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=ultima).status_code, 304)
+        self.assertNotIn('Last-Modified', self.client.get('/api/produtos/'))
+
+    @override_settings(CACHE_RESPOSTAS={'BACKEND': 'local'})
+    def test_acerto_no_cache_responde_304_sem_banco(self):
+        url = '/api/categorias/'
+        etag = self.etag(url)
+        with CaptureQueriesContext(connection) as ctx:
+            resposta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 304)
+        self.assertEqual(ctx.captured_queries, [])
+
+
+class RecomendacaoTests(CatalogoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.moda = Categoria.objects.create(nome='Moda')
+        self.cozinha = Categoria.objects.create(nome='Cozinha')
+
+    def loja(self, nome, categoria, nota=None):
+        loja = Loja.objects.create(nome=nome, lojista=self.lojista)
+        loja.categorias.add(categoria)
+        if nota is not None:
+            Avaliacao.objects.create(cliente=self.cliente, loja=loja, nota=nota)
+        return loja
+
+    def recomendadas(self, **params):
+        resposta = self.client.get('/api/lojas-recomendadas/', params)
+        self.assertEqual(resposta.status_code, 200)
+        return [loja['nome'] for loja in resposta.json()]
+
+    def test_ordena_por_afinidade_e_nota(self):
+        self.loja('Praia boa', self.categoria, nota=5)
+        self.loja('Praia fraca', self.categoria, nota=1)
+        self.loja('Moda', self.moda, nota=5)
+        recomendacao.atualizar()
+        self.assertEqual(self.recomendadas(), ['Praia boa', 'Praia fraca'])
+        self.assertEqual(self.recomendadas(limite=1), ['Praia boa'])
+
+    def test_cliente_sem_lista_recebe_os_de_melhor_nota(self):
+        self.loja('Praia fraca', self.categoria, nota=1)
+        self.loja('Praia boa', self.categoria, nota=4)
+        self.loja('Moda', self.moda, nota=5)
+        self.loja('Cozinha', self.cozinha, nota=3)
+        with mock.patch.object(recomendacao.Recomendador, 'recalcular') as recalcular:
+            # das categorias desejadas e, sem nenhuma loja nelas, de todo o catálogo
+            self.assertEqual(self.recomendadas(), ['Praia boa', 'Praia fraca'])
+            self.cliente.categorias_desejadas.set([Categoria.objects.create(nome='Vazia')])
+            self.assertEqual(self.recomendadas(), ['Moda', 'Praia boa', 'Cozinha', 'Praia fraca'])
+        recalcular.assert_not_called()
+
+        # a próxima atualização calcula a lista que falta
+        self.cliente.categorias_desejadas.set([self.categoria])
+        self.assertEqual(recomendacao.atualizar()['loja']['recalculadas'], 1)
+        self.assertEqual(self.recomendadas(limite=1), ['Praia boa'])
+
+    def test_favoritos_e_visualizacoes_entram_no_perfil(self):
+        self.loja('Praia', self.categoria)
+        moda = self.loja('Moda', self.moda)
+        cozinha = self.loja('Cozinha', self.cozinha)
+        recomendacao.atualizar()
+        self.assertEqual(self.recomendadas(), ['Praia'])
+
+        self.cliente.lojas_favoritas.add(moda)
+        AcaoUsuario.objects.create(usuario=self.user, acao='visualizou loja', loja=cozinha)
+        self.assertEqual(self.recomendadas(), ['Praia'])  # lista antiga até a próxima atualização
+
+        totais = recomendacao.atualizar()
+        self.assertEqual(totais['loja']['recalculadas'], 1)
+        # categorias desejadas pesam mais que favoritos, e favoritos mais que visualizações
+        self.assertEqual(self.recomendadas(), ['Praia', 'Moda', 'Cozinha'])
+
+    def test_itens_novos_sao_mesclados_sem_recalcular(self):
+        self.loja('Praia', self.categoria, nota=3)
+        recomendacao.atualizar()
+
+        self.loja('Praia nova', self.categoria, nota=5)
+        self.loja('Moda nova', self.moda, nota=5)
+        totais = recomendacao.atualizar()
+        self.assertEqual(totais['loja'], {'recalculadas': 0, 'mescladas': 1})
+        self.assertEqual(self.recomendadas(), ['Praia nova', 'Praia'])
+
+    def test_endpoint_le_apenas_a_lista_guardada(self):
+        for i in range(3):
+            self.loja(f'Praia {i}', self.categoria)
+        recomendacao.atualizar()
+        _, poucas = self.consultas('/api/lojas-recomendadas/')
+        for i in range(20):
+            self.loja(f'Outra {i}', self.moda)
+        _, muitas = self.consultas('/api/lojas-recomendadas/')
+        self.assertEqual(len(muitas), len(poucas))
+        self.assertFalse([sql for sql in muitas if 'app_acaousuario' in sql or 'app_cliente_categorias' in sql])
+
+    def test_top_k_em_lote(self):
+        import numpy as np
+        perfis = np.array([[1, 0], [0, 1], [0, 0]], dtype=np.float32)
+        itens = np.array([[1, 0], [1, 0], [0, 1]], dtype=np.float32)
+        nota = np.array([0.2, 1.0, 0.5], dtype=np.float32)
+        indices, valores = recomendacao.top_k(recomendacao.pontuar(perfis, itens, nota, 0.5), 2)
+        self.assertEqual(indices[0].tolist(), [1, 0])
+        self.assertEqual(indices[1, 0], 2)
+        self.assertFalse(np.isfinite(valores[1, 1]))
+        self.assertFalse(np.isfinite(valores[2]).any())
+
+
+class SimilaresTests(CatalogoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        configuracao = override_settings(SIMILARES={'DIRETORIO': diretorio.name, 'VIZINHOS': 2})
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+        self.lojas = {nome: Loja.objects.create(nome=nome, lojista=self.lojista) for nome in 'ABCD'}
+        self.outros = []
+        for i in range(3):
+            user = User.objects.create_user(username=f'outro{i}@feira.com', password='x')
+            self.outros.append(Cliente.objects.create(user=user, nome=f'Outro {i}', cpf='1', telefone='1', genero='F', tipo='Local'))
+
+    def favoritar(self, cliente, *nomes):
+        cliente.lojas_favoritas.add(*(self.lojas[nome] for nome in nomes))
+
+    def parecidas(self, nome, **params):
+        resposta = self.client.get(f'/api/lojas/{self.lojas[nome].pk}/similares/', params)
+        self.assertEqual(resposta.status_code, 200)
+        return [loja['nome'] for loja in resposta.json()]
+
+    def test_vizinhos_por_coocorrencia(self):
+        self.favoritar(self.outros[0], 'A', 'B')
+        self.favoritar(self.outros[1], 'A', 'B', 'C')
+        self.favoritar(self.outros[2], 'C', 'D')
+        self.assertEqual(self.parecidas('A'), [])  # sem índice
+
+        similares.construir('loja')
+        self.assertEqual(self.parecidas('A'), ['B', 'C'])
+        self.assertEqual(self.parecidas('D'), ['C'])
+        self.assertEqual(self.parecidas('A', limite=1), ['B'])
+
+        # o pacote offline leva a mesma tabela
+        secao = {chave: dados for nome, chave, dados in pacotes.itens() if nome == 'similares_loja'}
+        self.assertEqual(secao[self.lojas['D'].pk], [self.lojas['C'].pk])
+        self.assertEqual(len(secao), 4)
+
+    def test_visualizacoes_pesam_menos_que_favoritos(self):
+        self.favoritar(self.outros[0], 'A', 'B')
+        AcaoUsuario.objects.create(usuario=self.outros[1].user, acao='visualizou loja', loja=self.lojas['A'])
+        AcaoUsuario.objects.create(usuario=self.outros[1].user, acao='visualizou loja', loja=self.lojas['C'])
+        similares.construir('loja')
+        self.assertEqual(self.parecidas('A'), ['B', 'C'])
+
+    def test_consulta_nao_percorre_interacoes(self):
+        self.favoritar(self.outros[0], 'A', 'B')
+        similares.construir('loja')
+        _, consultas = self.consultas(f"/api/lojas/{self.lojas['A'].pk}/similares/")
+        # só os favoritos do próprio usuário, para o campo favoritado
+        interacoes = [sql for sql in consultas if 'favorita' in sql or 'acaousuario' in sql]
+        self.assertFalse([sql for sql in interacoes if f'"cliente_id" = {self.cliente.pk}' not in sql])
+
+    def test_tabela_acompanha_os_itens_e_nao_o_maior_id(self):
+        grande = 2 ** 40
+        origem = np.array([grande + 7, grande + 7, 3, grande])
+        destino = np.array([3, grande, grande + 7, 3])
+        tabela = similares.tabela_vizinhos(origem, destino, np.array([0.9, 0.5, 0.8, 0.1]), 2)
+        self.assertEqual(tabela['id'].tolist(), [3, grande, grande + 7])
+        self.assertEqual(tabela[similares.linha(tabela, grande + 7)]['ids'].tolist(), [3, grande])
+        self.assertIsNone(similares.linha(tabela, 4))
+        self.assertIsNone(similares.linha(tabela, grande + 8))
+
+    def test_indice_novo_substitui_o_aberto(self):
+        self.favoritar(self.outros[0], 'A', 'B')
+        similares.construir('loja')
+        self.assertEqual(self.parecidas('A'), ['B'])
+        self.favoritar(self.outros[1], 'A', 'C')
+        self.favoritar(self.outros[2], 'A', 'C')
+        similares.construir('loja')
+        self.assertEqual(self.parecidas('A'), ['C', 'B'])
+
+
+class ProdutoLoteTests(CatalogoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loja = Loja.objects.create(nome='Rota do Mar', lojista=self.lojista)
+        self.moda = Categoria.objects.create(nome='Moda')
+
+    def linha(self, i, **campos):
+        return {
+            'nome': f'Sunga {i}', 'descricao': 'moda praia', 'loja': self.loja.pk,
+            'categorias': [self.categoria.pk], 'cor': 'azul', 'composicao': 'lycra', **campos,
+        }
+
+    def enviar(self, linhas):
+        return self.client.post('/api/produtos/lote/', linhas, format='json')
+
+    def test_cria_e_atualiza_em_lote(self):
+        existente = Produto.objects.create(nome='Chapéu', descricao='d', loja=self.loja, cor='bege', composicao='palha')
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.enviar([
+                self.linha(0),
+                self.linha(1, categorias=[self.categoria.pk, self.moda.pk]),
+                {'id': existente.pk, 'cor': 'preto', 'categorias': [self.moda.pk]},
+            ])
+        self.assertEqual(resposta.status_code, 201)
+        self.assertEqual(len(resposta.data['criados']), 2)
+        self.assertEqual(resposta.data['atualizados'], [existente.pk])
+
+        existente.refresh_from_db()
+        self.assertEqual((existente.nome, existente.cor), ('Chapéu', 'preto'))
+        self.assertEqual(list(existente.categorias.values_list('pk', flat=True)), [self.moda.pk])
+        novo = Produto.objects.get(pk=resposta.data['criados'][1])
+        self.assertEqual(novo.categorias.count(), 2)
+        self.assertEqual(busca.motor.buscar('produto', 'sunga'), sorted(resposta.data['criados']))
+
+    def test_erros_por_linha_e_nada_e_gravado(self):
+        resposta = self.enviar([
+            self.linha(0),
+            self.linha(1, categorias=[self.categoria.pk, 999]),
+            {'nome': 'Sem loja'},
+            {'id': 999, 'cor': 'preto'},
+        ])
+        self.assertEqual(resposta.status_code, 400)
+        erros = {erro['linha']: erro for erro in resposta.json()['erros']}
+        self.assertEqual(sorted(erros), [2, 3, 4])
+        self.assertIn('categorias', erros[2])
+        self.assertIn('loja', erros[3])
+        self.assertIn('id', erros[4])
+        self.assertFalse(Produto.objects.exists())
+
+    def test_produto_repetido_no_lote(self):
+        existente = Produto.objects.create(nome='Chapéu', descricao='d', loja=self.loja, cor='bege', composicao='palha')
+        linha = {'id': existente.pk, 'categorias': [self.moda.pk]}
+        resposta = self.enviar([linha, self.linha(0), linha])
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(resposta.json()['erros'], [{'linha': 3, 'id': ['Produto repetido no lote.']}])
+        self.assertFalse(existente.categorias.exists())
+
+    def test_ndjson(self):
+        corpo = '\n'.join(json.dumps(self.linha(i)) for i in range(3)) + '\n'
+        resposta = self.client.post('/api/produtos/lote/', corpo, content_type='application/x-ndjson')
+        self.assertEqual(resposta.status_code, 201)
+        self.assertEqual(Produto.objects.filter(loja=self.loja).count(), 3)
+
+        resposta = self.client.post('/api/produtos/lote/', '{"nome": ', content_type='application/x-ndjson')
+        self.assertEqual(resposta.status_code, 400)
+
+    def test_consultas_nao_crescem_com_o_lote(self):
+        def contar(n):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.enviar([self.linha(i) for i in range(n)]).status_code, 201)
+            return len(ctx.captured_queries)
+        # no SQLite cada INSERT leva até 999 parâmetros: 80 produtos ainda cabem em um
+        self.assertEqual(contar(5), contar(80))
+
+
+class ExportacaoTests(CatalogoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser(username='admin@feira.com', password='x')
+        self.client.force_authenticate(self.admin)
+        inicio = datetime(2025, 6, 10, 12, tzinfo=dt_timezone.utc)
+        for i in range(5):
+            AcaoUsuario.objects.create(usuario=self.user, acao='visualizou loja', timestamp=inicio + timedelta(hours=i))
+
+    def baixar(self, url):
+        resposta = self.client.get(url)
+        self.assertEqual(resposta.status_code, 200)
+        return b''.join(resposta.streaming_content).decode()
+
+    def test_csv_com_intervalo(self):
+        corpo = self.baixar('/api/exportar/acoes/?formato=csv&inicio=2025-06-10T13:00&fim=2025-06-10T15:00')
+        linhas = corpo.splitlines()
+        self.assertEqual(linhas[0], 'id,usuario_id,acao,timestamp,loja_id,produto_id,detalhes')
+        self.assertEqual([linha.split(',')[3][11:13] for linha in linhas[1:]], ['13', '14', '15'])
+
+    def test_retoma_pelo_cursor(self):
+        exportacao = Exportacao('acoes', lote=2)
+        pedacos = iter(exportacao)
+        self.assertEqual(len(next(pedacos).splitlines()), 2)
+        # o cursor só avança quando o pedaço seguinte é pedido (o anterior foi entregue)
+        self.assertIsNone(exportacao.cursor)
+        next(pedacos)
+
+        restante = self.baixar(f'/api/exportar/acoes/?cursor={exportacao.cursor}')
+        ids = [json.loads(linha)['id'] for linha in restante.splitlines()]
+        self.assertEqual(ids, list(AcaoUsuario.objects.order_by('timestamp').values_list('pk', flat=True))[2:])
+
+    def test_retoma_pela_ultima_linha_recebida(self):
+        for formato in ('ndjson', 'csv'):
+            completo = self.baixar(f'/api/exportar/acoes/?formato={formato}').splitlines()
+            recebidas = completo[:3]
+            if formato == 'csv':
+                campos = next(csv.reader(recebidas[-1:]))
+                data, pk = campos[3], campos[0]
+            else:
+                ultima = json.loads(recebidas[-1])
+                data, pk = ultima['timestamp'], ultima['id']
+            restante = self.baixar(f'/api/exportar/acoes/?formato={formato}&depois={quote(data)},{pk}')
+            self.assertEqual(recebidas + restante.splitlines(), completo, formato)
+
+    def test_parametros_invalidos_e_permissao(self):
+        for url in ('/api/exportar/nada/', '/api/exportar/acoes/?formato=xml',
+                    '/api/exportar/acoes/?cursor=x', '/api/exportar/acoes/?inicio=ontem',
+                    '/api/exportar/acoes/?depois=2025-06-10', '/api/exportar/acoes/?depois=ontem,1'):
+            self.assertEqual(self.client.get(url).status_code, 400, url)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/exportar/acoes/').status_code, 403)
+
+    def test_comando(self):
+        saida = tempfile.NamedTemporaryFile(suffix='.ndjson')
+        self.addCleanup(saida.close)
+        erros = StringIO()
+        call_command('exportar_eventos', 'acoes', '--saida', saida.name, stderr=erros)
+        self.assertEqual(len(open(saida.name).read().splitlines()), 5)
+        self.assertIn('Cursor para continuar', erros.getvalue())
+
+
+class RetencaoTests(CatalogoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        configuracao = override_settings(RETENCAO_ACOES={'DIRETORIO': diretorio.name, 'LOTE': 2})
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+    def acao(self, meses_atras, hora=0):
+        # no início do mês, para que as ações fiquem no mês esperado em qualquer data
+        inicio = retencao.inicio_do_mes(timezone.now(), meses_atras)
+        momento = inicio + timedelta(hours=hora)
+        return AcaoUsuario.objects.create(
+            usuario=self.user, acao='visualizou loja', timestamp=momento, gravado_em=momento
+        )
+
+    def exportadas(self, **filtros):
+        return [json.loads(linha)['id'] for linha in b''.join(Exportacao('acoes', lote=2, **filtros)).splitlines()]
+
+    def test_arquiva_meses_antigos_e_exportacao_le_os_arquivos(self):
+        antigas = [self.acao(6), self.acao(6, hora=1), self.acao(3)]
+        recente = self.acao(0)
+        metricas.agregar_tudo()
+
+        arquivadas = retencao.arquivar(meses=2)
+        self.assertEqual(sum(arquivadas.values()), 3)
+        self.assertEqual(list(AcaoUsuario.objects.values_list('pk', flat=True)), [recente.pk])
+        self.assertEqual(ArquivoAcoes.objects.count(), 2)
+
+        ordem = [acao.pk for acao in antigas] + [recente.pk]
+        self.assertEqual(self.exportadas(), ordem)
+        self.assertEqual(self.exportadas(inicio=retencao.inicio_do_mes(timezone.now(), 4)), ordem[2:])
+        self.assertEqual(retencao.arquivar(meses=2), {})
+
+    def test_so_arquiva_acoes_ja_agregadas(self):
+        self.acao(6)
+        metricas.agregar_tudo()
+        tardia = self.acao(6, hora=1)
+        retencao.arquivar(meses=2)
+        self.assertEqual(list(AcaoUsuario.objects.values_list('pk', flat=True)), [tardia.pk])
+
+        # a tardia entra numa nova parte do mesmo mês e a exportação intercala as duas
+        metricas.agregar_tudo()
+        retencao.arquivar(meses=2)
+        self.assertFalse(AcaoUsuario.objects.exists())
+        self.assertEqual(list(ArquivoAcoes.objects.values_list('parte', flat=True)), [1, 2])
+        self.assertEqual(len(self.exportadas()), 2)
+
+    def test_exportacao_nao_repete_arquivadas_ainda_no_banco(self):
+        for hora in range(3):
+            self.acao(6, hora)
+        metricas.agregar_tudo()
+        # interrompida depois de registrar a parte e antes do DELETE
+        with mock.patch.object(retencao, 'apagar', side_effect=[0, KeyboardInterrupt]):
+            with self.assertRaises(KeyboardInterrupt):
+                retencao.arquivar(meses=2)
+        self.assertEqual(AcaoUsuario.objects.count(), 3)
+        ids = list(AcaoUsuario.objects.order_by('pk').values_list('pk', flat=True))
+        self.assertEqual(self.exportadas(), ids)
+
+        retencao.arquivar(meses=2)
+        self.assertFalse(AcaoUsuario.objects.exists())
+        self.assertEqual(self.exportadas(), ids)
+
+    def test_retoma_exportacao_entre_arquivo_e_banco(self):
+        for meses, hora in ((6, 0), (6, 1), (6, 2), (0, 0), (0, 0)):
+            self.acao(meses, hora)
+        metricas.agregar_tudo()
+        retencao.arquivar(meses=2)
+        todas = self.exportadas()
+
+        exportacao = Exportacao('acoes', lote=2)
+        pedacos = iter(exportacao)
+        next(pedacos)
+        next(pedacos)
+        restante = b''.join(Exportacao('acoes', cursor=exportacao.cursor)).splitlines()
+        self.assertEqual([json.loads(linha)['id'] for linha in restante], todas[2:])
+
+
+class ImagensTests(CatalogoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        configuracao = override_settings(MEDIA_ROOT=diretorio.name, IMAGENS={'SINCRONO': True, 'FORMATOS': ('webp',)})
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        self.criar_lojas(1, favoritar=False)
+        self.produto = Produto.objects.get()
+
+    def imagem(self, largura, altura, cor='red'):
+        saida = io.BytesIO()
+        Image.new('RGB', (largura, altura), cor).save(saida, 'PNG')
+        return SimpleUploadedFile('foto.png', saida.getvalue(), content_type='image/png')
+
+    def enviar(self, produto, imagem):
+        with self.captureOnCommitCallbacks(execute=True):
+            produto.imagem = imagem
+            produto.save()
+        produto.refresh_from_db()
+        return produto.variantes.get('imagem')
+
+    def lado(self, nome):
+        with default_storage.open(nome) as arquivo:
+            return max(Image.open(arquivo).size)
+
+    def test_gera_tamanhos_sem_ampliar(self):
+        variantes = self.enviar(self.produto, self.imagem(1000, 600))
+        self.assertEqual((variantes['largura'], variantes['altura']), (1000, 600))
+        lados = {tamanho: self.lado(arquivos['webp']) for tamanho, arquivos in variantes['tamanhos'].items()}
+        self.assertEqual(lados, {'grande': 1000, 'media': 960, 'pequena': 480, 'mini': 160})
+
+        variantes = self.enviar(self.produto, self.imagem(100, 50))
+        self.assertEqual(list(variantes['tamanhos']), ['mini'])
+        self.assertEqual(self.lado(variantes['tamanhos']['mini']['webp']), 100)
+
+    def test_mesmo_conteudo_reaproveita_variantes(self):
+        primeira = self.enviar(self.produto, self.imagem(500, 500))
+        outro = Produto.objects.create(nome='Outro', descricao='d', loja=self.produto.loja, cor='azul', composicao='x')
+        with mock.patch.object(imagens, 'preparar', wraps=imagens.preparar) as preparar:
+            segunda = self.enviar(outro, self.imagem(500, 500))
+        preparar.assert_not_called()
+        self.assertNotEqual(primeira['original'], segunda['original'])
+        self.assertEqual(primeira['tamanhos'], segunda['tamanhos'])
+
+    def test_salvar_sem_trocar_a_imagem_nao_reprocessa(self):
+        self.enviar(self.produto, self.imagem(200, 200))
+        with mock.patch.object(imagens, 'processar') as processar:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.produto.nome = 'Renomeado'
+                self.produto.save()
+        processar.assert_not_called()
+
+    def test_resposta_lista_urls_das_variantes(self):
+        resposta = self.client.get(f'/api/produtos/{self.produto.pk}/')
+        self.assertIsNone(resposta.json()['imagem_variantes'])
+
+        self.enviar(self.produto, self.imagem(300, 200))
+        variantes = self.client.get(f'/api/produtos/{self.produto.pk}/').json()['imagem_variantes']
+        self.assertEqual(list(variantes), ['pequena', 'mini'])
+        self.assertTrue(variantes['mini']['webp'].startswith('http://testserver/media/variantes/'))
+
+    def test_comando_processa_imagens_existentes(self):
+        Produto.objects.filter(pk=self.produto.pk).update(imagem=default_storage.save('produtos/antiga.png', self.imagem(300, 300)))
+        call_command('processar_imagens', model='produtos', stdout=StringIO())
+        self.produto.refresh_from_db()
+        self.assertEqual(self.produto.variantes['imagem']['original'], 'produtos/antiga.png')
+
+
+class MosaicoTests(CatalogoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        configuracao = override_settings(MEDIA_ROOT=diretorio.name, IMAGENS={'SINCRONO': True, 'FORMATOS': ()})
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+        saida = io.BytesIO()
+        Image.new('RGB', (600, 300), 'blue').save(saida, 'PNG')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mapa = Mapas.objects.create(mapa=SimpleUploadedFile('mapa.png', saida.getvalue()))
+        self.info = self.client.get(f'/api/mapa/{self.mapa.pk}/').json()['mosaico']
+
+    def tile(self, z, x, y, **extra):
+        url = self.info['tiles'].format(z=z, x=x, y=y).removeprefix('http://testserver')
+        return APIClient().get(url, **extra)
+
+    def test_piramide_de_zooms(self):
+        # 600x300 em tiles de 256: 3x2 no zoom 2, 2x1 no 1 e 1x1 no 0
+        self.assertEqual(
+            {chave: self.info[chave] for chave in ('largura', 'altura', 'tamanho', 'zoom_maximo')},
+            {'largura': 600, 'altura': 300, 'tamanho': 256, 'zoom_maximo': 2},
+        )
+        for z, colunas, linhas in ((2, 3, 2), (1, 2, 1), (0, 1, 1)):
+            self.assertEqual(self.tile(z, colunas - 1, linhas - 1).status_code, 200)
+            self.assertEqual(self.tile(z, colunas, 0).status_code, 404)
+            self.assertEqual(self.tile(z, 0, linhas).status_code, 404)
+        self.assertEqual(self.tile(3, 0, 0).status_code, 404)
+
+        resposta = self.tile(2, 2, 1)
+        imagem = Image.open(io.BytesIO(b''.join(resposta.streaming_content)))
+        self.assertEqual(imagem.size, (256, 256))
+        # borda além da imagem fica transparente
+        self.assertEqual(imagem.convert('RGBA').getpixel((255, 255))[3], 0)
+
+    def test_cache_imutavel_e_revalidacao(self):
+        resposta = self.tile(0, 0, 0, HTTP_ACCEPT='image/webp')
+        self.assertEqual(resposta['Content-Type'], 'image/webp')
+        self.assertIn('immutable', resposta['Cache-Control'])
+        self.assertIn('public', resposta['Cache-Control'])
+        self.assertEqual(self.tile(0, 0, 0, HTTP_IF_NONE_MATCH=resposta['ETag']).status_code, 304)
+
+    def test_nova_imagem_muda_a_versao(self):
+        antigo = self.info['tiles']
+        saida = io.BytesIO()
+        Image.new('RGB', (100, 100), 'red').save(saida, 'PNG')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mapa.mapa = SimpleUploadedFile('novo.png', saida.getvalue())
+            self.mapa.save()
+        self.info = self.client.get(f'/api/mapa/{self.mapa.pk}/').json()['mosaico']
+        self.assertNotEqual(self.info['tiles'], antigo)
+        self.assertEqual(self.info['zoom_maximo'], 0)
+        self.assertEqual(self.tile(0, 0, 0).status_code, 200)
+        self.assertEqual(APIClient().get(antigo.format(z=0, x=0, y=0)).status_code, 404)
+
+
+class EspacialTests(CatalogoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.mapa = Mapas.objects.create()
+        self.criar_lojas(4, favoritar=False)
+        self.lojas = list(Loja.objects.order_by('pk'))
+        self.setor = Setor.objects.create(nome='Artesanato')
+        outra = Categoria.objects.create(nome='Couro')
+        Loja.objects.filter(pk=self.lojas[3].pk).update(setor=self.setor)
+        self.lojas[2].categorias.set([outra])
+        for loja, (x, y) in zip(self.lojas, [(10, 10), (20, 10), (100, 100), (12, 40)]):
+            PosicaoLoja.objects.create(loja=loja, mapa=self.mapa, x=x, y=y)
+
+    def get(self, acao, **params):
+        return self.client.get(f'/api/mapa/{self.mapa.pk}/{acao}/', params)
+
+    def test_grade_igual_a_forca_bruta(self):
+        aleatorio = random.Random(7)
+        pontos = [
+            espacial.Ponto(i, '', aleatorio.uniform(0, 5000), aleatorio.uniform(0, 3000), i % 5, frozenset({i % 7}))
+            for i in range(2000)
+        ]
+        # lojas alinhadas, como uma rua de barracas
+        pontos += [espacial.Ponto(2000 + i, '', 100.0 * i, 50.0, 0, frozenset()) for i in range(50)]
+        grade = espacial.Grade(pontos)
+        for _ in range(200):
+            x, y = aleatorio.uniform(-1000, 6000), aleatorio.uniform(-1000, 4000)
+            aceita = espacial.filtro(setor=aleatorio.choice([None, 1]), categoria=aleatorio.choice([None, 3]))
+            candidatos = [p for p in pontos if not aceita or aceita(p)]
+            esperado = sorted(candidatos, key=lambda p: (math.dist((p.x, p.y), (x, y)), p.loja))[:10]
+            self.assertEqual([p for p, _ in grade.proximas(x, y, 10, aceita)], esperado)
+
+            x1, y1 = x + aleatorio.uniform(0, 2000), y + aleatorio.uniform(0, 2000)
+            dentro = {p for p in candidatos if x <= p.x <= x1 and y <= p.y <= y1}
+            self.assertEqual(set(grade.regiao(x1, y1, x, y, aceita)), dentro)
+
+    def test_proximas(self):
+        resposta = self.get('proximas', x=11, y=11, limite=3)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual([item['loja'] for item in resposta.json()], [self.lojas[i].pk for i in (0, 1, 3)])
+        self.assertEqual(resposta.json()[0]['distancia'], 1.41)
+
+        self.assertEqual([item['loja'] for item in self.get('proximas', x=11, y=11, setor=self.setor.pk).json()], [self.lojas[3].pk])
+        categoria = self.get('proximas', x=11, y=11, categoria=self.categoria.pk).json()
+        self.assertNotIn(self.lojas[2].pk, [item['loja'] for item in categoria])
+
+        self.assertEqual(self.get('proximas', x='abc', y=1).status_code, 400)
+        self.assertEqual(self.get('proximas', x=1).status_code, 400)
+        self.assertEqual(self.get('proximas', x=1, y=1, setor='x').status_code, 400)
+        self.assertEqual(self.client.get('/api/mapa/999/proximas/', {'x': 1, 'y': 1}).status_code, 404)
+
+    def test_regiao(self):
+        resposta = self.get('regiao', x0=0, y0=0, x1=50, y1=50).json()
+        self.assertEqual([item['loja'] for item in resposta['results']], [self.lojas[i].pk for i in (0, 1, 3)])
+        self.assertFalse(resposta['mais'])
+
+        resposta = self.get('regiao', x0=0, y0=0, x1=50, y1=50, limite=2).json()
+        self.assertEqual(len(resposta['results']), 2)
+        self.assertTrue(resposta['mais'])
+
+    def test_grade_acompanha_as_alteracoes(self):
+        self.assertEqual(len(self.get('regiao', x0=0, y0=0, x1=50, y1=50).json()['results']), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            PosicaoLoja.objects.filter(loja=self.lojas[0]).get().delete()
+            posicao = PosicaoLoja.objects.get(loja=self.lojas[2])
+            posicao.x = posicao.y = 30
+            posicao.save()
+        regiao = self.get('regiao', x0=0, y0=0, x1=50, y1=50).json()['results']
+        self.assertEqual([item['loja'] for item in regiao], [self.lojas[1].pk, self.lojas[2].pk, self.lojas[3].pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lojas[1].nome = 'Renomeada'
+            self.lojas[1].save()
+            self.lojas[3].ativo = False
+            self.lojas[3].save()
+        regiao = self.get('regiao', x0=0, y0=0, x1=50, y1=50).json()['results']
+        self.assertEqual([item['nome'] for item in regiao], ['Renomeada', self.lojas[2].nome])
+
+    def test_posicao_dentro_do_mapa(self):
+        Mapas.objects.filter(pk=self.mapa.pk).update(mosaico={'largura': 200, 'altura': 100})
+        loja = Loja.objects.create(nome='Nova', lojista=self.lojista)
+        dados = {'loja': loja.pk, 'mapa': self.mapa.pk, 'x': 150, 'y': 150}
+        self.assertEqual(self.client.post('/api/posicoes/', dados).status_code, 400)
+        dados['y'] = 90
+        self.assertEqual(self.client.post('/api/posicoes/', dados).status_code, 201)
+        # uma posição por loja em cada mapa
+        self.assertEqual(self.client.post('/api/posicoes/', dados).status_code, 400)
+        self.assertEqual(len(self.client.get('/api/posicoes/', {'mapa': self.mapa.pk}).json()['results']), 5)
+
+
+class RotasTests(CatalogoTestCase):
+    # Grade 5x5 de nós a cada 10px com uma parede entre as linhas 1 e 2,
+    # aberta só na última coluna
+
+    def setUp(self):
+        super().setUp()
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        configuracao = override_settings(ROTAS={'DIRETORIO': diretorio.name})
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+        self.mapa = Mapas.objects.create()
+        self.criar_lojas(3, favoritar=False)
+        self.lojas = list(Loja.objects.order_by('pk'))
+        for loja, (x, y) in zip(self.lojas, [(0, 42), (40, 0), (2, 0)]):
+            PosicaoLoja.objects.create(loja=loja, mapa=self.mapa, x=x, y=y)
+
+        nos = [[c * 10, l * 10] for l in range(5) for c in range(5)]
+        corredores = [[l * 5 + c, l * 5 + c + 1] for l in range(5) for c in range(4)]
+        corredores += [[l * 5 + c, (l + 1) * 5 + c] for l in range(4) for c in range(5) if l != 1 or c == 4]
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.put(
+                f'/api/mapa/{self.mapa.pk}/caminhos/', {'nos': nos, 'corredores': corredores}, format='json'
+            )
+        self.assertEqual(resposta.status_code, 200)
+
+    def rota(self, **params):
+        return self.client.get(f'/api/mapa/{self.mapa.pk}/rota/', {'x': 1, 'y': 1, **params})
+
+    def test_contorna_a_parede(self):
+        rota = self.rota(lojas=self.lojas[0].pk).json()
+        # 1.41 até o nó (0, 0), 120 pelos corredores e 2 até a loja
+        self.assertEqual(rota['distancia'], 123.41)
+        self.assertEqual(rota['trajeto'][0], [1, 1])
+        self.assertEqual(rota['trajeto'][-1], [0, 42])
+        self.assertIn([40, 20], rota['trajeto'])
+        self.assertEqual(rota['inalcancaveis'], [])
+
+    def test_varias_paradas_na_melhor_ordem(self):
+        pks = [loja.pk for loja in self.lojas]
+        rota = self.rota(lojas=','.join(map(str, pks))).json()
+        self.assertEqual([parada['loja'] for parada in rota['paradas']], [pks[2], pks[1], pks[0]])
+        self.assertEqual(rota['distancia'], rota['paradas'][-1]['distancia'])
+
+        LojaFavorita.objects.create(cliente=self.cliente, loja=self.lojas[1])
+        rota = self.rota(favoritas=1).json()
+        self.assertEqual([parada['loja'] for parada in rota['paradas']], [pks[1]])
+
+    def test_ordenar_paradas(self):
+        # numa reta, com a partida no 0, vale ir primeiro para o lado mais curto
+        posicoes = [5, -3, 8, 1, -6]
+        partida = [abs(p) for p in posicoes]
+        matriz = [[abs(a - b) for b in posicoes] for a in posicoes]
+        self.assertEqual([posicoes[i] for i in rotas.ordenar_paradas(partida, matriz)], [-3, -6, 1, 5, 8])
+        self.assertEqual(rotas.ordenar_paradas([], []), [])
+
+    def test_lojas_sem_posicao_ou_inativas(self):
+        sem_posicao = Loja.objects.create(nome='Sem posição', lojista=self.lojista)
+        Loja.objects.filter(pk=self.lojas[1].pk).update(ativo=False)
+        rota = self.rota(lojas=f'{self.lojas[2].pk},{sem_posicao.pk},{self.lojas[1].pk}').json()
+        self.assertEqual([parada['loja'] for parada in rota['paradas']], [self.lojas[2].pk])
+        self.assertEqual(sorted(rota['inalcancaveis']), sorted([sem_posicao.pk, self.lojas[1].pk]))
+
+    def test_recompila_quando_a_posicao_muda(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            PosicaoLoja.objects.filter(loja=self.lojas[0]).update(x=0, y=2)
+            PosicaoLoja.objects.get(loja=self.lojas[0]).save()
+        self.assertEqual(self.rota(lojas=self.lojas[0].pk).json()['distancia'], 3.41)
+
+    def test_parametros_invalidos(self):
+        self.assertEqual(self.rota().status_code, 400)
+        self.assertEqual(self.rota(lojas='1,a').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/mapa/{self.mapa.pk}/rota/', {'lojas': 1}).status_code, 400)
+        resposta = self.client.put(f'/api/mapa/{self.mapa.pk}/caminhos/', {'nos': [[0, 0]], 'corredores': [[0, 1]]}, format='json')
+        self.assertIn('corredores', resposta.json())
+        outro = Mapas.objects.create()
+        self.assertEqual(self.client.get(f'/api/mapa/{outro.pk}/rota/', {'x': 1, 'y': 1, 'lojas': 1}).status_code, 404)
+
+
+class PerfilClienteTests(CatalogoTestCase):
+    EXPANDIR = '?expand=produtos_favoritos,lojas_favoritas'
+
+    def urls(self, sufixo=''):
+        return [f'/api/clientes/{sufixo}', f'/api/clientes/{self.cliente.pk}/{sufixo}', f'/api/meu-perfil/{sufixo}']
+
+    def perfil(self, url):
+        dados = self.client.get(url).json()
+        if 'results' in dados:
+            return dados['results'][0]
+        return dados.get('cliente', dados)
+
+    def test_favoritos_vem_como_ids_por_padrao(self):
+        self.criar_lojas(2)
+        lojas = sorted(Loja.objects.values_list('pk', flat=True))
+        produtos = sorted(Produto.objects.values_list('pk', flat=True))
+        for url in self.urls():
+            with self.subTest(url=url):
+                perfil = self.perfil(url)
+                self.assertNotIn('cliente_erro', self.client.get(url).json())
+                self.assertEqual(sorted(perfil['lojas_favoritas']), lojas)
+                self.assertEqual(sorted(perfil['produtos_favoritos']), produtos)
+
+    def test_expand_embute_os_objetos(self):
+        self.criar_lojas(2)
+        for url in self.urls(self.EXPANDIR):
+            with self.subTest(url=url):
+                perfil = self.perfil(url)
+                self.assertEqual({l['nome'] for l in perfil['lojas_favoritas']}, {'Loja 0', 'Loja 1'})
+                self.assertEqual({p['nome'] for p in perfil['produtos_favoritos']}, {'Produto 0', 'Produto 1'})
+
+        perfil = self.perfil(f'/api/clientes/{self.cliente.pk}/?expand=lojas_favoritas')
+        self.assertEqual(sorted(perfil['produtos_favoritos']), sorted(Produto.objects.values_list('pk', flat=True)))
+
+    def test_custo_nao_cresce_com_os_favoritos(self):
+        self.criar_lojas(2)
+        urls = self.urls() + self.urls(self.EXPANDIR)
+        for url in urls:
+            self.consultas(url)  # o usuário autenticado guarda user.cliente/user.lojista
+        poucas = {url: len(self.consultas(url)[1]) for url in urls}
+        self.criar_lojas(10)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(len(self.consultas(url)[1]), poucas[url])
+
+    def test_sem_expand_nao_consulta_lojas_nem_produtos(self):
+        self.criar_lojas(3)
+        _, sqls = self.consultas(f'/api/clientes/{self.cliente.pk}/')
+        self.assertFalse(any('"app_avaliacao"' in sql for sql in sqls))
+
+
+class LeituraRapidaTests(CatalogoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.criar_lojas(3)
+        self.criar_lojas(2, favoritar=False)
+        setor = Setor.objects.create(nome='Artesanato')
+        loja = Loja.objects.order_by('pk').first()
+        # update() não dispara o processamento das imagens
+        Loja.objects.filter(pk=loja.pk).update(
+            setor=setor, nome='Açaí da Zoé\u2028', logo='lojas/logos/logo.png', Instagram='@zoe',
+            variantes={'logo': {'original': 'lojas/logos/logo.png', 'tamanhos': {'mini': {'webp': 'variantes/ab/abc/mini.webp'}}}},
+        )
+        Produto.objects.filter(loja=loja).update(
+            imagem='produtos/foto.jpg',
+            variantes={'imagem': {'original': 'produtos/antiga.jpg', 'tamanhos': {'mini': {'webp': 'variantes/cd/cde/mini.webp'}}}},
+        )
+        Categoria.objects.create(nome='Inverno', ativo=False)
+
+    def esperado(self, resposta, serializer, objetos, many=True):
+        # Bytes que os serializers do DRF produziriam para a mesma requisição
+        contexto = {'request': resposta.renderer_context['request']}
+        return serializer(objetos, many=many, context=contexto).data
+
+    def assertMesmosBytes(self, resposta, dados):
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.content, JSONRenderer().render(dados))
+
+    def test_listagens_iguais_aos_serializers(self):
+        casos = [
+            ('/api/produtos/', ProdutoSerializer, Produto),
+            ('/api/lojas/', LojaSerializer, Loja),
+            ('/api/categorias/', CategoriaSerializer, Categoria),
+            ('/api/lojas/?fields=id,nome,favoritado,nota_media', LojaSerializer, Loja),
+            ('/api/produtos/?limite=2&nome=Produto', ProdutoSerializer, Produto),
+        ]
+        for url, serializer, model in casos:
+            with self.subTest(url=url):
+                resposta = self.client.get(url)
+                pagina = [item['id'] for item in resposta.data['results']]
+                objetos = em_ordem(planejar_queryset(model.objects.filter(pk__in=pagina), serializer), pagina)
+                self.assertTrue(pagina)
+                self.assertMesmosBytes(resposta, {
+                    'next': resposta.data['next'], 'results': self.esperado(resposta, serializer, objetos),
+                })
+
+    def test_detalhes_iguais_aos_serializers(self):
+        for model, serializer, rota in [(Produto, ProdutoSerializer, 'produtos'), (Loja, LojaSerializer, 'lojas')]:
+            for objeto in planejar_queryset(model.objects.all(), serializer):
+                with self.subTest(rota=rota, pk=objeto.pk):
+                    resposta = self.client.get(f'/api/{rota}/{objeto.pk}/')
+                    self.assertMesmosBytes(resposta, self.esperado(resposta, serializer, objeto, many=False))
+        self.assertEqual(self.client.get('/api/produtos/999999/').status_code, 404)
+        self.assertEqual(self.client.get('/api/produtos/abc/').status_code, 404)
+
+    def test_pesquisa_igual_aos_serializers(self):
+        resposta = self.client.get('/api/pesquisa/?nome=&limite=3')
+        lojas = [loja['id'] for loja in resposta.data['lojas']]
+        produtos = [produto['id'] for produto in resposta.data['produtos']]
+        self.assertEqual((len(lojas), len(produtos)), (3, 3))
+        self.assertMesmosBytes(resposta, {
+            'lojas': self.esperado(resposta, PesquisaSerializer, em_ordem(
+                lojas_queryset(Loja.objects.filter(pk__in=lojas), PesquisaSerializer), lojas
+            )),
+            'produtos': self.esperado(resposta, ProdutoSerializer, em_ordem(
+                planejar_queryset(Produto.objects.filter(pk__in=produtos), ProdutoSerializer), produtos
+            )),
+            'proximo_cursor': resposta.data['proximo_cursor'],
+        })
+
+    def test_cursor_da_listagem(self):
+        primeira = self.client.get('/api/produtos/?limite=2').json()
+        segunda = self.client.get(primeira['next']).json()
+        vistos = [p['id'] for p in primeira['results'] + segunda['results']]
+        self.assertEqual(vistos, list(Produto.objects.order_by('-criacao', '-pk').values_list('pk', flat=True)[:4]))
+
+    def test_renderer_igual_ao_do_drf(self):
+        dados = {
+            'texto': 'linha\u2028e parágrafo\u2029 "aspas"', 1: [1.5, None, True],
+            'data': timezone.now(), 'dia': timezone.now().date(), 'decimal': Decimal('1.10'),
+        }
+        self.assertEqual(JSONRapidoRenderer().render(dados), JSONRenderer().render(dados))
+        self.assertEqual(
+            JSONRapidoRenderer().render(dados, 'application/json; indent=2'),
+            JSONRenderer().render(dados, 'application/json; indent=2'),
+        )
+
+
+class FavoritosLoteTests(CatalogoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.criar_lojas(4, favoritar=False)
+        self.lojas = list(Loja.objects.order_by('pk').values_list('pk', flat=True))
+        self.produtos = list(Produto.objects.order_by('pk').values_list('pk', flat=True))
+        self.url = f'/api/clientes/{self.cliente.pk}/favoritos/'
+
+    def enviar(self, operacoes):
+        return self.client.post(self.url, operacoes, format='json')
+
+    def test_aplica_a_ultima_operacao_de_cada_item(self):
+        ProdutoFavorito.objects.create(cliente=self.cliente, produto_id=self.produtos[0])
+        resposta = self.enviar([
+            {'acao': 'adicionar', 'produto': self.produtos[1]},
+            {'acao': 'remover', 'produto': self.produtos[0]},
+            {'acao': 'adicionar', 'loja': self.lojas[0]},
+            {'acao': 'remover', 'loja': self.lojas[0]},
+            {'acao': 'remover', 'loja': self.lojas[1]},
+            {'acao': 'adicionar', 'loja': self.lojas[1]},
+        ])
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json(), {
+            'produtos_favoritos': [self.produtos[1]],
+            'lojas_favoritas': [self.lojas[1]],
+            'ignorados': {'produto': [], 'loja': []},
+        })
+
+    def test_repetir_o_lote_nao_muda_nada(self):
+        operacoes = [{'acao': 'adicionar', 'produto': pk} for pk in self.produtos]
+        primeira = self.enviar(operacoes).json()
+        segunda = self.enviar(operacoes + operacoes).json()
+        self.assertEqual(primeira, segunda)
+        self.assertEqual(ProdutoFavorito.objects.filter(cliente=self.cliente).count(), len(self.produtos))
+
+    def test_ids_inexistentes_sao_ignorados(self):
+        resposta = self.enviar([
+            {'acao': 'adicionar', 'loja': 999999},
+            {'acao': 'remover', 'produto': 999999},
+            {'acao': 'adicionar', 'loja': self.lojas[2]},
+        ]).json()
+        self.assertEqual(resposta['ignorados'], {'produto': [], 'loja': [999999]})
+        self.assertEqual(resposta['lojas_favoritas'], [self.lojas[2]])
+
+    def test_operacao_invalida_nao_grava_nada(self):
+        resposta = self.enviar([
+            {'acao': 'adicionar', 'loja': self.lojas[0]},
+            {'acao': 'trocar', 'loja': self.lojas[1]},
+            {'acao': 'adicionar', 'loja': self.lojas[1], 'produto': self.produtos[0]},
+            'loja',
+        ])
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual([erro['linha'] for erro in resposta.json()['erros']], [2, 3, 4])
+        self.assertFalse(LojaFavorita.objects.exists())
+        self.assertEqual(self.enviar({'acao': 'adicionar'}).status_code, 400)
+
+    def test_so_o_proprio_cliente(self):
+        outro = User.objects.create_user(username='outro@feira.com', password='x')
+        self.client.force_authenticate(outro)
+        self.assertEqual(self.enviar([{'acao': 'adicionar', 'loja': self.lojas[0]}]).status_code, 403)
+        self.assertFalse(LojaFavorita.objects.exists())
+
+    def test_consultas_nao_crescem_com_o_lote(self):
+        def consultas(operacoes):
+            LojaFavorita.objects.all().delete()
+            ProdutoFavorito.objects.all().delete()
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.enviar(operacoes).status_code, 200)
+            return len(ctx.captured_queries)
+
+        poucas = consultas([{'acao': 'adicionar', 'loja': self.lojas[0]}, {'acao': 'remover', 'produto': self.produtos[0]}])
+        muitas = consultas(
+            [{'acao': 'adicionar', 'loja': pk} for pk in self.lojas]
+            + [{'acao': 'remover', 'produto': pk} for pk in self.produtos]
+        )
+        self.assertEqual(muitas, poucas)
+
+    @override_settings(CACHE_RESPOSTAS={'ATIVO': True})
+    def test_invalida_o_favoritado_em_cache(self):
+        self.assertFalse(any(p['favoritado'] for p in self.client.get('/api/produtos/').json()['results']))
+        self.enviar([{'acao': 'adicionar', 'produto': self.produtos[0]}])
+        favoritados = [p['id'] for p in self.client.get('/api/produtos/').json()['results'] if p['favoritado']]
+        self.assertEqual(favoritados, [self.produtos[0]])
+
+    def test_delete_de_um_favorito(self):
+        ProdutoFavorito.objects.create(cliente=self.cliente, produto_id=self.produtos[0])
+        base = f'/api/clientes/{self.cliente.pk}/produtos_favoritos'
+        self.assertEqual(self.client.delete(f'{base}/{self.produtos[0]}/').status_code, 204)
+        self.assertEqual(self.client.delete(f'{base}/{self.produtos[0]}/').status_code, 204)
+        self.assertEqual(self.client.delete(f'{base}/999999/').status_code, 404)
+        self.assertFalse(ProdutoFavorito.objects.exists())
+
+
+@override_settings(SINCRONIZACAO={'MARGEM_SEGUNDOS': 0, 'LIMITE': 3})
+class SincronizacaoTests(CatalogoTestCase):
+    url = '/api/sincronizacao/'
+
+    def setUp(self):
+        super().setUp()
+        self.criar_lojas(3)
+
+    def sincronizar(self, token=None, **params):
+        resposta = self.client.get(self.url, {**params, **({'token': token} if token else {})})
+        self.assertEqual(resposta.status_code, 200)
+        return resposta.json()
+
+    def ate_o_fim(self, token=None):
+        # junta as páginas até `mais` ser falso
+        alteracoes, remocoes = {}, {}
+        while True:
+            dados = self.sincronizar(token)
+            for destino, origem in ((alteracoes, dados['alteracoes']), (remocoes, dados['remocoes'])):
+                for nome, itens in origem.items():
+                    destino.setdefault(nome, []).extend(itens)
+            token = dados['token']
+            if not dados['mais']:
+                return alteracoes, remocoes, token
+
+    def ids(self, alteracoes, nome):
+        return sorted(item['id'] for item in alteracoes[nome])
+
+    def test_sem_token_entrega_o_catalogo_em_paginas(self):
+        primeira = self.sincronizar()
+        self.assertTrue(primeira['mais'])
+        self.assertEqual(sum(len(itens) for itens in primeira['alteracoes'].values()), 3)
+
+        alteracoes, remocoes, _ = self.ate_o_fim()
+        self.assertEqual(self.ids(alteracoes, 'lojas'), sorted(Loja.objects.values_list('pk', flat=True)))
+        self.assertEqual(self.ids(alteracoes, 'produtos'), sorted(Produto.objects.values_list('pk', flat=True)))
+        self.assertEqual(self.ids(alteracoes, 'categorias'), [self.categoria.pk])
+        self.assertFalse(any(remocoes.values()))
+        # os campos das listagens, menos o favoritado
+        produto = alteracoes['produtos'][0]
+        self.assertNotIn('favoritado', produto)
+        esperado = dict(self.client.get(f'/api/produtos/{produto["id"]}/').json())
+        del esperado['favoritado']
+        self.assertEqual(produto, esperado)
+
+    def test_depois_do_token_so_o_que_mudou(self):
+        _, _, token = self.ate_o_fim()
+        self.assertFalse(any(self.sincronizar(token)['alteracoes'].values()))
+
+        produto = Produto.objects.order_by('pk').first()
+        produto.nome = 'Renomeado'
+        produto.save()
+        dados = self.sincronizar(token)
+        self.assertEqual([p['nome'] for p in dados['alteracoes']['produtos']], ['Renomeado'])
+        self.assertFalse(dados['alteracoes']['lojas'])
+        self.assertFalse(self.sincronizar(dados['token'])['alteracoes']['produtos'])
+
+    def test_relacao_alterada_entrega_o_objeto(self):
+        _, _, token = self.ate_o_fim()
+        loja = Loja.objects.order_by('pk').first()
+        loja.categorias.add(Categoria.objects.create(nome='Artesanato'))
+        alteracoes, _, _ = self.ate_o_fim(token)
+        self.assertEqual(self.ids(alteracoes, 'lojas'), [loja.pk])
+
+    def test_remocoes_incluem_as_em_cascata(self):
+        _, _, token = self.ate_o_fim()
+        loja = Loja.objects.order_by('pk').first()
+        produtos = list(loja.produtos.values_list('pk', flat=True))
+        removida = loja.pk
+        loja.delete()
+        _, remocoes, token = self.ate_o_fim(token)
+        self.assertEqual(remocoes['lojas'], [removida])
+        self.assertEqual(remocoes['produtos'], produtos)
+        self.assertFalse(any(self.sincronizar(token)['remocoes'].values()))
+
+    def test_sem_token_nao_entrega_remocoes_antigas(self):
+        Produto.objects.order_by('pk').first().delete()
+        _, remocoes, _ = self.ate_o_fim()
+        self.assertFalse(any(remocoes.values()))
+
+    @override_settings(SINCRONIZACAO={'MARGEM_SEGUNDOS': 60})
+    def test_alteracoes_recentes_esperam_a_margem(self):
+        self.assertFalse(any(self.sincronizar()['alteracoes'].values()))
+        depois = timezone.now() + timedelta(minutes=2)
+        with mock.patch('app.sincronizacao.timezone.now', return_value=depois):
+            self.assertTrue(self.sincronizar()['alteracoes']['lojas'])
+
+    def test_token_expirado_recomeca(self):
+        _, _, token = self.ate_o_fim()
+        depois = timezone.now() + timedelta(days=31)
+        with mock.patch('app.sincronizacao.timezone.now', return_value=depois):
+            dados = self.sincronizar(token, limite=100)
+        self.assertTrue(dados['reiniciar'])
+        self.assertEqual(len(dados['alteracoes']['lojas']), 3)
+
+    def test_token_e_limite_invalidos(self):
+        self.assertEqual(self.client.get(self.url, {'token': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'limite': 'x'}).status_code, 400)
+
+    def test_limpar_remocoes(self):
+        Produto.objects.order_by('pk').first().delete()
+        Remocao.objects.update(removido_em=timezone.now() - timedelta(days=31))
+        Loja.objects.order_by('pk').last().delete()
+        call_command('limpar_remocoes', stdout=StringIO())
+        self.assertCountEqual(Remocao.objects.values_list('tipo', flat=True), ['lojas', 'produtos'])
+
+
+class PacotesTests(CatalogoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.diretorio.cleanup)
+        configuracao = override_settings(PACOTES={'DIRETORIO': self.diretorio.name, 'MANTER': 3, 'LOTE': 2})
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        self.criar_lojas(3)
+
+    def abrir(self, conteudo):
+        # conexão com o SQLite de um pacote baixado (gzip)
+        nome = f'{self.diretorio.name}/aberto-{len(conteudo)}.sqlite'
+        with open(nome, 'wb') as arquivo:
+            arquivo.write(gzip.decompress(conteudo))
+        conexao = sqlite3.connect(nome)
+        self.addCleanup(conexao.close)
+        return conexao
+
+    def baixar(self, versao, **params):
+        resposta = self.client.get(f'/api/pacotes/{versao}/', params)
+        self.assertEqual(resposta.status_code, 200)
+        return self.abrir(b''.join(resposta.streaming_content))
+
+    def itens(self, conexao, secao):
+        return {chave: json.loads(dados) for chave, dados in conexao.execute(
+            'SELECT chave, dados FROM itens WHERE secao = ?', (secao, )
+        )}
+
+    def test_pacote_traz_o_catalogo_e_a_busca(self):
+        versao, nova = pacotes.construir()
+        self.assertTrue(nova)
+        self.assertEqual(self.client.get('/api/pacotes/').json()['versoes'][0]['versao'], versao)
+
+        pacote = self.baixar(versao)
+        lojas = self.itens(pacote, 'lojas')
+        self.assertEqual(sorted(map(int, lojas)), sorted(Loja.objects.values_list('pk', flat=True)))
+        loja = Loja.objects.order_by('pk').first()
+        esperado = dict(self.client.get(f'/api/lojas/{loja.pk}/').json())
+        del esperado['favoritado']
+        self.assertEqual(lojas[str(loja.pk)], esperado)
+        self.assertEqual(len(self.itens(pacote, 'produtos')), 3)
+        self.assertEqual(sorted(pk for pk, _ in self.itens(pacote, 'busca_produto')['produt']), sorted(
+            Produto.objects.values_list('pk', flat=True)
+        ))
+        self.assertIn('k1', self.itens(pacote, 'config')['busca'])
+
+    def test_mesmo_conteudo_mesma_versao(self):
+        versao, _ = pacotes.construir()
+        self.assertEqual(pacotes.construir(), (versao, False))
+        self.assertEqual(len(pacotes.versoes()), 1)
+
+    def test_diferenca_so_com_o_que_mudou(self):
+        anterior, _ = pacotes.construir()
+        produto = Produto.objects.order_by('pk').first()
+        produto.descricao = 'Bordado'
+        produto.save()
+        removida = Loja.objects.order_by('pk').last()
+        removidos = {('lojas', str(removida.pk)), *(('produtos', str(pk)) for pk in removida.produtos.values_list('pk', flat=True))}
+        removida.delete()
+        versao, _ = pacotes.construir()
+
+        diferenca = self.baixar(versao, desde=anterior)
+        self.assertEqual(list(self.itens(diferenca, 'produtos')), [str(produto.pk)])
+        self.assertFalse(self.itens(diferenca, 'lojas'))
+        self.assertIn('bordad', self.itens(diferenca, 'busca_produto'))
+        self.assertTrue(removidos <= set(diferenca.execute('SELECT secao, chave FROM remocoes')))
+
+        # aplicar a diferença ao pacote anterior dá o pacote novo
+        antigo, novo = self.baixar(anterior), self.baixar(versao)
+        antigo.executemany('DELETE FROM itens WHERE secao = ? AND chave = ?', diferenca.execute('SELECT * FROM remocoes'))
+        antigo.executemany('INSERT OR REPLACE INTO itens VALUES (?, ?, ?, ?)', diferenca.execute('SELECT * FROM itens'))
+        consulta = 'SELECT * FROM itens ORDER BY secao, chave'
+        self.assertEqual(antigo.execute(consulta).fetchall(), novo.execute(consulta).fetchall())
+
+    def test_versoes_antigas_sao_apagadas(self):
+        versoes = []
+        for i in range(4):
+            Categoria.objects.create(nome=f'Nova {i}')
+            versoes.append(pacotes.construir()[0])
+        self.assertEqual([item['versao'] for item in pacotes.versoes()], versoes[:0:-1])
+        self.assertEqual(self.client.get(f'/api/pacotes/{versoes[0]}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/pacotes/{versoes[3]}/', {'desde': versoes[0]}).status_code, 404)
+
+    def test_download_condicional(self):
+        versao, _ = pacotes.construir()
+        resposta = self.client.get(f'/api/pacotes/{versao}/')
+        self.assertIn('immutable', resposta['Cache-Control'])
+        self.assertEqual(
+            self.client.get(f'/api/pacotes/{versao}/', HTTP_IF_NONE_MATCH=resposta['ETag']).status_code, 304
+        )
+        self.assertEqual(self.client.get('/api/pacotes/abc/').status_code, 404)
+
+
+# ROOT_URLCONF do modo ASGI nos testes: as rotas de app/urls.py com as views async na frente
+urlpatterns = [path('api/', include(urls.rotas_assincronas + urls.urlpatterns))]
+
+
+class AssincronoTests(CatalogoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.criar_lojas(3)
+        recomendacao.atualizar(completo=True)
+        self.assincrono = AsyncClient()
+        self.assincrono.force_login(self.user)
+
+    def obter(self, url, cliente=None, **headers):
+        with override_settings(ROOT_URLCONF=__name__):
+            return async_to_sync((cliente or self.assincrono).get)(url, headers=headers)
+
+    def test_rotas_async_na_frente(self):
+        for url in ('/api/produtos/', '/api/pesquisa/', '/api/meu-perfil/'):
+            self.assertTrue(hasattr(resolve(url, urlconf=__name__).func, 'sincrona'))
+            self.assertFalse(hasattr(resolve(url).func, 'sincrona'))
+
+    def test_mesma_saida_das_views_sincronas(self):
+        Loja.objects.filter(pk=Loja.objects.order_by('pk').first().pk).update(ativo=False)
+        urls = [
+            '/api/produtos/', '/api/lojas/', '/api/categorias/', '/api/lojas/?nome=Loja%201',
+            '/api/produtos/?fields=id,nome,favoritado', '/api/lojas/?limite=2',
+            '/api/pesquisa/?nome=produto', '/api/pesquisa/?nome=&limite=1&cursor=1',
+            '/api/lojas-recomendadas/', '/api/produtos-recomendados/?limite=2',
+            '/api/meu-perfil/?expand=produtos_favoritos',
+        ]
+        proximo = self.client.get('/api/produtos/?limite=2').json()['next']
+        urls.append(proximo.removeprefix('http://testserver'))
+        for url in urls:
+            with self.subTest(url=url):
+                sincrona, assincrona = self.client.get(url), self.obter(url)
+                self.assertEqual(assincrona.status_code, 200)
+                self.assertEqual(assincrona.content, sincrona.content)
+
+    def test_erros_como_no_drf(self):
+        for url in ('/api/produtos/?cursor=x', '/api/pesquisa/?limite=x', '/api/lojas-recomendadas/?limite=x'):
+            with self.subTest(url=url):
+                sincrona, assincrona = self.client.get(url), self.obter(url)
+                self.assertEqual(assincrona.status_code, sincrona.status_code)
+                self.assertEqual(assincrona.json(), sincrona.json())
+
+        anonimo = APIClient().get('/api/produtos/')
+        resposta = self.obter('/api/produtos/', AsyncClient())
+        self.assertEqual((resposta.status_code, resposta.json()), (anonimo.status_code, anonimo.json()))
+        sincrona = APIClient(HTTP_AUTHORIZATION='Bearer x').get('/api/produtos/')
+        resposta = self.obter('/api/produtos/', AsyncClient(), authorization='Bearer x')
+        self.assertEqual((resposta.status_code, resposta.json()), (sincrona.status_code, sincrona.json()))
+
+    def test_jwt(self):
+        token = RefreshToken.for_user(self.user).access_token
+        resposta = self.obter('/api/produtos/', AsyncClient(), authorization=f'Bearer {token}')
+        self.assertEqual(resposta.content, self.client.get('/api/produtos/').content)
+
+    def test_recomendacoes_so_para_clientes(self):
+        self.assincrono.force_login(self.lojista.user)
+        self.assertEqual(self.obter('/api/lojas-recomendadas/').status_code, 403)
+
+    @override_settings(CACHE_RESPOSTAS={'ATIVO': True})
+    def test_mesmo_cache_e_etags(self):
+        sincrona = self.client.get('/api/lojas/')
+        acertos = cache_respostas.estatisticas()['acertos']
+        assincrona = self.obter('/api/lojas/')
+        self.assertEqual(cache_respostas.estatisticas()['acertos'], acertos + 1)
+        self.assertEqual((assincrona.content, assincrona['ETag']), (sincrona.content, sincrona['ETag']))
+        self.assertEqual(self.obter('/api/lojas/', if_none_match=sincrona['ETag']).status_code, 304)
+
+        # gravada pela view async, servida pela síncrona
+        self.assertEqual(self.obter('/api/categorias/').status_code, 200)
+        acertos = cache_respostas.estatisticas()['acertos']
+        self.assertEqual(self.client.get('/api/categorias/').content, self.obter('/api/categorias/').content)
+        self.assertEqual(cache_respostas.estatisticas()['acertos'], acertos + 2)
+
+    def baixar_em_fluxo(self, url):
+        # conteúdo lido como o servidor ASGI lê; um iterador síncrono aqui vira aviso (erro)
+        async def ler(resposta):
+            return b''.join([pedaco async for pedaco in resposta])
+
+        resposta = self.obter(url)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta.is_async)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            return resposta, async_to_sync(ler)(resposta)
+
+    def test_exportacao_e_pacote_em_fluxo(self):
+        AcaoUsuario.objects.create(usuario=self.user, acao='visualizou loja')
+        self.client.force_authenticate(User.objects.create_superuser(username='admin@feira.com', password='x'))
+        self.assincrono.force_login(User.objects.get(username='admin@feira.com'))
+        for url in ('/api/exportar/acoes/', '/api/exportar/avaliacoes/?formato=csv'):
+            _, conteudo = self.baixar_em_fluxo(url)
+            self.assertEqual(conteudo, b''.join(self.client.get(url).streaming_content))
+
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        with override_settings(PACOTES={'DIRETORIO': diretorio.name}):
+            versao, _ = pacotes.construir()
+            resposta, conteudo = self.baixar_em_fluxo(f'/api/pacotes/{versao}/')
+            self.assertEqual(conteudo, pacotes.caminho(versao).read_bytes())
+        self.assertEqual(int(resposta['Content-Length']), len(conteudo))
+        self.assertIn(f'filename="{versao}.sqlite.gz"', resposta['Content-Disposition'])
+
+    def test_outros_metodos_seguem_para_o_drf(self):
+        with override_settings(ROOT_URLCONF=__name__):
+            resposta = async_to_sync(self.assincrono.post)(
+                '/api/categorias/', {'nome': 'Cerâmica'}, content_type='application/json'
+            )
+        self.assertEqual(resposta.status_code, 201)
+        self.assertTrue(Categoria.objects.filter(nome='Cerâmica').exists())
 
-# Create your tests here.
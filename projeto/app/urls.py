@@ -1,10 +1,14 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import SimpleRouter
+from . import assincrono
 from .views import (
     AvaliacaoViewSet, LojaViewSet, ProdutoViewSet, CategoriaViewSet, AcaoUsuarioViewSet, logout,
     LojistaViewSet, ClienteViewSet, ProdutoFavoritoViewSet, LojaFavoritaViewSet, PesquisaView,
     SetorViewSet, TotemPessoalViewSet, RegisterView, meu_perfil, MapaViewSet, CriarLojistaView,
-    LojasRecomendadasView, ProdutosRecomendadosView
+    LojasRecomendadasView, ProdutosRecomendadosView, MetricasAcoesView, MetricasTotensView,
+    CacheRespostasView, ExportacaoView, PosicaoLojaViewSet, SincronizacaoView,
+    PacotesView, PacoteView
 )
 
 router = SimpleRouter()
@@ -19,6 +23,7 @@ router.register('lojas_favoritas', LojaFavoritaViewSet)
 router.register('setores', SetorViewSet)
 router.register('totens', TotemPessoalViewSet)
 router.register('mapa', MapaViewSet)
+router.register('posicoes', PosicaoLojaViewSet)
 router.register(r'acoes', AcaoUsuarioViewSet, basename='acao')
 
 
@@ -31,6 +36,28 @@ urlpatterns = [
     path('pesquisa/', PesquisaView.as_view(), name='pesquisa'),
     path('criar-lojista/', CriarLojistaView.as_view(), name='criar-lojista'),
     path('meu-perfil/', meu_perfil),
+    path('metricas/acoes/', MetricasAcoesView.as_view(), name='metricas-acoes'),
+    path('metricas/totens/', MetricasTotensView.as_view(), name='metricas-totens'),
+    path('cache/', CacheRespostasView.as_view(), name='cache'),
+    path('exportar/<str:fonte>/', ExportacaoView.as_view(), name='exportar'),
+    path('sincronizacao/', SincronizacaoView.as_view(), name='sincronizacao'),
+    path('pacotes/', PacotesView.as_view(), name='pacotes'),
+    path('pacotes/<str:versao>/', PacoteView.as_view(), name='pacote'),
 
     path('', include(router.urls)),
 ]
+
+# Modo ASGI (app/assincrono.py): as leituras mais frequentes por views async,
+# nos mesmos endereços; os outros métodos desses endereços seguem no DRF
+rotas_assincronas = [
+    path('pesquisa/', assincrono.pesquisa(PesquisaView.as_view())),
+    path('lojas-recomendadas/', assincrono.lojas_recomendadas(LojasRecomendadasView.as_view())),
+    path('produtos-recomendados/', assincrono.produtos_recomendados(ProdutosRecomendadosView.as_view())),
+    path('meu-perfil/', assincrono.perfil(meu_perfil)),
+    path('lojas/', assincrono.listagem(LojaViewSet)),
+    path('produtos/', assincrono.listagem(ProdutoViewSet)),
+    path('categorias/', assincrono.listagem(CategoriaViewSet)),
+]
+
+if settings.VIEWS_ASSINCRONAS:
+    urlpatterns = rotas_assincronas + urlpatterns
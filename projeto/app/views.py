@@ -2,25 +2,44 @@ from rest_framework import viewsets, status, filters
 from rest_framework.views import APIView
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 
-from django.db.models import Avg, Q
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Q, Sum
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_date, parse_datetime
+
+import math
+from datetime import datetime, time
 
 from .models import (
     Lojista, Cliente, Loja, Produto, Categoria, Avaliacao,
-    ProdutoFavorito, LojaFavorita, Setor, TotemPessoal, Mapas, AcaoUsuario
+    ProdutoFavorito, LojaFavorita, Setor, TotemPessoal, Mapas, AcaoUsuario,
+    AgregadoAcao, AgregadoTotem, PosicaoLoja
 )
 from .serializers import (
     LojistaSerializer, ClienteSerializer, LojaSerializer, ProdutoSerializer,
     CategoriaSerializer, AvaliacaoSerializer, ProdutoFavoritoSerializer,
     LojaFavoritaSerializer, SetorSerializer, TotemPessoalSerializer, ClienteRegisterSerializer, 
-    MapasSerializer, LojistaRegisterSerializer, AcaoUsuarioSerializer, PesquisaSerializer
+    MapasSerializer, LojistaRegisterSerializer, AcaoUsuarioSerializer,
+    PosicaoLojaSerializer
 )
+from .consultas import planejar_queryset, lojas_queryset, em_ordem
+from . import busca, espacial, favoritos, metricas, mosaico, pacotes, recomendacao, rotas, similares, sincronizacao
+from .eventos import fila_acoes
+from .cache import CacheRespostaMixin, RespostaCondicionalMixin, cache_respostas
+from .lote import NDJSONParser, importar_produtos
+from .exportacao import Exportacao
+from .leitura import LeituraRapidaMixin, LeituraCategoria, LeituraLoja, LeituraPesquisa, LeituraProduto, RENDERERS
 
 def registrar_acao(usuario, acao, loja=None, produto=None, detalhes=''):
-    AcaoUsuario.objects.create(
+    # Enfileira a ação; a gravação acontece em lote fora da requisição (app/eventos.py)
+    fila_acoes.registrar(
         usuario=usuario,
         acao=acao,
         loja=loja,
@@ -28,6 +47,14 @@ def registrar_acao(usuario, acao, loja=None, produto=None, detalhes=''):
         detalhes=detalhes
     )
 
+def resposta_paginada(view, queryset, serializer_class):
+    # Listagens das actions: mesmo paginador, ?fields= e planejamento de consultas das listagens padrão
+    contexto = view.get_serializer_context()
+    queryset = planejar_queryset(queryset, serializer_class(context=contexto))
+    pagina = view.paginate_queryset(queryset)
+    serializer = serializer_class(pagina, many=True, context=contexto)
+    return view.get_paginated_response(serializer.data)
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def logout(request):
@@ -52,14 +79,20 @@ class CriarLojistaView(APIView):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def meu_perfil(request):
+    return Response(dados_perfil(request))
+
+
+def dados_perfil(request):
+    # também usado pela variante async (app/assincrono.py)
     user = request.user
-    dataid = {"id": user.id}
     data = {"email": user.email}
 
     try:
         if hasattr(user, 'cliente'):
-            data["cliente"] = ClienteSerializer(user.cliente, context={"request": request}).data
-            dataid["cliente"] = ClienteSerializer(user.cliente, context={"resquest": request}).dataid
+            contexto = {"request": request}
+            # mesmo planejamento de /clientes/<id>/, inclusive com ?expand=
+            cliente = planejar_queryset(Cliente.objects.filter(pk=user.cliente.pk), ClienteSerializer(context=contexto)).get()
+            data["cliente"] = ClienteSerializer(cliente, context=contexto).data
     except Exception as e:
         data["cliente_erro"] = f"Erro ao serializar cliente: {str(e)}"
 
@@ -69,19 +102,20 @@ def meu_perfil(request):
     except Exception as e:
         data["lojista_erro"] = f"Erro ao serializar lojista: {str(e)}"
 
-    return Response(data)
+    return data
 
 
 class LojasRecomendadasView(APIView):
     permission_classes = [IsAuthenticated]
 
-    
+    # Top-K pré-calculado por cliente (app/recomendacao.py)
     def get(self, request):
         cliente = request.user.cliente  # ou ajuste conforme sua relação
-        categorias = cliente.categorias_desejadas.all()
-        lojas = Loja.objects.annotate(
-            nota_media=Avg('avaliacoes_recebidas__nota')
-        ).filter(categorias__in=categorias).distinct()
+        limite = ler_limite(request)
+        if limite is None:
+            return Response({"detail": "Parâmetro 'limite' deve ser inteiro."}, status=status.HTTP_400_BAD_REQUEST)
+        ids = recomendacao.recomendados(cliente, 'loja', limite)
+        lojas = em_ordem(lojas_queryset(Loja.objects.filter(pk__in=ids, ativo=True)), ids)
         serializer = LojaSerializer(lojas, many=True, context={"request": request})
         return Response(serializer.data)
     
@@ -90,8 +124,13 @@ class ProdutosRecomendadosView(APIView):
 
     def get(self, request):
         cliente = request.user.cliente  # ou ajuste conforme sua relação
-        categorias = cliente.categorias_desejadas.all()
-        produtos = Produto.objects.filter(categorias__in=categorias).distinct()
+        limite = ler_limite(request)
+        if limite is None:
+            return Response({"detail": "Parâmetro 'limite' deve ser inteiro."}, status=status.HTTP_400_BAD_REQUEST)
+        ids = recomendacao.recomendados(cliente, 'produto', limite)
+        produtos = em_ordem(
+            planejar_queryset(Produto.objects.filter(pk__in=ids, ativo=True), ProdutoSerializer), ids
+        )
         serializer = ProdutoSerializer(produtos, many=True, context={"request": request})
         return Response(serializer.data)
     
@@ -106,17 +145,121 @@ class RegisterView(APIView):
             return Response({"message": "Usuário criado com sucesso!"}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
-class MapaViewSet(viewsets.ModelViewSet):
+class MapaViewSet(CacheRespostaMixin, RespostaCondicionalMixin, viewsets.ModelViewSet):
     queryset = Mapas.objects.all()
     serializer_class = MapasSerializer
     permission_classes = (IsAuthenticated, )
 
     @action(detail=True, methods=['get'])
     def loja(self, request, pk=None):
-        Mapas = self.get_object()
-        lojas = Mapas.loja.all()
-        serializer = LojaSerializer(lojas, many=True)
-        return Response(serializer.data)
+        mapa = self.get_object()
+        return resposta_paginada(self, Loja.objects.filter(pk=mapa.loja_id), LojaSerializer)
+
+    @action(detail=True, methods=['get'])
+    def proximas(self, request, pk=None):
+        # Lojas mais próximas de ?x=&y= no mapa (app/espacial.py), com a distância em pixels
+        try:
+            x, y = ler_coordenadas(request, 'x', 'y')
+            filtros = ler_filtros_espaciais(request)
+        except ValueError as erro:
+            return Response({"detail": str(erro)}, status=status.HTTP_400_BAD_REQUEST)
+        config = espacial.configuracao()
+        limite = ler_limite(request, config['MAXIMO_VIZINHOS'], padrao=config['VIZINHOS'])
+        if limite is None:
+            return Response({"detail": "Parâmetro 'limite' deve ser inteiro."}, status=status.HTTP_400_BAD_REQUEST)
+
+        grade = self.grade_espacial()
+        if grade is None:
+            return Response({"detail": "Mapa não encontrado."}, status=status.HTTP_404_NOT_FOUND)
+        return Response([
+            {**posicao_loja(ponto), 'distancia': round(distancia, 2)}
+            for ponto, distancia in grade.proximas(x, y, limite, espacial.filtro(**filtros))
+        ])
+
+    @action(detail=True, methods=['get'])
+    def regiao(self, request, pk=None):
+        # Lojas dentro do retângulo ?x0=&y0=&x1=&y1= do mapa, em ordem de leitura
+        try:
+            x0, y0, x1, y1 = ler_coordenadas(request, 'x0', 'y0', 'x1', 'y1')
+            filtros = ler_filtros_espaciais(request)
+        except ValueError as erro:
+            return Response({"detail": str(erro)}, status=status.HTTP_400_BAD_REQUEST)
+        limite = ler_limite(request, espacial.configuracao()['MAXIMO_REGIAO'])
+        if limite is None:
+            return Response({"detail": "Parâmetro 'limite' deve ser inteiro."}, status=status.HTTP_400_BAD_REQUEST)
+
+        grade = self.grade_espacial()
+        if grade is None:
+            return Response({"detail": "Mapa não encontrado."}, status=status.HTTP_404_NOT_FOUND)
+        pontos = grade.regiao(x0, y0, x1, y1, espacial.filtro(**filtros))
+        return Response({'results': [posicao_loja(ponto) for ponto in pontos[:limite]], 'mais': len(pontos) > limite})
+
+    @action(detail=True, methods=['get', 'put'])
+    def caminhos(self, request, pk=None):
+        # Grafo de corredores do mapa (app/rotas.py): {'nos': [[x, y], ...], 'corredores': [[a, b], ...]}
+        mapa = self.get_object()
+        if request.method == 'GET':
+            return Response(mapa.caminhos or {'nos': [], 'corredores': []})
+        caminhos, erros = rotas.validar_caminhos(request.data)
+        if erros:
+            return Response(erros, status=status.HTTP_400_BAD_REQUEST)
+        Mapas.objects.filter(pk=mapa.pk).update(caminhos=caminhos)
+        rotas.agendar(mapa.pk)
+        return Response(caminhos)
+
+    @action(detail=True, methods=['get'])
+    def rota(self, request, pk=None):
+        # Rota a pé de ?x=&y= (o totem) até ?lojas=1,2,3 (ou ?favoritas=1, as
+        # lojas favoritas do cliente), na ordem que encurta o percurso
+        try:
+            x, y = ler_coordenadas(request, 'x', 'y')
+        except ValueError as erro:
+            return Response({"detail": str(erro)}, status=status.HTTP_400_BAD_REQUEST)
+        if request.query_params.get('favoritas'):
+            lojas = list(LojaFavorita.objects.filter(cliente__user=request.user).values_list('loja_id', flat=True))
+        else:
+            pedidas = [valor.strip() for valor in request.query_params.get('lojas', '').split(',') if valor.strip()]
+            if not pedidas or not all(valor.isdigit() for valor in pedidas):
+                return Response(
+                    {"detail": "Informe lojas=<id>,<id>,... ou favoritas=1."}, status=status.HTTP_400_BAD_REQUEST
+                )
+            lojas = [int(valor) for valor in pedidas]
+        maximo = rotas.configuracao()['MAXIMO_PARADAS']
+        if len(lojas) > maximo:
+            return Response({"detail": f"Máximo de {maximo} lojas por rota."}, status=status.HTTP_400_BAD_REQUEST)
+
+        grafo = rotas.roteador.grafo(self.pk_da_url())
+        if grafo is None:
+            return Response({"detail": "Mapa sem caminhos cadastrados."}, status=status.HTTP_404_NOT_FOUND)
+        ativas = set(Loja.objects.filter(pk__in=lojas, ativo=True).values_list('pk', flat=True))
+        rota = rotas.planejar(grafo, x, y, [loja for loja in lojas if loja in ativas])
+        rota['inalcancaveis'] += [loja for loja in dict.fromkeys(lojas) if loja not in ativas]
+        return Response(rota)
+
+    def grade_espacial(self):
+        pk = self.pk_da_url()
+        return espacial.indice_posicoes.grade(pk) if pk is not None else None
+
+    @action(
+        detail=True, methods=['get'], permission_classes=[AllowAny], content_negotiation_class=mosaico.SemNegociacao,
+        url_path=r'tiles/(?P<versao>[0-9a-f]+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)', url_name='tiles',
+    )
+    def tiles(self, request, pk=None, versao=None, z=None, x=None, y=None):
+        # Tiles do mosaico do mapa (app/mosaico.py). O endereço leva a versão da
+        # imagem, então o conteúdo nunca muda: cache público e imutável.
+        pk = self.pk_da_url()
+        dados = Mapas.objects.filter(pk=pk).values_list('mosaico', flat=True).first() if pk is not None else None
+        nome = mosaico.caminho_tile(dados, versao, int(z), int(x), int(y))
+        if nome is None:
+            return Response({"detail": "Tile não encontrado."}, status=status.HTTP_404_NOT_FOUND)
+
+        etag = f'"{versao}-{z}-{x}-{y}"'
+        resposta = get_conditional_response(request, etag=etag)
+        if resposta is None:
+            resposta = resposta_arquivo(request, mosaico.abrir_tile(nome), content_type='image/webp')
+        resposta.headers['ETag'] = etag
+        patch_cache_control(resposta, public=True, max_age=mosaico.CACHE_TILES, immutable=True)
+        return resposta
 
 class LojistaViewSet(viewsets.ModelViewSet):
     queryset = Lojista.objects.all()
@@ -133,7 +276,7 @@ class LojistaViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def loja(self, request, pk=None):
         lojista = self.get_object()
-        lojas = Loja.objects.get(lojista=lojista)  # Aqui usamos filter
+        lojas = lojas_queryset(Loja.objects.filter(lojista=lojista), LojaSerializer(context={'request': request})).get()
         serializer = LojaSerializer(lojas, many=False, context={'request': request})
         return Response(serializer.data)
 
@@ -144,6 +287,9 @@ class ClienteViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         queryset = super().get_queryset()
+        # As actions de favoritos só precisam do cliente, não do perfil completo
+        if self.action in ('list', 'retrieve', 'update', 'partial_update'):
+            queryset = planejar_queryset(queryset, self.get_serializer())
         nome = self.request.query_params.get('nome')
         if nome:
             queryset = queryset.filter(nome__icontains=nome)
@@ -152,9 +298,7 @@ class ClienteViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def categorias_desejadas(self, request, pk=None):
         cliente = self.get_object()
-        categorias_desejadas = cliente.categorias_desejadas.all()
-        serializer = CategoriaSerializer(categorias_desejadas, many=True)
-        return Response(serializer.data)
+        return resposta_paginada(self, cliente.categorias_desejadas.all(), CategoriaSerializer)
     
 
     @action(detail=True, methods=['get', 'delete'], url_path='produtos_favoritos(?:/(?P<id_produto>\d+))?')
@@ -170,20 +314,17 @@ class ClienteViewSet(viewsets.ModelViewSet):
                 serializer = ProdutoSerializer(produto, context={'request': request})
                 return Response(serializer.data)
 
-            produtos = cliente.produtos_favoritos.all()
-            serializer = ProdutoSerializer(produtos, many=True, context={'request': request})
-            return Response(serializer.data)
+            produtos = Produto.objects.filter(cliente_que_favoritou=cliente)
+            return resposta_paginada(self, produtos, ProdutoSerializer)
 
         elif request.method == 'DELETE':
             if not id_produto:
                 return Response({"detail": "É necessário informar o ID do produto para remover."}, status=status.HTTP_400_BAD_REQUEST)
 
-            try:
-                produto = Produto.objects.get(id=id_produto)
-            except Produto.DoesNotExist:
+            # Um DELETE só; o produto é procurado apenas se não era favorito
+            removidos, _ = ProdutoFavorito.objects.filter(cliente=cliente, produto_id=id_produto).delete()
+            if not removidos and not Produto.objects.filter(id=id_produto).exists():
                 return Response({"detail": "Produto não encontrado."}, status=status.HTTP_404_NOT_FOUND)
-
-            cliente.produtos_favoritos.remove(produto)
             return Response({"detail": "Produto removido dos favoritos."}, status=status.HTTP_204_NO_CONTENT)
 
 
@@ -200,36 +341,52 @@ class ClienteViewSet(viewsets.ModelViewSet):
                 serializer = LojaSerializer(loja, context={'request': request})
                 return Response(serializer.data)
 
-            lojas = cliente.lojas_favoritas.all()
-            serializer = LojaSerializer(lojas, many=True, context={'request': request})
-            return Response(serializer.data)
+            lojas = Loja.objects.filter(cliente_que_favoritou=cliente)
+            return resposta_paginada(self, lojas, LojaSerializer)
 
         elif request.method == 'DELETE':
             if not id_loja:
                 return Response({"detail": "É necessário informar o ID da loja para remover."}, status=status.HTTP_400_BAD_REQUEST)
 
-            try:
-                loja = Loja.objects.get(id=id_loja)
-            except Loja.DoesNotExist:
+            removidos, _ = LojaFavorita.objects.filter(cliente=cliente, loja_id=id_loja).delete()
+            if not removidos and not Loja.objects.filter(id=id_loja).exists():
                 return Response({"detail": "Loja não encontrado."}, status=status.HTTP_404_NOT_FOUND)
-
-            cliente.lojas_favoritas.remove(loja)
             return Response({"detail": "Loja removido dos favoritos."}, status=status.HTTP_204_NO_CONTENT)
+
+    # Aplica em lote operações de adicionar/remover favoritos (app/favoritos.py)
+    @action(detail=True, methods=['post'])
+    def favoritos(self, request, pk=None):
+        cliente = self.get_object()
+        if cliente.user_id != request.user.pk and not request.user.is_staff:
+            return Response({"detail": "Só o próprio cliente pode alterar os seus favoritos."}, status=status.HTTP_403_FORBIDDEN)
+
+        ignorados, erros = favoritos.sincronizar(cliente, request.data)
+        if erros:
+            return Response(erros, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'produtos_favoritos': list(cliente.produto_favorito_rel.order_by('produto_id').values_list('produto_id', flat=True)),
+            'lojas_favoritas': list(cliente.loja_favorita_rel.order_by('loja_id').values_list('loja_id', flat=True)),
+            'ignorados': ignorados,
+        })
     
 class AcaoUsuarioViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = AcaoUsuario.objects.all().order_by('-timestamp')
     serializer_class = AcaoUsuarioSerializer
     permission_classes = [IsAuthenticated]  # ou alguma permissão mais específica
 
+    # Contadores da fila de gravação: enfileiradas, gravadas, descartadas, falhas e pendentes
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def fila(self, request):
+        return Response(fila_acoes.estatisticas())
+
     @action(detail=True, methods=['get'])
     def lojas(self, request, pk=None):
         acao = self.get_object()
-        lojas = acao.lojas.all()
-        serializer = CategoriaSerializer(categorias_desejadas, many=True)
-        return Response(serializer.data)
+        return resposta_paginada(self, Loja.objects.filter(pk=acao.loja_id), LojaSerializer)
 
 class PesquisaView(APIView):
     permission_classes = (IsAuthenticated, )
+    renderer_classes = RENDERERS
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -245,50 +402,75 @@ class PesquisaView(APIView):
         return super().retrieve(request, *args, **kwargs)
     
     def get(self, request):
-        termo = request.query_params.get('nome', '')
-
-        # Lojas que têm no nome OU têm produtos com esse nome
-        lojas = Loja.objects.annotate(
-            nota_media=Avg('avaliacoes_recebidas__nota')
-        ).filter(
-            nome__icontains=termo
-        ).distinct()
-
-        # Produtos individualmente que batem com o nome
-        produtos = Produto.objects.filter(nome__icontains=termo)
-
-        # Serializa tudo
-        lojas_serializadas = PesquisaSerializer(lojas, many=True, context={'request': request})
-        produtos_serializados = ProdutoSerializer(produtos, many=True, context={'request': request})
+        pagina = ler_pagina_pesquisa(request)
+        if pagina is None:
+            return Response({"detail": "Parâmetros 'limite' e 'cursor' devem ser inteiros."}, status=status.HTTP_400_BAD_REQUEST)
+        ids_lojas, ids_produtos, proximo = ids_pesquisa(request.query_params.get('nome', ''), *pagina)
 
+        # Mesma saída de PesquisaSerializer e ProdutoSerializer (app/leitura.py)
         return Response({
-            'lojas': lojas_serializadas.data,
-            'produtos': produtos_serializados.data
+            'lojas': LeituraPesquisa().por_ids(ids_lojas, request),
+            'produtos': LeituraProduto().por_ids(ids_produtos, request),
+            'proximo_cursor': proximo,
         })
 
+
+def ler_pagina_pesquisa(request):
+    # (inicio, limite) de ?cursor= e ?limite= da pesquisa; None se inválidos
+    try:
+        limite = max(1, min(int(request.query_params.get('limite', 20)), 100))
+        inicio = max(0, int(request.query_params.get('cursor') or 0))
+    except ValueError:
+        return None
+    return inicio, limite
+
+
+def ids_pesquisa(termo, inicio, limite):
+    # Lojas e produtos ranqueados pelo índice de busca (app/busca.py) e o próximo cursor
+    paginas = []
+    fim = inicio + limite
+    for tipo, model in (('loja', Loja), ('produto', Produto)):
+        if not termo.strip():
+            # Sem termo, mantém o comportamento antigo de listar tudo
+            ids = list(model.objects.order_by('pk').values_list('pk', flat=True)[:fim + 1])
+        elif busca.normalizar(termo):
+            ids = busca.motor.buscar(tipo, termo, fim + 1)
+        else:
+            # só stopwords ou pontuação: nada a procurar
+            ids = []
+        paginas.append((ids[inicio:fim], len(ids) > fim))
+    (ids_lojas, mais_lojas), (ids_produtos, mais_produtos) = paginas
+    return ids_lojas, ids_produtos, str(fim) if mais_lojas or mais_produtos else None
+
     
 
-class LojaViewSet(viewsets.ModelViewSet):
+class LojaViewSet(CacheRespostaMixin, RespostaCondicionalMixin, LeituraRapidaMixin, viewsets.ModelViewSet):
 
     serializer_class = LojaSerializer
+    leitura = LeituraLoja()
     permission_classes = (IsAuthenticated, )
 
     def retrieve(self, request, *args, **kwargs):
-        instance = self.get_object()
-        
+        # A resposta pode vir do cache; a loja existe, senão seria 404
+        resposta = super().retrieve(request, *args, **kwargs)
+
         # Registra a ação automaticamente
         if request.user.is_authenticated:
             registrar_acao(
                 usuario=request.user,
                 acao='visualizou loja',
-                loja=instance
+                loja=Loja(pk=self.pk_da_url())
             )
 
-        return super().retrieve(request, *args, **kwargs)
+        return resposta
 
 
     def get_queryset(self):
-        queryset = Loja.objects.annotate(nota_media=Avg('avaliacoes_recebidas__nota'))
+        queryset = Loja.objects.all()
+        # As actions só usam a loja para filtrar; list e retrieve não usam o
+        # serializer (LeituraRapidaMixin), o planejamento é da resposta da escrita
+        if self.action in ('update', 'partial_update'):
+            queryset = lojas_queryset(serializer=self.get_serializer())
         nome = self.request.query_params.get('nome')
         if nome:
             queryset = queryset.filter(nome__icontains=nome)
@@ -297,69 +479,63 @@ class LojaViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def avaliacoes(self, request, pk=None):
         avaliacoes = Avaliacao.objects.filter(loja_id=pk)
-        serializer = AvaliacaoSerializer(avaliacoes, many=True)
-        return Response(serializer.data)
+        return resposta_paginada(self, avaliacoes, AvaliacaoSerializer)
 
-    # # ACTION PARA PAGINAÇÃO
-    # @action(detail=True, methods=['get'])
-    # def avaliacoes(self, request, pk=None):
-    #     self.pagination_class.page_size = 1  # Paginação: 1 por página
-    #     avaliacoes = Avaliacao.objects.filter(loja_id=pk)
-    #     page = self.paginate_queryset(avaliacoes)
-    #     if page is not None:
-    #         serializer = AvaliacaoSerializer(page, many=True)
-    #         return self.get_paginated_response(serializer.data)
-    #     serializer = AvaliacaoSerializer(avaliacoes.all(), many=True)
-    #     return Response(serializer.data)
-    
     # ACTION PARA ENDPOINT /lojas/1/produtos
     @action(detail=True, methods=['get'])
     def produtos(self, request, pk=None):
         loja = self.get_object()
-        serializer = ProdutoSerializer(loja.produtos.all(), many=True)
-        return Response(serializer.data)
+        return resposta_paginada(self, loja.produtos.all(), ProdutoSerializer)
     
     @action(detail=True, methods=['get'])
     def categorias(self, request, pk=None):
         loja = self.get_object()
-        categorias = loja.categorias.all()
-        serializer = CategoriaSerializer(categorias, many=True)
-        return Response(serializer.data)
+        return resposta_paginada(self, loja.categorias.all(), CategoriaSerializer)
     
     @action(detail=True, methods=['get'])
     def acoes(self, request, pk=None):
         acoes = AcaoUsuario.objects.filter(loja_id=pk)
-        serializer = AcaoUsuarioSerializer(acoes, many=True)
-        return Response(serializer.data)
+        return resposta_paginada(self, acoes, AcaoUsuarioSerializer)
     
     @action(detail=True, methods=['get'])
     def favoritas(self, request, pk=None):
         favoritos = LojaFavorita.objects.filter(loja_id=pk)
-        serializer = LojaFavoritaSerializer(favoritos, many=True)
-        return Response(serializer.data)
+        return resposta_paginada(self, favoritos, LojaFavoritaSerializer)
+
+    @action(detail=True, methods=['get'])
+    def similares(self, request, pk=None):
+        ids = ler_vizinhos(self, 'loja')
+        if ids is None:
+            return Response({"detail": "Parâmetro 'limite' deve ser inteiro."}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer()
+        lojas = em_ordem(lojas_queryset(Loja.objects.filter(pk__in=ids, ativo=True), serializer), ids)
+        return Response(self.get_serializer(lojas, many=True).data)
 
     
 
-class ProdutoViewSet(viewsets.ModelViewSet):
+class ProdutoViewSet(CacheRespostaMixin, RespostaCondicionalMixin, LeituraRapidaMixin, viewsets.ModelViewSet):
     queryset = Produto.objects.all()
     serializer_class = ProdutoSerializer
+    leitura = LeituraProduto()
     permission_classes = (IsAuthenticated, )
 
     def retrieve(self, request, *args, **kwargs):
-        produto = self.get_object()
+        resposta = super().retrieve(request, *args, **kwargs)
 
         if request.user.is_authenticated:
             registrar_acao(
                 usuario=request.user,
                 acao='visualizou produto',
-                produto=produto
+                produto=Produto(pk=self.pk_da_url())
             )
 
-        return super().retrieve(request, *args, **kwargs)
+        return resposta
 
     # ACTION PARA BUSCAR PELO NOME
     def get_queryset(self):
         queryset = super().get_queryset()
+        if self.action in ('update', 'partial_update'):
+            queryset = planejar_queryset(queryset, self.get_serializer())
         nome = self.request.query_params.get('nome')
         if nome:
             queryset = queryset.filter(nome__icontains=nome)
@@ -369,26 +545,39 @@ class ProdutoViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def lojas(self, request, pk=None):
         produto = self.get_object()
-        lojas = produto.lojas.all()
-        serializer = LojaSerializer(lojas, many=True)
-        return Response(serializer.data)
+        return resposta_paginada(self, Loja.objects.filter(pk=produto.loja_id), LojaSerializer)
     
     @action(detail=True, methods=['get'])
     def categorias(self, request, pk=None):
         produto = self.get_object()
-        categorias = produto.categorias.all()
-        serializer = CategoriaSerializer(categorias, many=True)
-        return Response(serializer.data)
+        return resposta_paginada(self, produto.categorias.all(), CategoriaSerializer)
     
     @action(detail=True, methods=['get'])
     def favoritos(self, request, pk=None):
         favoritos = ProdutoFavorito.objects.filter(produto_id=pk)
-        serializer = ProdutoFavoritoSerializer(favoritos, many=True)
-        return Response(serializer.data)
+        return resposta_paginada(self, favoritos, ProdutoFavoritoSerializer)
 
-class CategoriaViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['get'])
+    def similares(self, request, pk=None):
+        ids = ler_vizinhos(self, 'produto')
+        if ids is None:
+            return Response({"detail": "Parâmetro 'limite' deve ser inteiro."}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer()
+        produtos = em_ordem(planejar_queryset(Produto.objects.filter(pk__in=ids, ativo=True), serializer), ids)
+        return Response(self.get_serializer(produtos, many=True).data)
+
+    # Cria (linhas sem id) e atualiza (com id) produtos em lote, tudo ou nada (app/lote.py)
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def lote(self, request):
+        resultado, erros = importar_produtos(request.data)
+        if erros:
+            return Response(erros, status=status.HTTP_400_BAD_REQUEST)
+        return Response(resultado, status=status.HTTP_201_CREATED)
+
+class CategoriaViewSet(CacheRespostaMixin, RespostaCondicionalMixin, LeituraRapidaMixin, viewsets.ModelViewSet):
     queryset = Categoria.objects.all()
     serializer_class = CategoriaSerializer
+    leitura = LeituraCategoria()
     permission_classes = (IsAuthenticated, )
 
     def get_queryset(self):
@@ -401,25 +590,16 @@ class CategoriaViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def lojas(self, request, pk=None):
         categoria = self.get_object()
-        serializer = LojaSerializer(categoria.lojas.all(), many=True)
-        return Response(serializer.data)
+        return resposta_paginada(self, categoria.lojas.all(), LojaSerializer)
     
     
     @action(detail=True, methods=['get'])
     def setores(self, request, pk=None):
         categoria = self.get_object()
-        
-        # Pega todas as lojas que têm essa categoria
-        lojas = categoria.lojas.all()
-        
-        # Pega os setores dessas lojas
-        setores = set(loja.setor for loja in lojas if loja.setor is not None)
-        
-        # Serializa os setores
-        from .serializers import SetorSerializer  # certifique-se de ter esse serializer criado
-        serializer = SetorSerializer(setores, many=True)
-        
-        return Response(serializer.data)
+
+        # Setores das lojas que têm essa categoria
+        setores = Setor.objects.filter(lojas__categorias=categoria).distinct()
+        return resposta_paginada(self, setores, SetorSerializer)
 
 
 
@@ -446,7 +626,7 @@ class LojaFavoritaViewSet(viewsets.ModelViewSet):
     serializer_class = LojaFavoritaSerializer
     permission_classes = (IsAuthenticated, )
 
-class SetorViewSet(viewsets.ModelViewSet):
+class SetorViewSet(CacheRespostaMixin, RespostaCondicionalMixin, viewsets.ModelViewSet):
     queryset = Setor.objects.all()
     serializer_class = SetorSerializer
     permission_classes = (IsAuthenticated, )
@@ -461,9 +641,7 @@ class SetorViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def lojas(self, request, pk=None):
         setor = self.get_object()
-        lojas = setor.lojas.all()
-        serializer = LojaSerializer(lojas, many=True)
-        return Response(serializer.data)
+        return resposta_paginada(self, setor.lojas.all(), LojaSerializer)
 
     @action(detail=True, methods=['get'])
     def categorias(self, request, pk=None):
@@ -471,11 +649,257 @@ class SetorViewSet(viewsets.ModelViewSet):
 
         # Filtra as categorias das lojas que estão nesse setor
         categorias = Categoria.objects.filter(lojas__setor=setor).distinct()
-        serializer = CategoriaSerializer(categorias, many=True)
-        return Response(serializer.data)
+        return resposta_paginada(self, categorias, CategoriaSerializer)
 
 class TotemPessoalViewSet(viewsets.ModelViewSet):
     queryset = TotemPessoal.objects.all()
     serializer_class = TotemPessoalSerializer
     permission_classes = (IsAuthenticated, )
 
+
+class PosicaoLojaViewSet(viewsets.ModelViewSet):
+    # Posições das lojas nos mapas; ?mapa= e ?loja= filtram a listagem
+    queryset = PosicaoLoja.objects.all()
+    serializer_class = PosicaoLojaSerializer
+    permission_classes = (IsAuthenticated, )
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        for parametro in ('mapa', 'loja'):
+            valor = self.request.query_params.get(parametro)
+            if valor and valor.isdigit():
+                queryset = queryset.filter(**{f'{parametro}_id': valor})
+        return queryset
+
+
+
+class CacheRespostasView(APIView):
+    # Contadores do cache de respostas (app/cache.py); DELETE esvazia o cache
+    permission_classes = (IsAdminUser, )
+
+    def get(self, request):
+        return Response(cache_respostas.estatisticas())
+
+    def delete(self, request):
+        cache_respostas.limpar()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class SincronizacaoView(APIView):
+    # Alterações do catálogo desde o último token (app/sincronizacao.py).
+    #   ?token=...     devolvido pela chamada anterior; sem ele, o catálogo inteiro
+    #   ?limite=N      objetos por página
+    permission_classes = (IsAuthenticated, )
+    renderer_classes = RENDERERS
+
+    def get(self, request):
+        config = sincronizacao.configuracao()
+        limite = ler_limite(request, config['MAXIMO_LIMITE'], padrao=config['LIMITE'])
+        if limite is None:
+            return Response({"detail": "Parâmetro 'limite' deve ser inteiro."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            return Response(sincronizacao.alteracoes(request.query_params.get('token'), limite, request))
+        except sincronizacao.TokenInvalido as erro:
+            return Response({"detail": str(erro)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class PacotesView(APIView):
+    # Versões guardadas do pacote offline dos totens (app/pacotes.py), da mais nova
+    permission_classes = (IsAuthenticated, )
+
+    def get(self, request):
+        return Response({'versoes': pacotes.versoes()})
+
+
+class PacoteView(APIView):
+    # Pacote completo ou, com ?desde=<versão>, só o que mudou desde ela. O
+    # conteúdo de um endereço nunca muda: cache imutável.
+    permission_classes = (IsAuthenticated, )
+
+    def get(self, request, versao):
+        desde = request.query_params.get('desde')
+        arquivo = pacotes.arquivo(versao, desde)
+        if arquivo is None:
+            return Response({"detail": "Versão não encontrada."}, status=status.HTTP_404_NOT_FOUND)
+
+        etag = f'"{desde}-{versao}"' if desde and desde != versao else f'"{versao}"'
+        resposta = get_conditional_response(request, etag=etag)
+        if resposta is None:
+            resposta = resposta_arquivo(request, open(arquivo, 'rb'), as_attachment=True, filename=arquivo.name)
+            resposta.headers['Content-Type'] = 'application/gzip'
+        resposta.headers['ETag'] = etag
+        patch_cache_control(resposta, private=True, max_age=365 * 24 * 3600, immutable=True)
+        return resposta
+
+
+class ExportacaoView(APIView):
+    # Eventos brutos em fluxo (app/exportacao.py), sem montar a resposta em memória.
+    #   ?formato=csv|ndjson|parquet   (padrão: ndjson)
+    #   ?inicio=...&fim=...           intervalo (data ou data e hora ISO)
+    #   ?cursor=...                   retoma depois da última linha recebida
+    #   ?depois=<data>,<id>           o mesmo, com a data e o id da última linha recebida
+    permission_classes = (IsAdminUser, )
+
+    def get(self, request, fonte):
+        params = request.query_params
+        datas = {}
+        for parametro in ('inicio', 'fim'):
+            if params.get(parametro):
+                datas[parametro] = ler_data(params[parametro])
+                if datas[parametro] is None:
+                    return Response({"detail": f"Data inválida em '{parametro}'."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            exportacao = Exportacao(
+                fonte, formato=params.get('formato', 'ndjson'), cursor=params.get('cursor'),
+                depois=params.get('depois'), **datas
+            )
+        except ValueError as erro:
+            return Response({"detail": str(erro)}, status=status.HTTP_400_BAD_REQUEST)
+
+        resposta = StreamingHttpResponse(em_fluxo(request, exportacao), content_type=exportacao.content_type)
+        resposta['Content-Disposition'] = f'attachment; filename="{exportacao.nome_arquivo}"'
+        return resposta
+
+
+class MetricasView(APIView):
+    # Lê apenas as tabelas de agregados (app/metricas.py), nunca os eventos brutos.
+    #   ?periodo=hora|dia        granularidade (padrão: dia)
+    #   ?inicio=...&fim=...      intervalo (data ou data e hora ISO)
+    #   ?<dimensão>=<valor>      filtra por uma dimensão
+    #   ?agrupar=d1,d2           mantém só essas dimensões, somando as demais
+    permission_classes = (IsAuthenticated, )
+    agregado = None
+    dimensoes = ()
+
+    def get(self, request):
+        params = request.query_params
+        periodo = params.get('periodo', 'dia')
+        if periodo not in metricas.PERIODOS:
+            return Response({"detail": "Período deve ser 'hora' ou 'dia'."}, status=status.HTTP_400_BAD_REQUEST)
+
+        agrupar = [d for d in params.get('agrupar', '').split(',') if d] or list(self.dimensoes)
+        if set(agrupar) - set(self.dimensoes):
+            return Response({"detail": f"Dimensões disponíveis: {', '.join(self.dimensoes)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.agregado.objects.filter(periodo=periodo)
+        for parametro, lookup in (('inicio', 'inicio__gte'), ('fim', 'inicio__lte')):
+            if params.get(parametro):
+                data = ler_data(params[parametro])
+                if data is None:
+                    return Response({"detail": f"Data inválida em '{parametro}'."}, status=status.HTTP_400_BAD_REQUEST)
+                queryset = queryset.filter(**{lookup: data})
+        for dimensao in self.dimensoes:
+            if params.get(dimensao):
+                valor = params[dimensao]
+                if self.agregado._meta.get_field(dimensao).is_relation:
+                    try:
+                        valor = int(valor)
+                    except ValueError:
+                        return Response({"detail": f"Parâmetro '{dimensao}' deve ser inteiro."}, status=status.HTTP_400_BAD_REQUEST)
+                queryset = queryset.filter(**{dimensao: valor})
+
+        linhas = (
+            queryset.values('inicio', *agrupar)
+            .annotate(total=Sum('total'))
+            .order_by('inicio', *agrupar)
+        )
+        return Response(list(linhas))
+
+
+class MetricasAcoesView(MetricasView):
+    agregado = AgregadoAcao
+    dimensoes = ('acao', 'loja', 'produto')
+
+
+class MetricasTotensView(MetricasView):
+    agregado = AgregadoTotem
+    dimensoes = ('tipo_usuario', 'faixa_etaria', 'genero', 'categoria')
+
+
+# Respostas em fluxo. No ASGI o Django lê um iterador síncrono inteiro para a
+# memória antes de enviar o primeiro byte (sync_to_async(list)); lá o conteúdo
+# vai como iterador assíncrono, um pedaço por ida a uma thread.
+
+def em_fluxo(request, conteudo):
+    # conteudo: iterável síncrono que também implementa __aiter__ (ex.: Exportacao)
+    return aiter(conteudo) if isinstance(request._request, ASGIRequest) else iter(conteudo)
+
+
+def resposta_arquivo(request, arquivo, **kwargs):
+    if not isinstance(request._request, ASGIRequest):
+        return FileResponse(arquivo, **kwargs)
+    resposta = FileResponse(ler_arquivo(arquivo), **kwargs)
+    # Content-Length, Content-Type e Content-Disposition, como no FileResponse de um arquivo
+    resposta.set_headers(arquivo)
+    return resposta
+
+
+async def ler_arquivo(arquivo, bloco=64 * 1024):
+    # as leituras não usam o banco: fora da thread dele
+    ler = sync_to_async(arquivo.read, thread_sensitive=False)
+    try:
+        while pedaco := await ler(bloco):
+            yield pedaco
+    finally:
+        arquivo.close()
+
+
+def ler_data(valor):
+    data = parse_datetime(valor)
+    if data is None:
+        dia = parse_date(valor)
+        if dia is None:
+            return None
+        data = datetime.combine(dia, time.min)
+    if timezone.is_naive(data):
+        data = timezone.make_aware(data)
+    return data
+
+
+def ler_limite(request, maximo=None, padrao=None):
+    # ?limite= das recomendações (até o TOP_K guardado), dos similares e das
+    # consultas de posição
+    maximo = maximo or recomendacao.configuracao()['TOP_K']
+    try:
+        return max(1, min(int(request.query_params.get('limite', padrao or maximo)), maximo))
+    except ValueError:
+        return None
+
+
+def ler_coordenadas(request, *nomes):
+    valores = []
+    for nome in nomes:
+        try:
+            valor = float(request.query_params[nome])
+        except (KeyError, ValueError):
+            valor = math.nan
+        if not math.isfinite(valor):
+            raise ValueError(f"Informe {', '.join(nomes)} numéricos (pixels do mapa).")
+        valores.append(valor)
+    return valores
+
+
+def ler_filtros_espaciais(request):
+    # ?setor= e ?categoria= das consultas de posição
+    filtros = {}
+    for nome in ('setor', 'categoria'):
+        valor = request.query_params.get(nome)
+        if valor:
+            if not valor.isdigit():
+                raise ValueError(f"Parâmetro '{nome}' deve ser inteiro.")
+            filtros[nome] = int(valor)
+    return filtros
+
+
+def posicao_loja(ponto):
+    return {'loja': ponto.loja, 'nome': ponto.nome, 'x': ponto.x, 'y': ponto.y}
+
+
+def ler_vizinhos(view, tipo):
+    # Ids parecidos com o item da URL, lidos do índice em mmap (app/similares.py);
+    # None quando o ?limite= é inválido
+    limite = ler_limite(view.request, similares.configuracao()['VIZINHOS'])
+    if limite is None:
+        return None
+    pk = view.pk_da_url()
+    return similares.indice_similares.vizinhos(tipo, pk, limite) if pk is not None else []
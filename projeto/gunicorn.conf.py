@@ -0,0 +1,36 @@
+import multiprocessing
+import os
+
+
+# Servidor de produção: gunicorn -c gunicorn.conf.py, na pasta do manage.py.
+#   SERVIDOR=wsgi  projeto.wsgi em workers gthread (padrão)
+#   SERVIDOR=asgi  projeto.asgi em workers do uvicorn, com as views async de
+#                  app/assincrono.py nas leituras mais frequentes
+#
+# No WSGI, algumas threads por worker cobrem a espera pelo banco sem
+# multiplicar a memória (cada worker tem o seu índice de busca e o seu cache
+# de respostas). No ASGI cada worker atende muitas conexões num só loop, mas o
+# ORM e as views síncronas ainda passam por uma thread por worker: um worker
+# por núcleo, mais um. WEB_CONCURRENCY, THREADS e PORT sobrepõem os padrões.
+# Comparação de latência e vazão dos dois modos: comando teste_carga.
+
+modo = os.environ.get('SERVIDOR', 'wsgi')
+nucleos = multiprocessing.cpu_count()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+if modo == 'asgi':
+    wsgi_app = 'projeto.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+    workers = int(os.environ.get('WEB_CONCURRENCY', nucleos + 1))
+else:
+    wsgi_app = 'projeto.wsgi:application'
+    worker_class = 'gthread'
+    workers = int(os.environ.get('WEB_CONCURRENCY', nucleos * 2 + 1))
+    threads = int(os.environ.get('THREADS', 4))
+
+keepalive = 5
+timeout = 30
+graceful_timeout = 30
+# recicla os workers aos poucos, sem reiniciar todos juntos
+max_requests = 5000
+max_requests_jitter = 500
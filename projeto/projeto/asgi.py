@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'projeto.settings')
+# leituras mais frequentes por views async (app/assincrono.py)
+os.environ.setdefault('VIEWS_ASSINCRONAS', '1')
 
 application = get_asgi_application()
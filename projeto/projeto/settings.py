@@ -122,4 +122,91 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
-}
\ No newline at end of file
+    'DEFAULT_PAGINATION_CLASS': 'app.paginacao.CursorPaginacao',
+    'PAGE_SIZE': 50,
+}
+
+# Fila de gravação de AcaoUsuario (app/eventos.py)
+ACOES_FILA = {
+    'TAMANHO_MAXIMO': 10000,
+    'LOTE': 500,
+    'INTERVALO': 1.0,
+}
+
+# Cache de respostas de leitura do catálogo (app/cache.py).
+# Para compartilhar entre workers: 'BACKEND': 'django' com um cache em CACHES (ex.: Redis)
+CACHE_RESPOSTAS = {
+    'BACKEND': 'local',
+    'CAPACIDADE': 2000,
+    'TTL': 60,
+}
+
+# Recomendações pré-calculadas (app/recomendacao.py)
+RECOMENDACOES = {
+    'TOP_K': 50,
+    'HISTORICO_DIAS': 90,
+}
+
+# Índices de itens parecidos (app/similares.py), montados por construir_similares
+SIMILARES = {
+    'DIRETORIO': BASE_DIR / 'indices',
+    'VIZINHOS': 20,
+}
+
+# Retenção de AcaoUsuario (app/retencao.py): meses mais antigos vão para arquivos
+# comprimidos pelo comando arquivar_acoes
+RETENCAO_ACOES = {
+    'MESES': 6,
+    'DIRETORIO': BASE_DIR / 'arquivo',
+    'LOTE': 5000,
+}
+
+# Variantes das imagens enviadas (app/imagens.py): tamanhos menores em WebP
+# (e AVIF, se o Pillow tiver suporte), geradas fora da requisição
+IMAGENS = {
+    'TAMANHOS': {'mini': 160, 'pequena': 480, 'media': 960, 'grande': 1920},
+    'FORMATOS': ('webp', 'avif'),
+    'QUALIDADE': 80,
+    'TRABALHADORES': 2,
+}
+
+# Mosaico dos mapas (app/mosaico.py): tiles WebP em vários zooms, gerados no
+# mesmo pool das variantes
+MOSAICO = {
+    'TAMANHO': 256,
+    'QUALIDADE': 80,
+}
+
+# Índice espacial das posições das lojas nos mapas (app/espacial.py)
+ESPACIAL = {
+    'VIZINHOS': 10,
+    'MAXIMO_VIZINHOS': 100,
+    'MAXIMO_REGIAO': 1000,
+}
+
+# Rotas a pé entre as lojas (app/rotas.py): grafos compilados pelo comando
+# compilar_rotas e sempre que os caminhos ou as posições mudam
+ROTAS = {
+    'DIRETORIO': BASE_DIR / 'rotas',
+    'MAXIMO_PARADAS': 30,
+}
+
+# Sincronização incremental do catálogo (app/sincronizacao.py); remoções mais
+# antigas que RETENCAO_DIAS são apagadas pelo comando limpar_remocoes
+SINCRONIZACAO = {
+    'MARGEM_SEGUNDOS': 5,
+    'LIMITE': 500,
+    'MAXIMO_LIMITE': 2000,
+    'RETENCAO_DIAS': 30,
+}
+
+# Pacotes offline do catálogo para os totens (app/pacotes.py), montados pelo
+# comando construir_pacote
+PACOTES = {
+    'DIRETORIO': BASE_DIR / 'pacotes',
+    'MANTER': 5,
+}
+
+# Views async das leituras mais frequentes (app/assincrono.py), ligadas pelo
+# projeto/asgi.py; no WSGI ficam as views síncronas do DRF
+VIEWS_ASSINCRONAS = os.environ.get('VIEWS_ASSINCRONAS') == '1'